@@ -0,0 +1,199 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Stream blocks from local fake Golos nodes which drop connections.
+
+Run from repository root::
+
+    python -m benchmarks.golos_stream --blocks 5000 --interval 0.001
+"""
+import argparse
+import asyncio
+import json
+import sys
+import typing
+from time import perf_counter
+
+from aiohttp import web
+from aiohttp import WSMsgType
+
+from src.escrow.blockchain.golos_stream import block_num
+from src.escrow.blockchain.golos_stream import GolosBlockStream
+from src.escrow.blockchain.golos_stream import SUBSCRIPTION_ID
+
+
+class FakeChain:
+    """Chain of blocks with transfer operations applied one by one."""
+
+    def __init__(self, ops_per_block: int):
+        """Create empty chain with ``ops_per_block`` transfers in each block."""
+        self.ops_per_block = ops_per_block
+        self.head = 0
+        self.applied = asyncio.Condition()
+
+    def block(self, number: int) -> typing.Dict[str, typing.Any]:
+        """Get block # ``number``."""
+        return {
+            "previous": f"{number - 1:08x}" + "0" * 32,
+            "timestamp": "2020-01-01T00:00:00",
+            "transactions": [
+                {
+                    "operations": [
+                        [
+                            "transfer",
+                            {
+                                "from": f"sender{index}",
+                                "to": "tellerbot",
+                                "amount": "1.000 GOLOS",
+                                "memo": f"{number} {index}",
+                            },
+                        ]
+                    ]
+                }
+                for index in range(self.ops_per_block)
+            ],
+        }
+
+    async def produce(self, count: int, interval: float) -> None:
+        """Apply ``count`` blocks every ``interval`` seconds."""
+        for _ in range(count):
+            async with self.applied:
+                self.head += 1
+                self.applied.notify_all()
+            await asyncio.sleep(interval)
+
+
+class FakeGolosNode:
+    """Websocket server answering block subscription and ``get_block``."""
+
+    def __init__(self, chain: FakeChain, drop_after: typing.Optional[int] = None):
+        """Serve ``chain`` and close connections after ``drop_after`` blocks."""
+        self.chain = chain
+        self.drop_after = drop_after
+        self.subscribed = asyncio.Event()
+        self._runner: typing.Optional[web.AppRunner] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start server on ``host`` and ``port`` and return its URL."""
+        app = web.Application()
+        app.router.add_get("/", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets  # type: ignore
+        return "ws://{}:{}/".format(*sockets[0].getsockname()[:2])
+
+    async def close(self) -> None:
+        """Stop server."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.WebSocketResponse:
+        """Handle websocket connection."""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        push: typing.Optional[asyncio.Task] = None
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    break
+                request_id = json.loads(message.data)["id"]
+                _, method, params = json.loads(message.data)["params"]
+                if method == "set_block_applied_callback" and push is None:
+                    push = asyncio.create_task(self._push(ws))
+                    self.subscribed.set()
+                elif method == "get_block":
+                    result = self.chain.block(int(params[0]))
+                    await ws.send_json({"id": request_id, "result": result})
+        finally:
+            if push is not None:
+                push.cancel()
+        return ws
+
+    async def _push(self, ws: web.WebSocketResponse) -> None:
+        number = self.chain.head
+        sent = 0
+        while self.drop_after is None or sent < self.drop_after:
+            async with self.chain.applied:
+                await self.chain.applied.wait_for(lambda: self.chain.head > number)
+            number += 1
+            block = self.chain.block(number)
+            await ws.send_json({"id": SUBSCRIPTION_ID, "result": block})
+            sent += 1
+        await ws.close()
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Stream ``args.blocks`` blocks and report throughput and gaps."""
+    chain = FakeChain(args.ops_per_block)
+    servers = [
+        FakeGolosNode(chain, drop_after=args.drop_after) for _ in range(args.nodes)
+    ]
+    nodes = [await server.start() for server in servers]
+    stream = GolosBlockStream(
+        nodes,
+        reconnect_delay=args.reconnect_delay,
+        max_reconnect_delay=args.reconnect_delay * 8,
+        heartbeat=30,
+    )
+    stream.start()
+    await servers[0].subscribed.wait()
+
+    start = perf_counter()
+    producer = asyncio.create_task(chain.produce(args.blocks, args.interval))
+    received: typing.Set[int] = set()
+    duplicates = 0
+    while len(received) < args.blocks:
+        try:
+            block = await asyncio.wait_for(stream.get(), args.timeout)
+        except asyncio.TimeoutError:
+            break
+        number = block_num(block)
+        if number in received:
+            duplicates += 1
+        received.add(number)
+    elapsed = perf_counter() - start
+
+    await producer
+    await stream.close()
+    for server in servers:
+        await server.close()
+
+    missing = args.blocks - len(received & set(range(1, args.blocks + 1)))
+    sys.stdout.write(
+        f"{len(received)} blocks in {elapsed:.3f} s, "
+        f"{len(received) / elapsed:.0f} blocks/s\n"
+        f"{stream.reconnects} reconnects, {missing} missing, "
+        f"{duplicates} duplicates\n"
+    )
+
+
+def main() -> None:
+    """Run benchmark with parameters from command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--blocks", type=int, default=5000)
+    parser.add_argument("--ops-per-block", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.001)
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--drop-after", type=int, default=1000)
+    parser.add_argument("--reconnect-delay", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Replay synthetic Golos blocks against queue of pending escrow offers.
+
+Run from repository root with escrow requirements installed::
+
+    python -m benchmarks.stream_queue --offers 10000 --blocks 1000
+"""
+import argparse
+import asyncio
+import sys
+import typing
+from decimal import Decimal
+from time import perf_counter
+from time import time
+
+from bson.objectid import ObjectId
+
+from src.escrow.blockchain import TransactionQueue
+from src.escrow.blockchain.golos_blockchain import GolosBlockchain
+
+
+def make_offers(count: int) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Create ``count`` queue members of pending offers."""
+    transaction_time = time() - 60
+    return [
+        {
+            "offer_id": ObjectId(),
+            "from_address": f"sender{index}",
+            "amount_with_fee": Decimal("10.050"),
+            "amount_without_fee": Decimal("10.000"),
+            "asset": "GOLOS",
+            "memo": f"escrow {index}",
+            "transaction_time": transaction_time,
+        }
+        for index in range(count)
+    ]
+
+
+def make_blocks(
+    offers: typing.Sequence[typing.Mapping[str, typing.Any]],
+    count: int,
+    ops_per_block: int,
+    matches_per_block: int,
+) -> typing.List[typing.List[typing.Dict[str, typing.Any]]]:
+    """Create ``count`` blocks of transfer operations.
+
+    Each block has ``matches_per_block`` transfers paying pending offers
+    spread among transfers from unrelated accounts, half of which are
+    sent to escrow address.
+    """
+    blocks = []
+    step = max(ops_per_block // max(matches_per_block, 1), 1)
+    paid = 0
+    for _ in range(count):
+        block = []
+        for index in range(ops_per_block):
+            if index % step == 0 and index // step < matches_per_block:
+                queue_member = offers[paid % len(offers)]
+                paid += 1
+                op = {
+                    "from": queue_member["from_address"],
+                    "to": GolosBlockchain.address,
+                    "amount": "10.000 GOLOS",
+                    "memo": queue_member["memo"],
+                }
+            else:
+                op = {
+                    "from": f"stranger{index}",
+                    "to": GolosBlockchain.address if index % 2 else "someone",
+                    "amount": "1.000 GOLOS",
+                    "memo": "",
+                }
+            block.append(op)
+        blocks.append(block)
+    return blocks
+
+
+async def replay(
+    blockchain: GolosBlockchain,
+    blocks: typing.Sequence[typing.Sequence[typing.Mapping[str, typing.Any]]],
+) -> int:
+    """Check every operation of ``blocks`` and return number of matches."""
+    matches = 0
+    for block_num, block in enumerate(blocks, 1):
+        for op in block:
+            if await blockchain._check_operation(op, block_num):
+                matches += 1
+    return matches
+
+
+def main() -> None:
+    """Run benchmark with parameters from command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--offers", type=int, default=10000)
+    parser.add_argument("--blocks", type=int, default=1000)
+    parser.add_argument("--ops-per-block", type=int, default=50)
+    parser.add_argument("--matches-per-block", type=int, default=5)
+    args = parser.parse_args()
+
+    offers = make_offers(args.offers)
+    blocks = make_blocks(
+        offers, args.blocks, args.ops_per_block, args.matches_per_block
+    )
+    blockchain = GolosBlockchain()
+    blockchain._queue = TransactionQueue(offers)
+
+    start = perf_counter()
+    matches = asyncio.run(replay(blockchain, blocks))
+    elapsed = perf_counter() - start
+
+    ops = args.blocks * args.ops_per_block
+    sys.stdout.write(
+        f"{args.offers} pending offers, {args.blocks} blocks, {ops} operations\n"
+        f"{matches} matches in {elapsed:.3f} s\n"
+        f"{elapsed / args.blocks * 1e6:.1f} us per block\n"
+        f"{elapsed / ops * 1e6:.2f} us per operation\n"
+    )
+
+
+if __name__ == "__main__":
+    main()
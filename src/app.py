@@ -14,6 +14,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+import argparse
 import asyncio
 import secrets
 
@@ -21,13 +22,22 @@ from aiogram.utils import executor
 
 from src import bot
 from src import handlers  # noqa: F401
+from src import indexes
+from src import migrations
 from src import notifications
 from src.bot import dp
 from src.bot import tg
 from src.config import config
 from src.database import database
+from src.database import preference_buffer
 from src.escrow import close_blockchains
 from src.escrow import connect_to_blockchains
+from src.geocoding import geocoder
+from src.keyboards import build_keyboards
+from src.log_sink import log_sink
+from src.metrics import metrics_reporter
+from src.order_book import order_book
+from src.subscriptions import subscription_index
 
 
 async def on_startup(webhook_path=None, *args):
@@ -38,16 +48,48 @@ async def on_startup(webhook_path=None, *args):
     await tg.delete_webhook()
     if webhook_path is not None:
         await tg.set_webhook("https://" + config.SERVER_HOST + webhook_path)
-    await database.users.create_index("referral_code", unique=True, sparse=True)
+    await indexes.reconcile(database)
+    await subscription_index.load()
+    build_keyboards()
+    await order_book.start()
     asyncio.create_task(notifications.run_loop())
     asyncio.create_task(connect_to_blockchains())
+    preference_buffer.start()
+    metrics_reporter.start()
+    if config.DATABASE_LOGGING_ENABLED:
+        log_sink.start()
+
+
+async def on_shutdown(*args):
+    """Clean up before stopping.
+
+    Close connections with blockchains and geocoder and save queued
+    preferences and logs.
+    """
+    await metrics_reporter.close()
+    await close_blockchains()
+    await geocoder.close()
+    await preference_buffer.close()
+    await log_sink.close()
 
 
 def main():
     """Start bot in webhook mode.
 
-    Bot's main entry point.
+    Bot's main entry point. With **explain** command line argument,
+    print query plans of registered query shapes instead. With
+    **migrate**, migrate existing documents to current schema.
     """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", nargs="?", choices=["explain", "migrate"])
+    args = parser.parse_args()
+    if args.command == "explain":
+        asyncio.get_event_loop().run_until_complete(indexes.explain(database))
+        return
+    if args.command == "migrate":
+        asyncio.get_event_loop().run_until_complete(migrations.migrate(database))
+        return
+
     bot.setup()
     if config.SET_WEBHOOK:
         url_token = secrets.token_urlsafe()
@@ -57,7 +99,7 @@ def main():
             dispatcher=dp,
             webhook_path=webhook_path,
             on_startup=lambda *args: on_startup(webhook_path, *args),
-            on_shutdown=lambda *args: close_blockchains(),
+            on_shutdown=on_shutdown,
             host=config.INTERNAL_HOST,
             port=config.SERVER_PORT,
         )
@@ -65,7 +107,7 @@ def main():
         executor.start_polling(
             dispatcher=dp,
             on_startup=lambda *args: on_startup(None, *args),
-            on_shutdown=lambda *args: close_blockchains(),
+            on_shutdown=on_shutdown,
         )
     print()  # noqa: T001  Executor stopped with ^C
 
@@ -17,6 +17,7 @@
 import asyncio
 import logging
 import typing
+from copy import deepcopy
 from time import time
 
 from aiogram import Bot
@@ -25,26 +26,50 @@ from aiogram.bot import api
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
 from aiogram.dispatcher import Dispatcher
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from pymongo import ReturnDocument
+from aiogram.utils.exceptions import RetryAfter
 
 from src.config import config
-from src.database import database
+from src.database import creator_snapshot
 from src.database import database_user
+from src.database import get_user
 from src.database import MongoStorage
+from src.database import user_update_buffer
+from src.database import UserUpdateBuffer
 from src.i18n import i18n
+from src.log_sink import log_sink
+from src.order_book import order_book
+from src.send_scheduler import send_scheduler
+
+#: Methods sending messages to chats which are subject to flood limits.
+RATE_LIMITED_METHODS = frozenset(
+    (
+        api.Methods.SEND_MESSAGE,
+        api.Methods.FORWARD_MESSAGE,
+        api.Methods.SEND_PHOTO,
+        api.Methods.SEND_DOCUMENT,
+        api.Methods.SEND_LOCATION,
+        api.Methods.SEND_VENUE,
+        api.Methods.SEND_CONTACT,
+        api.Methods.EDIT_MESSAGE_TEXT,
+        api.Methods.EDIT_MESSAGE_CAPTION,
+        api.Methods.EDIT_MESSAGE_REPLY_MARKUP,
+    )
+)
+#: Maximum number of retries of request after flood control error.
+MAX_RETRIES = 3
 
 
 class IncomingHistoryMiddleware(BaseMiddleware):
     """Middleware for storing incoming history."""
 
     async def trigger(self, action, args):
-        """Save incoming data in the database."""
+        """Queue incoming data to be saved in the database."""
         if (
             "update" not in action
             and "error" not in action
             and action.startswith("pre_process_")
         ):
-            await database.logs.insert_one(
+            await log_sink.put(
                 {
                     "direction": "in",
                     "type": action.split("pre_process_", 1)[1],
@@ -57,8 +82,27 @@ class TellerBot(Bot):
     """Custom bot class."""
 
     async def request(self, method, data=None, *args, **kwargs):
-        """Make a request and save it in the database."""
-        result = await super().request(method, data, *args, **kwargs)
+        """Make a request and queue it to be saved in the database.
+
+        Messages are sent through ``send_scheduler`` to stay within
+        Telegram limits and are retried on flood control errors.
+        """
+        chat_id = data.get("chat_id") if data else None
+        if method not in RATE_LIMITED_METHODS or chat_id is None:
+            result = await super().request(method, data, *args, **kwargs)
+        else:
+            retries = 0
+            while True:
+                await send_scheduler.acquire(chat_id)
+                try:
+                    result = await super().request(method, data, *args, **kwargs)
+                except RetryAfter as exception:
+                    if retries >= MAX_RETRIES:
+                        raise
+                    retries += 1
+                    send_scheduler.pause(exception.timeout)
+                else:
+                    break
         if (
             config.DATABASE_LOGGING_ENABLED
             and result
@@ -74,7 +118,7 @@ class TellerBot(Bot):
             # On requests Telegram either returns True on success or relevant object.
             # To store only useful information, method's payload is saved if result is
             # a boolean and result is saved otherwise.
-            await database.logs.insert_one(
+            await log_sink.put(
                 {
                     "direction": "out",
                     "type": method,
@@ -91,6 +135,8 @@ class DispatcherManual(Dispatcher):
         """Process update object with user availability in database check.
 
         If bot doesn't know the user, it pretends they sent /start message.
+        Writes to user's document made by FSM storage are sent to
+        database after update is processed.
         """
         user = None
         if update.message:
@@ -100,19 +146,8 @@ class DispatcherManual(Dispatcher):
             user = update.callback_query.from_user
             chat = update.callback_query.message.chat
         if user:
-            await database.users.update_many(
-                {"id": {"$ne": user.id}, "mention": user.mention},
-                {"$set": {"has_username": False}},
-            )
-            document = await database.users.find_one_and_update(
-                {"id": user.id, "chat": chat.id},
-                {
-                    "$set": {
-                        "mention": user.mention,
-                        "has_username": bool(user.username),
-                    }
-                },
-                return_document=ReturnDocument.AFTER,
+            document = await get_user(
+                user.id, chat.id, user.mention, bool(user.username)
             )
             if document is None:
                 if update.message:
@@ -130,7 +165,15 @@ class DispatcherManual(Dispatcher):
                             "text": "/start",
                         },
                     )
-            database_user.set(document)
+            database_user.set(deepcopy(document))
+            if document is not None:
+                order_book.update_creator(document["id"], creator_snapshot(document))
+                buffer = UserUpdateBuffer(document)
+                user_update_buffer.set(buffer)
+                try:
+                    return await super().process_update(update)
+                finally:
+                    await buffer.close()
         return await super().process_update(update)
 
 
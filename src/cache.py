@@ -0,0 +1,106 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""In-process caches."""
+import math
+import typing
+from collections import OrderedDict
+from time import monotonic
+
+KT = typing.TypeVar("KT")
+VT = typing.TypeVar("VT")
+
+
+class LRUCache(typing.Generic[KT, VT]):
+    """Least recently used cache with optional expiration of entries.
+
+    Entries expire ``ttl`` seconds after they were set regardless of
+    how often they are accessed, so cached values can't be older than
+    ``ttl``.
+    """
+
+    def __init__(self, maxsize: int, ttl: typing.Optional[float] = None):
+        """Create empty cache holding at most ``maxsize`` entries."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        #: Number of successful lookups.
+        self.hits = 0
+        #: Number of lookups of missing or expired keys.
+        self.misses = 0
+        self._data: "OrderedDict[KT, typing.Tuple[float, VT]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """Get number of entries including expired ones."""
+        return len(self._data)
+
+    def _lookup(self, key: KT) -> typing.Optional[typing.Tuple[float, VT]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[0] <= monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: KT, default: typing.Optional[VT] = None) -> typing.Optional[VT]:
+        """Get value of ``key`` and mark it as recently used."""
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def peek(self, key: KT, default: typing.Optional[VT] = None) -> typing.Optional[VT]:
+        """Get value of ``key`` without affecting its recency and statistics."""
+        entry = self._lookup(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key: KT, value: VT) -> None:  # noqa: A003
+        """Set value of ``key`` evicting least recently used entries if full."""
+        expires = math.inf if self.ttl is None else monotonic() + self.ttl
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: KT, default: typing.Optional[VT] = None) -> typing.Optional[VT]:
+        """Remove ``key`` and return its value."""
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def values(self) -> typing.Iterator[VT]:
+        """Iterate over values of unexpired entries."""
+        current_time = monotonic()
+        for expires, value in list(self._data.values()):
+            if expires > current_time:
+                yield value
+
+    def items(self) -> typing.Iterator[typing.Tuple[KT, VT]]:
+        """Iterate over keys and values of unexpired entries."""
+        current_time = monotonic()
+        for key, (expires, value) in list(self._data.items()):
+            if expires > current_time:
+                yield key, value
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._data.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        """Get ratio of successful lookups to all lookups."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
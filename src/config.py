@@ -24,6 +24,34 @@ DEFAULT_VALUES = {
     "DATABASE_PORT": 27017,
     "DATABASE_NAME": "tellerbot",
     "ESCROW_ENABLED": False,
+    "USER_CACHE_SIZE": 10000,
+    "USER_CACHE_TTL": 600,
+    "ORDER_RENDER_CACHE_SIZE": 10000,
+    "CREATOR_CACHE_TTL": 60,
+    "PREFERENCES_FLUSH_INTERVAL": 30,
+    "LOG_QUEUE_SIZE": 10000,
+    "LOG_BATCH_SIZE": 100,
+    "LOG_FLUSH_INTERVAL": 1,
+    "LOG_OVERFLOW_POLICY": "drop_oldest",
+    "METRICS_INTERVAL": 60,
+    "MESSAGES_PER_SECOND": 30,
+    "CHAT_MESSAGES_PER_SECOND": 1,
+    "CHAT_MESSAGES_BURST": 3,
+    "GEOCODER_URL": "https://nominatim.openstreetmap.org/search",
+    "GEOCODER_TIMEOUT": 10,
+    "LOCATION_CACHE_SIZE": 10000,
+    "LOCATION_CACHE_TTL": 30 * 24 * 60 * 60,
+    "ORDER_BOOK_RECONCILE_INTERVAL": 300,
+    "STREAM_RECONNECT_DELAY": 1,
+    "STREAM_MAX_RECONNECT_DELAY": 60,
+    "STREAM_HEARTBEAT": 30,
+    "BLOCKCHAIN_WORKERS": 4,
+    "BLOCKCHAIN_QUEUE_SIZE": 16,
+    "BLOCKCHAIN_SLOW_CALL": 10,
+    "LIB_POLL_INTERVAL": 3,
+    "TRANSACTION_CACHE_SIZE": 1000,
+    "TRANSACTION_CACHE_TTL": 60,
+    "HISTORY_PAGE_SIZE": 100,
 }
 
 
@@ -14,14 +14,24 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import logging
 import typing
 from contextvars import ContextVar
+from copy import deepcopy
 
+import pymongo
 from aiogram.dispatcher.storage import BaseStorage
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
 
+from src.cache import LRUCache
 from src.config import config
+from src.indexes import register_index
+from src.indexes import register_query
 
+log = logging.getLogger(__name__)
 
 try:
     with open(config.DATABASE_PASSWORD_FILENAME, "r") as password_file:
@@ -38,15 +48,392 @@ except (AttributeError, FileNotFoundError):
     client = AsyncIOMotorClient(config.DATABASE_HOST)
 database = client[config.DATABASE_NAME]
 
+#: Snapshot of document of user who sent currently processed update.
 database_user: ContextVar[typing.Mapping[str, typing.Any]] = ContextVar("database_user")
 
+#: Documents of recently active users mapped to their Telegram IDs.
+user_cache: LRUCache[int, typing.Dict[str, typing.Any]] = LRUCache(
+    config.USER_CACHE_SIZE, config.USER_CACHE_TTL
+)
+
+#: Snapshots of order creators mapped to their Telegram IDs.
+creator_cache: LRUCache[int, typing.Dict[str, typing.Any]] = LRUCache(
+    config.USER_CACHE_SIZE, config.CREATOR_CACHE_TTL
+)
+
+register_index("users", [("id", pymongo.ASCENDING)])
+register_index("users", [("mention", pymongo.ASCENDING)])
+register_query("users", "user", {"id": 0, "chat": 0})
+register_query("users", "mention", {"mention": "@username", "has_username": True})
+register_index("orders", [("creator.mention", pymongo.ASCENDING)])
+
+#: Update operators which can be applied to cached documents and buffered.
+UPDATE_OPERATORS = frozenset(["$set", "$unset"])
+
+
+def apply_update(
+    document: typing.MutableMapping[str, typing.Any],
+    update: typing.Mapping[str, typing.Mapping[str, typing.Any]],
+) -> bool:
+    """Apply ``$set`` and ``$unset`` operators of ``update`` to ``document``.
+
+    Dotted field names are resolved into embedded documents.
+
+    :return: False if ``update`` has other operators and ``document``
+        was left unchanged, True otherwise.
+    """
+    if not set(update) <= UPDATE_OPERATORS:
+        return False
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            *path, name = field.split(".")
+            embedded: typing.Optional[typing.MutableMapping] = document
+            for key in path:
+                if operator == "$set":
+                    embedded = embedded.setdefault(key, {})
+                else:
+                    embedded = embedded.get(key)
+                    if embedded is None:
+                        break
+            if embedded is None:
+                continue
+            if operator == "$set":
+                embedded[name] = value
+            else:
+                embedded.pop(name, None)
+    return True
+
+
+class UserUpdateBuffer:
+    """Writes to document of user made during processing of a single update.
+
+    Writes are merged into one update which is sent to database when
+    buffer is flushed.
+    """
+
+    def __init__(self, document: typing.Mapping[str, typing.Any]):
+        """Create empty buffer of writes to ``document``."""
+        self.document = document
+        self.update: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        self.closed = False
+
+    def merge(self, update: typing.Mapping[str, typing.Mapping[str, typing.Any]]):
+        """Merge ``$set`` and ``$unset`` operators of ``update`` into buffer.
+
+        Later writes override earlier writes to the same field, its
+        embedded fields and its parent fields, so merged update never
+        has conflicting paths.
+
+        :raises ValueError: If ``update`` has other operators.
+        """
+        if not set(update) <= UPDATE_OPERATORS:
+            raise ValueError(f"Can't buffer update with operators {list(update)}")
+        sets = self.update.setdefault("$set", {})
+        unsets = self.update.setdefault("$unset", {})
+        for operator, fields in update.items():
+            for field, value in fields.items():
+                for pending in (sets, unsets):
+                    for key in list(pending):
+                        if key == field or key.startswith(field + "."):
+                            del pending[key]
+                parent = next(
+                    (key for key in (*sets, *unsets) if field.startswith(key + ".")),
+                    None,
+                )
+                if parent is None:
+                    if operator == "$set":
+                        sets[field] = value
+                    else:
+                        unsets[field] = True
+                elif parent in sets:
+                    embedded = {parent: deepcopy(sets[parent])}
+                    apply_update(embedded, {operator: {field: value}})
+                    sets[parent] = embedded[parent]
+                elif operator == "$set":
+                    embedded = {}
+                    apply_update(embedded, {operator: {field: value}})
+                    del unsets[parent]
+                    sets[parent] = embedded[parent]
+
+    async def flush(self) -> None:
+        """Send merged update to database and empty buffer."""
+        update = {
+            operator: fields for operator, fields in self.update.items() if fields
+        }
+        self.update = {}
+        if update:
+            await database.users.update_one({"_id": self.document["_id"]}, update)
+
+    async def close(self) -> None:
+        """Flush buffer and make subsequent writes unbuffered."""
+        self.closed = True
+        await self.flush()
+
+
+user_update_buffer: ContextVar[UserUpdateBuffer] = ContextVar("user_update_buffer")
+
+
+def get_update_buffer(user_id: int) -> typing.Optional[UserUpdateBuffer]:
+    """Get open buffer of writes to user if they sent currently processed update."""
+    buffer = user_update_buffer.get(None)
+    if buffer is None or buffer.closed or buffer.document["id"] != user_id:
+        return None
+    return buffer
+
+
+def update_cached_user(
+    user_id: int, update: typing.Mapping[str, typing.Mapping[str, typing.Any]]
+) -> None:
+    """Reflect ``update`` of user's document in cache and open update buffer.
+
+    Must be called after every update of ``users`` collection which
+    is not made through ``update_user``. Snapshot in ``database_user``
+    is left unchanged, so handlers see document as it was before
+    processing of update.
+    """
+    document = user_cache.peek(user_id)
+    if document is not None and not apply_update(document, update):
+        user_cache.pop(user_id)
+    buffer = get_update_buffer(user_id)
+    if buffer is not None and buffer.document is not document:
+        apply_update(buffer.document, update)
+
+
+async def update_user(
+    user_id: int, update: typing.Mapping[str, typing.Mapping[str, typing.Any]]
+) -> None:
+    """Update document of user with Telegram ID ``user_id`` keeping cache in sync.
+
+    If there are buffered writes to the document, they are sent before
+    or in the same update to preserve order of writes.
+    """
+    buffer = get_update_buffer(user_id)
+    if buffer is not None and set(update) <= UPDATE_OPERATORS:
+        buffer.merge(update)
+        await buffer.flush()
+    else:
+        if buffer is not None:
+            await buffer.flush()
+        await database.users.update_one({"id": user_id}, update)
+    update_cached_user(user_id, update)
+
+
+class PreferenceBuffer:
+    """Display preferences of users written to database in batches.
+
+    Preferences are applied to cached documents of users immediately
+    and only the latest value of each preference is written every
+    ``flush_interval`` seconds, so toggling display doesn't cost a
+    write.
+    """
+
+    def __init__(self, flush_interval: float):
+        """Create empty buffer."""
+        self.flush_interval = flush_interval
+        self._pending: typing.Dict[int, typing.Dict[str, typing.Any]] = {}
+        #: Preferences which are being written.
+        self._flushing: typing.Dict[int, typing.Dict[str, typing.Any]] = {}
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def set(self, user_id: int, field: str, value: typing.Any) -> None:  # noqa: A003
+        """Set preference ``field`` of user ``user_id`` to ``value``."""
+        self._pending.setdefault(user_id, {})[field] = value
+        update_cached_user(user_id, {"$set": {field: value}})
+
+    def apply(self, document: typing.MutableMapping[str, typing.Any]) -> None:
+        """Apply unwritten preferences to ``document`` read from database."""
+        document.update(self._flushing.get(document["id"], {}))
+        document.update(self._pending.get(document["id"], {}))
+
+    async def flush(self) -> None:
+        """Write all pending preferences.
+
+        Preferences are applied to documents until they are written. If
+        write fails, they are written again on the next flush unless
+        they were set to newer values meanwhile.
+        """
+        if self._flushing or not self._pending:
+            return
+        self._flushing, self._pending = self._pending, {}
+        requests = [
+            UpdateOne({"id": user_id}, {"$set": fields})
+            for user_id, fields in self._flushing.items()
+        ]
+        written = False
+        try:
+            await database.users.bulk_write(requests, ordered=False)
+            written = True
+        except PyMongoError:
+            log.exception("Failed to write preferences of %d users", len(requests))
+        finally:
+            if not written:
+                for user_id, fields in self._flushing.items():
+                    self._pending[user_id] = {
+                        **fields,
+                        **self._pending.get(user_id, {}),
+                    }
+            self._flushing = {}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Start flushing buffer in background asynchronous task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop background flushing and write remaining preferences."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+preference_buffer = PreferenceBuffer(float(config.PREFERENCES_FLUSH_INTERVAL))
+
+
+def creator_snapshot(
+    user: typing.Mapping[str, typing.Any]
+) -> typing.Dict[str, typing.Any]:
+    """Get fields of ``user`` denormalized into their orders."""
+    return {"mention": user["mention"], "has_username": user.get("has_username", False)}
+
+
+async def load_creators(
+    user_ids: typing.Iterable[int],
+) -> typing.Dict[int, typing.Dict[str, typing.Any]]:
+    """Get snapshots of creators ``user_ids`` mapped to their Telegram IDs.
+
+    Creators which are not cached are read in one query.
+    """
+    creators = {}
+    missing = []
+    for user_id in set(user_ids):
+        creator = creator_cache.get(user_id)
+        if creator is None:
+            missing.append(user_id)
+        else:
+            creators[user_id] = creator
+    if missing:
+        cursor = database.users.find(
+            {"id": {"$in": missing}},
+            projection={
+                "_id": False,
+                "id": True,
+                "mention": True,
+                "has_username": True,
+            },
+        )
+        async for user in cursor:
+            creator = creator_snapshot(user)
+            creator_cache.set(user["id"], creator)
+            creators[user["id"]] = creator
+    return creators
+
+
+async def release_mention(user_id: int, mention: str) -> None:
+    """Clear ``has_username`` of users other than ``user_id`` with ``mention``.
+
+    Creator snapshots in orders and caches are updated along with users.
+    """
+    await database.users.update_many(
+        {"id": {"$ne": user_id}, "mention": mention},
+        {"$set": {"has_username": False}},
+    )
+    await database.orders.update_many(
+        {"user_id": {"$ne": user_id}, "creator.mention": mention},
+        {"$set": {"creator.has_username": False}},
+    )
+    for other in user_cache.values():
+        if other["id"] != user_id and other.get("mention") == mention:
+            other["has_username"] = False
+    for other_id, creator in list(creator_cache.items()):
+        if other_id != user_id and creator["mention"] == mention:
+            creator_cache.pop(other_id)
+
+
+async def get_user(
+    user_id: int, chat_id: int, mention: str, has_username: bool
+) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """Get document of user in chat and synchronize their mention.
+
+    Document is read from database only if it is not cached. It is
+    written only if ``mention`` or ``has_username`` changed. Other
+    users with the same mention lose ``has_username`` when document
+    is read from database, including when user is not registered yet
+    and is about to be inserted with ``mention``, and when ``mention``
+    of cached document changed. Creator snapshots in orders are updated
+    along with users.
+    """
+    document = user_cache.get(user_id)
+    loaded = document is None or document["chat"] != chat_id
+    if loaded:
+        document = await database.users.find_one({"id": user_id, "chat": chat_id})
+        if document is None:
+            await release_mention(user_id, mention)
+            return None
+        preference_buffer.apply(document)
+        user_cache.set(user_id, document)
+
+    mention_changed = document.get("mention") != mention
+    if loaded or mention_changed:
+        await release_mention(user_id, mention)
+    if not mention_changed and document.get("has_username") == has_username:
+        return document
+
+    update = {"$set": {"mention": mention, "has_username": has_username}}
+    await database.users.update_one({"_id": document["_id"]}, update)
+    apply_update(document, update)
+    creator = creator_snapshot(document)
+    await database.orders.update_many(
+        {"user_id": user_id}, {"$set": {"creator": creator}}
+    )
+    creator_cache.set(user_id, creator)
+    return document
+
 
 class MongoStorage(BaseStorage):
-    """MongoDB asynchronous storage for FSM using motor."""
+    """MongoDB asynchronous storage for FSM using motor.
+
+    State and data of user who sent currently processed update are read
+    from document of their update buffer. Writes to it are buffered
+    until update is processed.
+    """
+
+    async def _get_document(
+        self, user: int
+    ) -> typing.Optional[typing.Mapping[str, typing.Any]]:
+        buffer = get_update_buffer(user)
+        if buffer is not None:
+            return buffer.document
+        document = user_cache.peek(user)
+        if document is not None:
+            return document
+        document = await database.users.find_one({"id": user})
+        if document is not None:
+            preference_buffer.apply(document)
+        return document
+
+    async def _update(
+        self, user: int, update: typing.Mapping[str, typing.Mapping[str, typing.Any]]
+    ) -> None:
+        buffer = get_update_buffer(user)
+        if buffer is None:
+            await update_user(user, update)
+        else:
+            buffer.merge(update)
+            update_cached_user(user, update)
 
     async def get_state(self, user: int, **kwargs) -> typing.Optional[str]:
         """Get current state of user with Telegram ID ``user``."""
-        document = await database.users.find_one({"id": user})
+        document = await self._get_document(user)
         return document.get("state") if document else None
 
     async def set_state(
@@ -54,23 +441,23 @@ class MongoStorage(BaseStorage):
     ) -> None:
         """Set new state ``state`` of user with Telegram ID ``user``."""
         if state is None:
-            await database.users.update_one({"id": user}, {"$unset": {"state": True}})
+            await self._update(user, {"$unset": {"state": True}})
         else:
-            await database.users.update_one({"id": user}, {"$set": {"state": state}})
+            await self._update(user, {"$set": {"state": state}})
 
     async def get_data(self, user: int, **kwargs) -> typing.Dict:
         """Get state data of user with Telegram ID ``user``."""
-        document = await database.users.find_one({"id": user})
-        return document.get("data", {})
+        document = await self._get_document(user)
+        return deepcopy(document.get("data", {})) if document else {}
 
     async def set_data(
         self, user: int, data: typing.Optional[typing.Dict] = None, **kwargs
     ) -> None:
         """Set state data ``data`` of user with Telegram ID ``user``."""
         if data is None:
-            await database.users.update_one({"id": user}, {"$unset": {"data": True}})
+            await self._update(user, {"$unset": {"data": True}})
         else:
-            await database.users.update_one({"id": user}, {"$set": {"data": data}})
+            await self._update(user, {"$set": {"data": deepcopy(data)}})
 
     async def update_data(
         self, user: int, data: typing.Optional[typing.Dict] = None, **kwargs
@@ -79,9 +466,8 @@ class MongoStorage(BaseStorage):
         if data is None:
             data = {}
         data.update(kwargs)
-        await database.users.update_one(
-            {"id": user},
-            {"$set": {f"data.{key}": value for key, value in data.items()}},
+        await self._update(
+            user, {"$set": {f"data.{key}": value for key, value in data.items()}}
         )
 
     async def reset_state(self, user: int, with_data: bool = True, **kwargs):
@@ -89,7 +475,7 @@ class MongoStorage(BaseStorage):
         update = {"$unset": {"state": True}}
         if with_data:
             update["$unset"]["data"] = True
-        await database.users.update_one({"id": user}, update)
+        await self._update(user, update)
 
     async def finish(self, user: int, **kwargs):
         """Finish conversation with user."""
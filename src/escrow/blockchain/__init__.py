@@ -20,6 +20,7 @@ from abc import ABC
 from abc import abstractmethod
 from asyncio import create_task
 from asyncio import get_running_loop
+from asyncio import Task
 from decimal import Decimal
 from time import time
 
@@ -30,8 +31,11 @@ from aiogram.utils import markdown
 from bson.objectid import ObjectId
 
 from src.bot import tg
+from src.cache import LRUCache
 from src.config import config
 from src.database import database
+from src.escrow.blockchain.executor import BlockchainExecutor
+from src.escrow.blockchain.irreversible import IrreversibleBlockWatcher
 from src.i18n import i18n
 
 
@@ -57,6 +61,10 @@ class BaseBlockchain(ABC):
     #: contain ``{}`` which gets replaced with transaction id.
     explorer: str = "{}"
 
+    _executor: typing.Optional[BlockchainExecutor] = None
+    _irreversible: typing.Optional[IrreversibleBlockWatcher] = None
+    _transaction_cache: typing.Optional[LRUCache[typing.Hashable, bool]] = None
+
     @abstractmethod
     async def connect(self) -> None:
         """Establish connection with blockchain node."""
@@ -103,6 +111,13 @@ class BaseBlockchain(ABC):
         :return: URL to transaction in blockchain explorer.
         """
 
+    @abstractmethod
+    async def get_last_irreversible_block(self) -> typing.Optional[int]:
+        """Get number of last irreversible block from node.
+
+        :return: Block number or None if node didn't provide it.
+        """
+
     @abstractmethod
     async def is_block_confirmed(
         self, block_num: int, op: typing.Mapping[str, typing.Any]
@@ -110,6 +125,8 @@ class BaseBlockchain(ABC):
         """Check if block # ``block_num`` has ``op`` after confirmation.
 
         Check block on blockchain-specific conditions to consider it confirmed.
+        Use ``self.irreversible`` to wait for block to become irreversible
+        and ``self.transaction_cache`` to cache result of search for ``op``.
 
         :param block_num: Number of block to check.
         :param op: Operation to check.
@@ -117,6 +134,35 @@ class BaseBlockchain(ABC):
 
     async def close(self):
         """Close connection with blockchain node."""
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._irreversible is not None:
+            self._irreversible.close()
+
+    @property
+    def executor(self) -> BlockchainExecutor:
+        """Get thread pool for blocking calls of node client library."""
+        if self._executor is None:
+            self._executor = BlockchainExecutor(self.name)
+        return self._executor
+
+    @property
+    def irreversible(self) -> IrreversibleBlockWatcher:
+        """Get watcher of last irreversible block shared by confirmations."""
+        if self._irreversible is None:
+            self._irreversible = IrreversibleBlockWatcher(
+                self.get_last_irreversible_block, config.LIB_POLL_INTERVAL
+            )
+        return self._irreversible
+
+    @property
+    def transaction_cache(self) -> LRUCache[typing.Hashable, bool]:
+        """Get cache of results of search for operations in blocks."""
+        if self._transaction_cache is None:
+            self._transaction_cache = LRUCache(
+                config.TRANSACTION_CACHE_SIZE, config.TRANSACTION_CACHE_TTL
+            )
+        return self._transaction_cache
 
     @property
     def nodes(self) -> typing.List[str]:
@@ -137,6 +183,17 @@ class BaseBlockchain(ABC):
     async def create_queue(self) -> typing.List[typing.Dict[str, typing.Any]]:
         """Create queue from unconfirmed transactions in database."""
         queue: typing.List[typing.Dict[str, typing.Any]] = []
+        for queue_member in await self.get_pending_transactions():
+            scheduled_queue_member = await self.schedule_timeout(queue_member)
+            if scheduled_queue_member:
+                queue.append(scheduled_queue_member)
+        return queue
+
+    async def get_pending_transactions(
+        self,
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Get unconfirmed transactions in database without scheduling timeouts."""
+        transactions: typing.List[typing.Dict[str, typing.Any]] = []
         cursor = database.escrow.find(
             {
                 "escrow": {"$in": list(self.assets)},
@@ -160,12 +217,12 @@ class BaseBlockchain(ABC):
                 "memo": offer["memo"],
                 "transaction_time": offer["transaction_time"],
             }
-            scheduled_queue_member = await self.schedule_timeout(queue_member)
-            if scheduled_queue_member:
-                queue.append(scheduled_queue_member)
-        return queue
+            transactions.append(queue_member)
+        return transactions
 
-    def get_min_time(self, queue: typing.List[typing.Dict[str, typing.Any]]) -> float:
+    def get_min_time(
+        self, queue: typing.Iterable[typing.Dict[str, typing.Any]]
+    ) -> float:
         """Get timestamp of earliest transaction from ``queue``."""
         return min(queue, key=lambda q: q["transaction_time"])["transaction_time"]
 
@@ -348,10 +405,97 @@ class BaseBlockchain(ABC):
         await tg.send_message(user["id"], answer, parse_mode=ParseMode.MARKDOWN)
 
 
+class TransactionQueue:
+    """Queue of transactions waiting to be found in blockchain.
+
+    Members are indexed by ``offer_id`` and by sender address with memo,
+    so operations from block are matched with a few dictionary lookups
+    instead of scanning every pending transaction.
+    """
+
+    def __init__(
+        self, members: typing.Iterable[typing.Dict[str, typing.Any]] = ()
+    ) -> None:
+        """Create queue with ``members``."""
+        self._members: typing.Dict[ObjectId, typing.Dict[str, typing.Any]] = {}
+        self._senders: typing.Dict[
+            str, typing.Dict[ObjectId, typing.Dict[str, typing.Any]]
+        ] = {}
+        self._memos: typing.Dict[
+            typing.Tuple[str, str], typing.Dict[ObjectId, typing.Dict[str, typing.Any]]
+        ] = {}
+        for queue_member in members:
+            self.add(queue_member)
+
+    def __len__(self) -> int:
+        """Get number of transactions in queue."""
+        return len(self._members)
+
+    def __iter__(self) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+        """Iterate over transactions in order they were added."""
+        return iter(list(self._members.values()))
+
+    def add(self, queue_member: typing.Dict[str, typing.Any]) -> None:
+        """Add ``queue_member`` to queue replacing transaction of the same offer."""
+        offer_id = queue_member["offer_id"]
+        self.remove(offer_id)
+        sender = queue_member["from_address"].lower()
+        self._members[offer_id] = queue_member
+        self._senders.setdefault(sender, {})[offer_id] = queue_member
+        self._memos.setdefault((sender, queue_member["memo"]), {})[
+            offer_id
+        ] = queue_member
+
+    def remove(
+        self, offer_id: ObjectId
+    ) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """Remove transaction of offer ``offer_id`` from queue.
+
+        :return: Removed queue member or None if it's not in queue.
+        """
+        queue_member = self._members.pop(offer_id, None)
+        if queue_member is None:
+            return None
+        sender = queue_member["from_address"].lower()
+        for index, key in (
+            (self._senders, sender),
+            (self._memos, (sender, queue_member["memo"])),
+        ):
+            bucket = index[key]
+            del bucket[offer_id]
+            if not bucket:
+                del index[key]
+        return queue_member
+
+    def candidates(
+        self, from_address: str, memo: str
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Get transactions which could be sent by ``from_address``.
+
+        Transactions with the same ``memo`` go first, so that transfer
+        is checked against offer it was made for before other offers of
+        the same sender.
+        """
+        sender = from_address.lower()
+        members = self._senders.get(sender)
+        if not members:
+            return []
+        exact = self._memos.get((sender, memo), {})
+        if len(exact) == len(members):
+            return list(exact.values())
+        return [
+            *exact.values(),
+            *(member for key, member in members.items() if key not in exact),
+        ]
+
+
 class StreamBlockchain(BaseBlockchain):
     """Blockchain node client supporting continuous stream to check transaction."""
 
-    _queue: typing.List[typing.Dict[str, typing.Any]] = []
+    def __init__(self) -> None:
+        """Create empty queue of transactions."""
+        self._queue = TransactionQueue()
+        self._stream_task: typing.Optional[Task] = None
 
     def remove_from_queue(
         self, offer_id: ObjectId
@@ -359,15 +503,12 @@ class StreamBlockchain(BaseBlockchain):
         """Remove transaction with specified ``offer_id`` value from ``self._queue``.
 
         :param offer_id: ``_id`` of escrow offer.
-        :return: True if transaction was found and False otherwise.
+        :return: Removed queue member or None if transaction wasn't found.
         """
-        for queue_member in self._queue:
-            if queue_member["offer_id"] == offer_id:
-                if "timeout_handler" in queue_member:
-                    queue_member["timeout_handler"].cancel()
-                self._queue.remove(queue_member)
-                return queue_member
-        return None
+        queue_member = self._queue.remove(offer_id)
+        if queue_member is not None and "timeout_handler" in queue_member:
+            queue_member["timeout_handler"].cancel()
+        return queue_member
 
     def check_timeout(self, offer_id: ObjectId) -> None:
         self.remove_from_queue(offer_id)
@@ -386,18 +527,22 @@ class StreamBlockchain(BaseBlockchain):
         """
 
     def start_streaming(self) -> None:
-        """Start streaming in background asynchronous task."""
-        create_task(self.stream())
+        """Start streaming in background asynchronous task if not streaming yet."""
+        if self._stream_task is None or self._stream_task.done():
+            self._stream_task = create_task(self.stream())
 
     async def add_to_queue(self, **kwargs):
         """Add transaction to self._queue to be checked.
 
-        Same parameters as in ``self.check_transaction``.
+        Same parameters as in ``self.check_transaction``. Transaction of
+        the same offer which is already in queue is replaced and its
+        timeout is cancelled.
         """
+        self.remove_from_queue(kwargs["offer_id"])
         queue_member = await self.schedule_timeout(kwargs)
         if not queue_member:
             return
-        self._queue.append(queue_member)
+        self._queue.add(queue_member)
         # Start streaming if not already streaming
         if len(self._queue) == 1:
             self.start_streaming()
@@ -16,10 +16,10 @@
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
 import json
 import typing
-from asyncio import sleep
-from calendar import timegm
+from asyncio import Lock
 from datetime import datetime
 from datetime import timedelta
+from datetime import timezone
 from decimal import Decimal
 from urllib.parse import urljoin
 
@@ -30,12 +30,13 @@ from eospy.keys import EOSKey
 from eospy.utils import sig_digest
 
 from src.config import config
+from src.database import database
 from src.escrow.blockchain import BaseBlockchain
 from src.escrow.blockchain import BlockchainConnectionError
 from src.escrow.blockchain import InsuranceLimits
+from src.escrow.blockchain import TransactionQueue
 from src.escrow.blockchain import TransferError
 
-
 TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
 
 
@@ -97,6 +98,12 @@ class CyberWayTransaction(types.Transaction):
         )
 
 
+def parse_time(block_time: str) -> float:
+    """Convert UTC time of block to timestamp."""
+    date = datetime.fromisoformat(block_time)
+    return date.replace(tzinfo=timezone.utc).timestamp()
+
+
 class CyberBlockchain(BaseBlockchain):
     """Golos node client implementation for escrow exchange."""
 
@@ -106,6 +113,7 @@ class CyberBlockchain(BaseBlockchain):
     explorer = "https://explorer.cyberway.io/trx/{}"
 
     async def connect(self):
+        self._history_lock = Lock()
         self._session = aiohttp.ClientSession(
             raise_for_status=True, timeout=aiohttp.ClientTimeout(total=30)
         )
@@ -121,13 +129,14 @@ class CyberBlockchain(BaseBlockchain):
         else:
             raise BlockchainConnectionError("Couldn't connect to any node")
 
-        queue = await self.create_queue()
-        if not queue:
-            return
-        await self._check_queue_in_history(queue)
+        await self._check_queue_in_history(await self.create_queue(), startup=True)
 
     async def check_transaction(self, **kwargs) -> bool:
-        return await self._check_queue_in_history([kwargs])
+        await self._check_queue_in_history()
+        offer = await database.escrow.find_one(
+            {"_id": kwargs["offer_id"]}, projection={"trx_id": True}
+        )
+        return offer is not None and "trx_id" in offer
 
     async def get_limits(self, asset: str):
         return InsuranceLimits(Decimal("10000"), Decimal("100000"))
@@ -180,28 +189,31 @@ class CyberBlockchain(BaseBlockchain):
             raise TransferError
         return self.trx_url(result["transaction_id"])
 
+    async def get_last_irreversible_block(self):
+        info = await self._api("v1/chain/get_info")
+        return info["last_irreversible_block_num"]
+
     async def is_block_confirmed(self, block_num, op):
-        while True:
+        await self.irreversible.wait(block_num)
+        key = (op["trx_id"], block_num)
+        is_found = self.transaction_cache.get(key)
+        if is_found is None:
             try:
-                info = await self._api("v1/chain/get_info")
+                await self._api(
+                    "v1/history/get_transaction",
+                    data={"id": op["trx_id"], "block_num_hint": block_num},
+                )
             except aiohttp.ClientResponseError:
-                continue
-            if block_num <= info["last_irreversible_block_num"]:
-                break
-            await sleep(3)
-        try:
-            await self._api(
-                "v1/history/get_transaction",
-                data={"id": op["trx_id"], "block_num_hint": block_num},
-            )
-        except aiohttp.ClientResponseError:
-            return False
-        else:
-            return True
+                is_found = False
+            else:
+                is_found = True
+            self.transaction_cache.set(key, is_found)
+        return is_found
 
     async def close(self):
         if hasattr(self, "_session"):
             await self._session.close()
+        await super().close()
 
     async def _api(
         self,
@@ -246,58 +258,145 @@ class CyberBlockchain(BaseBlockchain):
         addresses = await self._resolve_addresses([address])
         return addresses[address]
 
-    async def _check_queue_in_history(
-        self,
-        queue: typing.List[typing.Dict[str, typing.Any]],
-    ) -> bool:
-        addresses = [queue_member["from_address"].lower() for queue_member in queue]
-        resolved = await self._resolve_addresses(addresses)
-        for queue_member, address in zip(queue, addresses):
-            queue_member["from_address"] = resolved[address]
-
-        pos = -1
-        min_time = self.get_min_time(queue)
-        while True:
+    async def _get_head_action_seq(self) -> typing.Optional[int]:
+        history = await self._api(
+            "v1/history/get_actions",
+            data={"account_name": self.address, "pos": -1, "offset": -1},
+        )
+        if not history["actions"]:
+            return None
+        return max(act["account_action_seq"] for act in history["actions"])
+
+    async def _find_action_seq(self, timestamp: float, low: int = 0) -> int:
+        """Find position of the first action made at or after ``timestamp``.
+
+        Account history is binary searched by block time between ``low``
+        and head, requesting one action per step.
+        """
+        head = await self._get_head_action_seq()
+        if head is None:
+            return low
+        high = head + 1
+        while low < high:
+            middle = (low + high) // 2
             history = await self._api(
                 "v1/history/get_actions",
-                data={"account_name": self.address, "pos": pos, "offset": -20},
+                data={"account_name": self.address, "pos": middle, "offset": 0},
             )
-            if not history["actions"]:
-                return False
-            for act in reversed(history["actions"]):
-                if act["action_trace"]["act"]["name"] != "transfer":
-                    continue
-                date = datetime.strptime(act["block_time"], TIME_FORMAT)
-                if timegm(date.timetuple()) < min_time:
-                    return False
-                op = act["action_trace"]["act"]["data"]
-                op["timestamp"] = act["block_time"]
-                op["trx_id"] = act["action_trace"]["trx_id"]
-                req = await self._check_operation(op, act["block_num"], queue)
-                if not req:
-                    continue
-                await self._confirmation_callback(
-                    req["offer_id"], op, op["trx_id"], act["block_num"]
+            actions = history["actions"]
+            if actions and parse_time(actions[0]["block_time"]) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    async def _check_queue_in_history(
+        self,
+        queue: typing.Optional[typing.List[typing.Dict[str, typing.Any]]] = None,
+        *,
+        startup: bool = False,
+    ) -> None:
+        """Match actions after saved history cursor with pending transactions.
+
+        Actions are scanned forward in pages of ``HISTORY_PAGE_SIZE`` and
+        position of the last scanned action is saved after every page,
+        so every action is checked only once. If action matched pending
+        transaction which wasn't confirmed, cursor is saved before it
+        instead, so it's checked again while transaction is pending.
+        Scan on ``startup`` or without saved cursor starts from the first
+        action made after the earliest pending transaction was requested.
+
+        :param queue: Pending transactions. Loaded from database if None.
+        """
+        async with self._history_lock:
+            cursor = await database.history_cursors.find_one({"_id": self.name})
+            pos = cursor["seq"] + 1 if cursor else 0
+            if queue is None:
+                queue = await self.get_pending_transactions()
+            if not queue:
+                if cursor is None or startup:
+                    head = await self._get_head_action_seq()
+                    if head is not None:
+                        await self._save_history_cursor(head)
+                return
+            if cursor is None or startup:
+                pos = await self._find_action_seq(self.get_min_time(queue), pos)
+
+            addresses = [queue_member["from_address"].lower() for queue_member in queue]
+            resolved = await self._resolve_addresses(addresses)
+            for queue_member, address in zip(queue, addresses):
+                queue_member["from_address"] = resolved[address]
+            transactions = TransactionQueue(queue)
+
+            unresolved = None
+            while True:
+                history = await self._api(
+                    "v1/history/get_actions",
+                    data={
+                        "account_name": self.address,
+                        "pos": pos,
+                        "offset": config.HISTORY_PAGE_SIZE - 1,
+                    },
                 )
-                if len(queue) == 1:
-                    return True
-            pos = history["actions"][0]["account_action_seq"] - 1
+                actions = history["actions"]
+                for act in actions:
+                    if act["action_trace"]["act"]["name"] != "transfer":
+                        continue
+                    op = act["action_trace"]["act"]["data"]
+                    op["timestamp"] = act["block_time"]
+                    op["trx_id"] = act["action_trace"]["trx_id"]
+                    candidates = self._get_candidates(op, transactions)
+                    if not candidates:
+                        continue
+                    req = await self._check_operation(op, act["block_num"], candidates)
+                    if req and await self._confirmation_callback(
+                        req["offer_id"], op, op["trx_id"], act["block_num"]
+                    ):
+                        transactions.remove(req["offer_id"])
+                        if "timeout_handler" in req:
+                            req["timeout_handler"].cancel()
+                    elif unresolved is None:
+                        unresolved = act["account_action_seq"]
+                if not actions:
+                    break
+                pos = actions[-1]["account_action_seq"] + 1
+                if unresolved is None:
+                    await self._save_history_cursor(pos - 1)
+                if len(actions) < config.HISTORY_PAGE_SIZE or not transactions:
+                    break
+            if unresolved is not None:
+                await self._save_history_cursor(unresolved - 1)
+
+    async def _save_history_cursor(self, seq: int) -> None:
+        await database.history_cursors.update_one(
+            {"_id": self.name}, {"$set": {"seq": seq}}, upsert=True
+        )
+
+    def _get_candidates(
+        self, op: typing.Mapping[str, typing.Any], queue: TransactionQueue
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Get pending transactions which could be made with ``op``.
+
+        Transactions are candidates if ``op`` was sent from their address
+        to escrow address after transaction was requested.
+        """
+        if op["to"] != self.address:
+            return []
+        candidates = queue.candidates(op["from"], op["memo"])
+        if not candidates or "timestamp" not in op:
+            return candidates
+        op_time = parse_time(op["timestamp"])
+        return [req for req in candidates if op_time >= req["transaction_time"]]
 
     async def _check_operation(
         self,
         op: typing.Mapping[str, typing.Any],
         block_num: int,
-        queue: typing.List[typing.Dict[str, typing.Any]],
+        candidates: typing.Iterable[typing.Dict[str, typing.Any]],
     ):
         op_amount, asset = op["quantity"].split()
         amount = Decimal(op_amount)
-        for req in queue:
-            if "timestamp" in op:
-                date = datetime.strptime(op["timestamp"], TIME_FORMAT)
-                if timegm(date.timetuple()) < req["transaction_time"]:
-                    continue
-            if op["to"] != self.address or op["from"] != req["from_address"]:
-                continue
+        for req in candidates:
             req_asset = req["asset"]
             if "." in req_asset:
                 req_asset = req_asset.split(".")[1]
@@ -0,0 +1,176 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Bounded thread pool for blocking calls of blockchain client libraries."""
+import asyncio
+import logging
+import typing
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from src.config import config
+
+log = logging.getLogger(__name__)
+
+T = typing.TypeVar("T")
+
+
+class ExecutorStats(typing.NamedTuple):
+    """Snapshot of executor instrumentation."""
+
+    #: Number of calls waiting in event loop for place in executor queue.
+    waiting: int
+    #: Number of calls waiting in executor queue for free worker.
+    queued: int
+    #: Number of calls running in workers.
+    running: int
+    #: Number of finished calls.
+    calls: int
+    #: Number of calls which raised exception.
+    errors: int
+    #: Average time between submission and start of call in seconds.
+    average_wait: float
+    #: Average duration of call in seconds.
+    average_duration: float
+    #: Longest duration of call in seconds.
+    max_duration: float
+
+
+class _Call:
+    """Timing of call submitted to worker thread."""
+
+    __slots__ = ("name", "submitted", "started", "finished")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.submitted = monotonic()
+        #: Set by worker thread when call starts and finishes.
+        self.started: typing.Optional[float] = None
+        self.finished: typing.Optional[float] = None
+
+
+class BlockchainExecutor:
+    """Thread pool of ``workers`` threads named after blockchain ``name``.
+
+    At most ``workers + queue_size`` calls are submitted to threads at a
+    time. Other calls wait in event loop, so a stalled node can't grow
+    executor queue indefinitely or occupy threads used by the rest of
+    the bot.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        workers: typing.Optional[int] = None,
+        queue_size: typing.Optional[int] = None,
+        slow_call: typing.Optional[float] = None,
+    ):
+        """Create executor which logs calls longer than ``slow_call`` seconds.
+
+        Missing arguments are taken from config.
+        """
+        self.name = name
+        self.workers = config.BLOCKCHAIN_WORKERS if workers is None else workers
+        self.queue_size = (
+            config.BLOCKCHAIN_QUEUE_SIZE if queue_size is None else queue_size
+        )
+        self.slow_call = config.BLOCKCHAIN_SLOW_CALL if slow_call is None else slow_call
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+        self._slots: typing.Optional[asyncio.Semaphore] = None
+        self._in_flight: typing.Set[_Call] = set()
+        self._waiting = 0
+        self._calls = 0
+        self._errors = 0
+        self._total_wait = 0.0
+        self._total_duration = 0.0
+        self._max_duration = 0.0
+
+    @property
+    def stats(self) -> ExecutorStats:
+        """Get current instrumentation values."""
+        running = sum(call.started is not None for call in self._in_flight)
+        calls = self._calls or 1
+        return ExecutorStats(
+            waiting=self._waiting,
+            queued=len(self._in_flight) - running,
+            running=running,
+            calls=self._calls,
+            errors=self._errors,
+            average_wait=self._total_wait / calls,
+            average_duration=self._total_duration / calls,
+            max_duration=self._max_duration,
+        )
+
+    async def run(self, func: typing.Callable[..., T], *args, **kwargs) -> T:
+        """Call ``func`` with ``args`` and ``kwargs`` in worker thread."""
+        if self._executor is None or self._slots is None:
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix=self.name
+            )
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+        call = _Call(getattr(func, "__name__", repr(func)))
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight.add(call)
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(self._call, call, func, *args, **kwargs)
+        future.add_done_callback(
+            lambda future: loop.call_soon_threadsafe(self._finish, call, future)
+        )
+        return await asyncio.wrap_future(future)
+
+    @staticmethod
+    def _call(call: _Call, func: typing.Callable[..., T], *args, **kwargs) -> T:
+        call.started = monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            call.finished = monotonic()
+
+    def _finish(self, call: _Call, future: Future) -> None:
+        self._in_flight.discard(call)
+        if self._slots is not None:
+            self._slots.release()
+        if call.started is None or call.finished is None:
+            return
+        duration = call.finished - call.started
+        self._calls += 1
+        if future.cancelled() or future.exception() is not None:
+            self._errors += 1
+        self._total_wait += call.started - call.submitted
+        self._total_duration += duration
+        self._max_duration = max(self._max_duration, duration)
+        if duration >= self.slow_call:
+            log.warning(
+                "%s call %s took %.1f s (%d waiting, %d queued, %d running)",
+                self.name,
+                call.name,
+                duration,
+                *self.stats[:3],
+            )
+
+    def shutdown(self) -> None:
+        """Shut down worker threads without waiting for running calls."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._slots = None
+            self._in_flight.clear()
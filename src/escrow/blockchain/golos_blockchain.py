@@ -14,11 +14,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
-import functools
-import json
 import typing
-from asyncio import get_running_loop
-from asyncio import sleep
 from calendar import timegm
 from datetime import datetime
 from decimal import Decimal
@@ -32,7 +28,10 @@ from golos.exceptions import TransactionNotFound
 from src.escrow.blockchain import BlockchainConnectionError
 from src.escrow.blockchain import InsuranceLimits
 from src.escrow.blockchain import StreamBlockchain
+from src.escrow.blockchain import TransactionQueue
 from src.escrow.blockchain import TransferError
+from src.escrow.blockchain.golos_stream import block_num as get_block_num
+from src.escrow.blockchain.golos_stream import GolosBlockStream
 
 
 class GolosBlockchain(StreamBlockchain):
@@ -44,27 +43,23 @@ class GolosBlockchain(StreamBlockchain):
     explorer = "https://golos.cf/tx/?={}"
 
     async def connect(self):
-        loop = get_running_loop()
-        connect_to_node = functools.partial(Api, nodes=self.nodes)
         try:
-            self._golos = await loop.run_in_executor(None, connect_to_node)
-            self._stream = await loop.run_in_executor(None, connect_to_node)
-            self._stream.rpc.api_total["set_block_applied_callback"] = "database_api"
+            self._golos = await self.executor.run(Api, nodes=self.nodes)
         except RetriesExceeded as exception:
             raise BlockchainConnectionError(exception)
+        self._block_stream = GolosBlockStream(self.nodes)
 
-        queue = await self.create_queue()
+        queue = TransactionQueue(await self.create_queue())
         if not queue:
             return
         min_time = self.get_min_time(queue)
 
-        func = functools.partial(
+        history = await self.executor.run(
             self._golos.get_account_history,
             self.address,
             op_limit="transfer",
             age=int(time() - min_time),
         )
-        history = await get_running_loop().run_in_executor(None, func)
         for op in history:
             req = await self._check_operation(op, op["block"], queue)
             if not req:
@@ -73,10 +68,11 @@ class GolosBlockchain(StreamBlockchain):
                 req["offer_id"], op, op["trx_id"], op["block"]
             )
             if is_confirmed:
-                queue.remove(req)
+                queue.remove(req["offer_id"])
                 if not queue:
                     return
-        self._queue.extend(queue)
+        for queue_member in queue:
+            self._queue.add(queue_member)
 
     async def get_limits(self, asset: str):
         limits = {"GOLOS": InsuranceLimits(Decimal("10000"), Decimal("100000"))}
@@ -84,8 +80,7 @@ class GolosBlockchain(StreamBlockchain):
 
     async def transfer(self, to: str, amount: Decimal, asset: str, memo: str = ""):
         try:
-            transaction = await get_running_loop().run_in_executor(
-                None,
+            transaction = await self.executor.run(
                 self._golos.transfer,
                 to.lower(),
                 amount,
@@ -98,17 +93,14 @@ class GolosBlockchain(StreamBlockchain):
             raise TransferError
         return self.trx_url(transaction["id"])
 
+    async def get_last_irreversible_block(self):
+        properties = await self.executor.run(self._golos.get_dynamic_global_properties)
+        if properties:
+            return properties["last_irreversible_block_num"]
+        return None
+
     async def is_block_confirmed(self, block_num, op):
-        loop = get_running_loop()
-        while True:
-            properties = await loop.run_in_executor(
-                None, self._golos.get_dynamic_global_properties
-            )
-            if properties:
-                head_block_num = properties["last_irreversible_block_num"]
-                if block_num <= head_block_num:
-                    break
-            await sleep(3)
+        await self.irreversible.wait(block_num)
         op = {
             "block": block_num,
             "type_op": "transfer",
@@ -117,61 +109,66 @@ class GolosBlockchain(StreamBlockchain):
             "amount": op["amount"],
             "memo": op["memo"],
         }
-        try:
-            await loop.run_in_executor(None, self._golos.find_op_transaction, op)
-        except TransactionNotFound:
-            return False
-        else:
-            return True
+        key = tuple(op.values())
+        is_found = self.transaction_cache.get(key)
+        if is_found is None:
+            try:
+                await self.executor.run(self._golos.find_op_transaction, op)
+            except TransactionNotFound:
+                is_found = False
+            else:
+                is_found = True
+            self.transaction_cache.set(key, is_found)
+        return is_found
 
     async def stream(self):
-        loop = get_running_loop()
-        block = await loop.run_in_executor(
-            None, self._stream.rpc.call, "set_block_applied_callback", [0]
-        )
-        while True:
+        self._block_stream.start()
+        while self._queue:
+            block = await self._block_stream.get()
+            block_num = get_block_num(block)
             for trx in block["transactions"]:
                 for op_type, op in trx["operations"]:
                     if op_type != "transfer":
                         continue
-                    block_num = int(block["previous"][:8], 16) + 1
                     req = await self._check_operation(op, block_num)
                     if not req:
                         continue
-                    trx_id = await loop.run_in_executor(
-                        None, self._golos.get_transaction_id, trx
+                    trx_id = await self.executor.run(
+                        self._golos.get_transaction_id, trx
                     )
                     is_confirmed = await self._confirmation_callback(
                         req["offer_id"], op, trx_id, block_num
                     )
                     if is_confirmed:
-                        self._queue.remove(req)
-            if not self._queue:
-                await loop.run_in_executor(None, self._stream.rpc.close)
-                return
-            while True:
-                response = await loop.run_in_executor(None, self._stream.rpc.ws.recv)
-                response_json = json.loads(response)
-                if "error" not in response_json:
-                    break
-            block = response_json["result"]
+                        self._queue.remove(req["offer_id"])
+        self._block_stream.stop()
+
+    async def close(self):
+        if hasattr(self, "_block_stream"):
+            await self._block_stream.close()
+        await super().close()
 
     async def _check_operation(
         self,
         op: typing.Mapping[str, typing.Any],
         block_num: int,
-        queue: typing.Optional[typing.List] = None,
+        queue: typing.Optional[TransactionQueue] = None,
     ):
+        if op["to"] != self.address:
+            return None
         if queue is None:
             queue = self._queue
+        candidates = queue.candidates(op["from"], op["memo"])
+        if not candidates:
+            return None
+        op_time = None
+        if "timestamp" in op:
+            date = datetime.strptime(op["timestamp"], "%Y-%m-%dT%H:%M:%S")
+            op_time = timegm(date.timetuple())
         op_amount, asset = op["amount"].split()
         amount = Decimal(op_amount)
-        for req in queue:
-            if "timestamp" in op:
-                date = datetime.strptime(op["timestamp"], "%Y-%m-%dT%H:%M:%S")
-                if timegm(date.timetuple()) < req["transaction_time"]:
-                    continue
-            if op["to"] != self.address or op["from"] != req["from_address"].lower():
+        for req in candidates:
+            if op_time is not None and op_time < req["transaction_time"]:
                 continue
             if "timeout_handler" in req:
                 req["timeout_handler"].cancel()
@@ -0,0 +1,189 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Asynchronous subscription to blocks applied on Golos nodes."""
+import asyncio
+import itertools
+import json
+import logging
+import typing
+
+import aiohttp
+
+from src.config import config
+
+log = logging.getLogger(__name__)
+
+Block = typing.Dict[str, typing.Any]
+
+#: JSON-RPC ID of block subscription request. Node sends every applied
+#: block with the same ID.
+SUBSCRIPTION_ID = 0
+
+
+def block_num(block: typing.Mapping[str, typing.Any]) -> int:
+    """Get number of ``block`` from ID of previous block."""
+    return int(block["previous"][:8], 16) + 1
+
+
+def rpc_request(request_id: int, method: str, params: typing.List) -> Block:
+    """Create JSON-RPC request to method of ``database_api``."""
+    return {
+        "id": request_id,
+        "method": "call",
+        "jsonrpc": "2.0",
+        "params": ["database_api", method, params],
+    }
+
+
+class GolosBlockStream:
+    """Subscription to applied blocks kept alive across ``nodes``.
+
+    Blocks are read in background task into queue, so slow consumer
+    doesn't stop websocket from answering heartbeats. When connection
+    is lost, the next node is tried after exponentially growing delay
+    and blocks applied while reconnecting are requested with
+    ``get_block``.
+    """
+
+    #: Maximum number of missed blocks requested after reconnection.
+    BACKFILL_LIMIT = 100
+
+    def __init__(
+        self,
+        nodes: typing.Sequence[str],
+        *,
+        reconnect_delay: typing.Optional[float] = None,
+        max_reconnect_delay: typing.Optional[float] = None,
+        heartbeat: typing.Optional[float] = None,
+    ):
+        """Create stream from ``nodes`` which reconnects after ``reconnect_delay``.
+
+        Delay is doubled after each failed connection up to
+        ``max_reconnect_delay``. Missing arguments are taken from config.
+        """
+        self.nodes = list(nodes)
+        self.reconnect_delay = (
+            config.STREAM_RECONNECT_DELAY
+            if reconnect_delay is None
+            else reconnect_delay
+        )
+        self.max_reconnect_delay = (
+            config.STREAM_MAX_RECONNECT_DELAY
+            if max_reconnect_delay is None
+            else max_reconnect_delay
+        )
+        self.heartbeat = config.STREAM_HEARTBEAT if heartbeat is None else heartbeat
+        #: URL of node stream is connected to.
+        self.url: typing.Optional[str] = None
+        #: Number of connections made after losing previous one.
+        self.reconnects = 0
+        self._blocks: "asyncio.Queue[Block]" = asyncio.Queue()
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+        self._task: typing.Optional[asyncio.Task] = None
+        self._last_block_num: typing.Optional[int] = None
+        self._missing: typing.Set[int] = set()
+
+    def start(self) -> None:
+        """Subscribe to blocks in background task if not subscribed yet."""
+        if self._task is None:
+            if self._session is None:
+                self._session = aiohttp.ClientSession()
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        """Unsubscribe from blocks and drop blocks which weren't read."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._blocks = asyncio.Queue()
+        self._last_block_num = None
+        self._missing.clear()
+
+    async def close(self) -> None:
+        """Unsubscribe from blocks and close HTTP session."""
+        task = self._task
+        self.stop()
+        if task is not None:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(self) -> Block:
+        """Wait for the next applied block."""
+        return await self._blocks.get()
+
+    async def _run(self) -> None:
+        delay = self.reconnect_delay
+        for url in itertools.cycle(self.nodes):
+            self.url = url
+            try:
+                if await self._listen(url):
+                    delay = self.reconnect_delay
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as error:
+                log.warning("Golos block stream from %s failed: %r", url, error)
+            else:
+                log.warning("Golos node %s closed block stream", url)
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _listen(self, url: str) -> bool:
+        """Read blocks from ``url`` until connection is closed.
+
+        :return: True if any block was received and False otherwise.
+        """
+        assert self._session is not None  # nosec
+        received = False
+        request_ids = itertools.count(SUBSCRIPTION_ID + 1)
+        async with self._session.ws_connect(url, heartbeat=self.heartbeat) as ws:
+            await ws.send_json(
+                rpc_request(SUBSCRIPTION_ID, "set_block_applied_callback", [0])
+            )
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                response = json.loads(message.data)
+                if "error" in response:
+                    log.warning("Golos node %s responded with error: %s", url, response)
+                    continue
+                block = response.get("result")
+                if not isinstance(block, dict) or "previous" not in block:
+                    continue
+                received = True
+                number = block_num(block)
+                if response.get("id") != SUBSCRIPTION_ID:
+                    if number in self._missing:
+                        self._missing.discard(number)
+                        self._blocks.put_nowait(block)
+                    continue
+                last = self._last_block_num
+                if last is not None:
+                    if number <= last:
+                        continue
+                    missed = range(max(last + 1, number - self.BACKFILL_LIMIT), number)
+                    for missed_num in missed:
+                        self._missing.add(missed_num)
+                        await ws.send_json(
+                            rpc_request(next(request_ids), "get_block", [missed_num])
+                        )
+                self._last_block_num = number
+                self._blocks.put_nowait(block)
+        return received
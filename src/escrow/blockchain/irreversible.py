@@ -0,0 +1,99 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Shared watcher of last irreversible block of blockchain."""
+import asyncio
+import heapq
+import logging
+import typing
+
+log = logging.getLogger(__name__)
+
+
+class IrreversibleBlockWatcher:
+    """Last irreversible block number polled by a single task.
+
+    Coroutines waiting for blocks to become irreversible share one
+    polling loop, which runs only while someone is waiting. Waiters of
+    the same block share a future, and futures are woken in order of
+    block numbers, so every poll wakes all ready waiters at once.
+    """
+
+    def __init__(
+        self,
+        fetch: typing.Callable[[], typing.Awaitable[typing.Optional[int]]],
+        interval: float,
+    ):
+        """Create watcher polling ``fetch`` every ``interval`` seconds.
+
+        :param fetch: Coroutine function returning number of last
+            irreversible block or None if node didn't provide it.
+        """
+        self._fetch = fetch
+        self.interval = interval
+        #: Number of last irreversible block known to watcher.
+        self.last_irreversible = 0
+        self._waiters: typing.Dict[int, asyncio.Future] = {}
+        self._heap: typing.List[int] = []
+        self._task: typing.Optional[asyncio.Task] = None
+
+    async def wait(self, block_num: int) -> None:
+        """Wait until block # ``block_num`` becomes irreversible."""
+        if block_num <= self.last_irreversible:
+            return
+        future = self._waiters.get(block_num)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[block_num] = future
+            heapq.heappush(self._heap, block_num)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        # Cancelled waiter shouldn't cancel future of other waiters.
+        await asyncio.shield(future)
+
+    def close(self) -> None:
+        """Stop polling and cancel waiters."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for future in self._waiters.values():
+            future.cancel()
+        self._waiters.clear()
+        self._heap.clear()
+
+    def _update(self, last_irreversible: int) -> None:
+        self.last_irreversible = max(self.last_irreversible, last_irreversible)
+        while self._heap and self._heap[0] <= self.last_irreversible:
+            future = self._waiters.pop(heapq.heappop(self._heap))
+            if not future.done():
+                future.set_result(None)
+
+    async def _run(self) -> None:
+        try:
+            while self._waiters:
+                try:
+                    last_irreversible = await self._fetch()
+                except Exception as error:
+                    log.warning("Can't get last irreversible block: %r", error)
+                else:
+                    if last_irreversible is not None:
+                        self._update(last_irreversible)
+                if not self._waiters:
+                    break
+                await asyncio.sleep(self.interval)
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
@@ -0,0 +1,245 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Asynchronous geocoding of location names."""
+import asyncio
+import logging
+import typing
+import unicodedata
+from abc import ABC
+from abc import abstractmethod
+from datetime import datetime
+
+import aiohttp
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import PyMongoError
+
+from src.cache import LRUCache
+from src.config import config
+from src.database import database
+from src.indexes import register_index
+from src.indexes import register_query
+
+log = logging.getLogger(__name__)
+
+Location = typing.Dict[str, str]
+
+register_index(
+    "locations",
+    [("q", pymongo.ASCENDING), ("lang", pymongo.ASCENDING)],
+    unique=True,
+)
+register_index(
+    "locations",
+    [("date", pymongo.ASCENDING)],
+    expireAfterSeconds=config.LOCATION_CACHE_TTL,
+)
+register_query("locations", "location", {"q": "query", "lang": "en"})
+
+
+def normalize_query(query: str) -> str:
+    """Normalize unicode form, case and whitespace of ``query``."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class GeocodingError(Exception):
+    """Geocoding service didn't respond with results."""
+
+
+class GeocodingBackend(ABC):
+    """Geocoding service API."""
+
+    @abstractmethod
+    async def search(
+        self, session: aiohttp.ClientSession, query: str, language: str
+    ) -> typing.List[Location]:
+        """Find locations matching ``query``.
+
+        :return: List of locations with ``display_name``, ``lat`` and
+            ``lon`` keys.
+        """
+
+
+class NominatimBackend(GeocodingBackend):
+    """Backend of Nominatim API or compatible service at ``url``."""
+
+    def __init__(self, url: str, limit: int = 10):
+        """Create backend returning at most ``limit`` locations."""
+        self.url = url
+        self.limit = limit
+
+    async def search(
+        self, session: aiohttp.ClientSession, query: str, language: str
+    ) -> typing.List[Location]:
+        """Find locations matching ``query`` with names in ``language``."""
+        params = {
+            "q": query,
+            "format": "json",
+            "accept-language": language,
+            "limit": str(self.limit),
+        }
+        async with session.get(self.url, params=params) as response:
+            results = await response.json(content_type=None)
+        return [
+            {
+                "display_name": result["display_name"],
+                "lat": result["lat"],
+                "lon": result["lon"],
+            }
+            for result in results[: self.limit]
+        ]
+
+
+class GeocodeCache:
+    """Cache of geocoding results in collection with in-process LRU cache.
+
+    Documents are expired by TTL index on their ``date``.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, maxsize: int, ttl: float):
+        """Create cache in ``collection`` with ``maxsize`` entries kept in memory."""
+        self.collection = collection
+        self.local: LRUCache[typing.Tuple[str, str], typing.List[Location]] = LRUCache(
+            maxsize, ttl
+        )
+        #: Number of lookups found in collection.
+        self.hits = 0
+        #: Number of lookups found neither in memory nor in collection.
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Get ratio of lookups found in memory or collection to all lookups."""
+        lookups = self.local.hits + self.local.misses
+        return (self.local.hits + self.hits) / lookups if lookups else 0.0
+
+    async def get(
+        self, query: str, language: str
+    ) -> typing.Optional[typing.List[Location]]:
+        """Get cached results of normalized ``query`` in ``language``."""
+        key = (query, language)
+        results = self.local.get(key)
+        if results is not None:
+            return results
+        document = await self.collection.find_one(
+            {"q": query, "lang": language}, projection={"results": True}
+        )
+        if document is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.local.set(key, document["results"])
+        return document["results"]
+
+    async def set(  # noqa: A003
+        self, query: str, language: str, results: typing.List[Location]
+    ) -> None:
+        """Cache ``results`` of normalized ``query`` in ``language``."""
+        self.local.set((query, language), results)
+        await self.collection.update_one(
+            {"q": query, "lang": language},
+            {"$set": {"results": results, "date": datetime.utcnow()}},
+            upsert=True,
+        )
+
+
+class Geocoder:
+    """Client of geocoding backend.
+
+    Requests are made with shared HTTP session. Queries are normalized
+    and looked up in ``cache`` first. Concurrent searches of the same
+    query in the same language wait for a single request.
+    """
+
+    def __init__(
+        self,
+        backend: GeocodingBackend,
+        timeout: float,
+        cache: typing.Optional[GeocodeCache] = None,
+    ):
+        """Create client of ``backend`` with request ``timeout`` in seconds."""
+        self.backend = backend
+        self.timeout = timeout
+        self.cache = cache
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+        self._in_flight: typing.Dict[
+            typing.Tuple[str, str], "asyncio.Future[typing.List[Location]]"
+        ] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"User-Agent": "TellerBot"},
+                raise_for_status=True,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _search(self, query: str, language: str) -> typing.List[Location]:
+        try:
+            results = await self.backend.search(self._get_session(), query, language)
+        except (
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            ValueError,
+            KeyError,
+            TypeError,
+        ) as error:
+            # Key and type errors are raised by backends parsing
+            # malformed results.
+            raise GeocodingError(repr(error)) from error
+        if self.cache is not None:
+            try:
+                await self.cache.set(query, language, results)
+            except PyMongoError as error:
+                log.warning("Can't cache geocoding results of %r: %r", query, error)
+        return results
+
+    async def search(self, query: str, language: str) -> typing.List[Location]:
+        """Find locations matching ``query`` with names in ``language``.
+
+        :raises GeocodingError: If backend failed to respond or
+            responded with malformed results.
+        """
+        query = normalize_query(query)
+        if self.cache is not None:
+            results = await self.cache.get(query, language)
+            if results is not None:
+                return results
+
+        key = (query, language)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._search(query, language))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def close(self) -> None:
+        """Close HTTP session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+geocoder = Geocoder(
+    NominatimBackend(config.GEOCODER_URL),
+    float(config.GEOCODER_TIMEOUT),
+    GeocodeCache(
+        database.locations, config.LOCATION_CACHE_SIZE, config.LOCATION_CACHE_TTL
+    ),
+)
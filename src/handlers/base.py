@@ -14,16 +14,20 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+import base64
+import binascii
 import math
 import typing
 from datetime import datetime
 from decimal import Decimal
 from time import time
 
+import pymongo
 from aiogram import types
 from aiogram.utils import markdown
 from aiogram.utils.emoji import emojize
-from pymongo.cursor import Cursor
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
 
 from src.config import config
 from src.escrow import get_escrow_instance
@@ -35,11 +39,25 @@ from src.bot import (  # noqa: F401, noreorder
     state_handlers,
 )
 from src.bot import tg
-from src.database import database, database_user
+from src.cache import LRUCache
+from src.database import database, database_user, update_user
+from src.database import load_creators
+from src.database import preference_buffer
 from src.i18n import i18n
+from src.indexes import register_index
+from src.indexes import register_query
+from src.keyboards import cached_keyboard
 from src.money import normalize
+from src.order_book import active_filter
+from src.order_book import AFTER
+from src.order_book import BEFORE
+from src.order_book import BookFilter
+from src.order_book import FROM
+from src.order_book import is_active
+from src.order_book import order_book
 
 
+@cached_keyboard()
 def start_keyboard() -> types.ReplyKeyboardMarkup:
     """Create reply keyboard with main menu."""
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
@@ -83,48 +101,203 @@ async def inline_control_buttons(
     return buttons
 
 
+#: Sort key of orders from the newest to the oldest.
+NEWEST_FIRST = (("start_time", pymongo.DESCENDING), ("_id", pymongo.DESCENDING))
+
+register_index(
+    "orders", [("start_time", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+)
+register_query(
+    "orders",
+    "book",
+    active_filter(0),
+    NEWEST_FIRST,
+)
+
+
+class OrdersQuery(typing.NamedTuple):
+    """Query to orders collection sorted by unique key.
+
+    Sort key must end with ``_id``, so that every order has distinct
+    position in list which pages can be anchored to.
+    """
+
+    #: Filter of orders.
+    match: typing.Mapping[str, typing.Any]
+    #: Fields of sort key with their directions.
+    sort: typing.Sequence[typing.Tuple[str, int]] = NEWEST_FIRST
+    #: Equivalent filter of active orders if query can be answered by book.
+    book_filter: typing.Optional[BookFilter] = None
+
+
+def encode_anchor(kind: str, order_id: ObjectId) -> str:
+    """Encode anchor of page to order ``order_id`` into callback data argument."""
+    return kind + base64.urlsafe_b64encode(order_id.binary).decode()
+
+
+def decode_anchor(anchor: str) -> typing.Optional[typing.Tuple[str, ObjectId]]:
+    """Decode anchor encoded with ``encode_anchor``.
+
+    :return: Anchor kind and order ID or None if anchor is invalid.
+    """
+    if anchor[:1] not in (AFTER, BEFORE, FROM):
+        return None
+    try:
+        return anchor[0], ObjectId(base64.urlsafe_b64decode(anchor[1:]))
+    except (binascii.Error, InvalidId, TypeError):
+        return None
+
+
+def keyset_filter(
+    orders_query: OrdersQuery, values: typing.Mapping[str, typing.Any], kind: str
+) -> typing.Dict[str, typing.Any]:
+    """Get filter of orders positioned relative to sort key ``values`` by ``kind``."""
+    branches = []
+    for i, (field, direction) in enumerate(orders_query.sort):
+        ascending = (direction == pymongo.ASCENDING) != (kind == BEFORE)
+        operator = "$gt" if ascending else "$lt"
+        if kind == FROM and i == len(orders_query.sort) - 1:
+            operator += "e"
+        conditions = [
+            {previous: {"$eq": values[previous]}}
+            for previous, _ in orders_query.sort[:i]
+        ]
+        conditions.append({field: {operator: values[field]}})
+        branches.append({"$and": conditions})
+    return {"$or": branches}
+
+
+async def orders_page(
+    orders_query: OrdersQuery, start: int, anchor: typing.Optional[str] = None
+) -> typing.Tuple[typing.List[typing.Mapping[str, typing.Any]], int]:
+    """Get page of orders and quantity of all orders in query.
+
+    Page and quantity are computed in one aggregation, in which sorted
+    orders are passed to ``$facet`` with page and count pipelines.
+    Page is positioned relative to order in ``anchor`` if it still
+    exists and has all fields of sort key, so only orders of the page
+    are returned. Otherwise, first ``start`` orders are skipped.
+
+    Queries with book filter are answered by order book once it is
+    loaded.
+    """
+    decoded_anchor = decode_anchor(anchor) if anchor and start > 0 else None
+    if orders_query.book_filter is not None:
+        book_page = order_book.page(orders_query.book_filter, start, decoded_anchor)
+        if book_page is not None:
+            return book_page
+
+    page_pipeline: typing.List[typing.Dict[str, typing.Any]] = []
+    backward = False
+    if decoded_anchor is not None:
+        kind, order_id = decoded_anchor
+        anchor_order = await database.orders.find_one({"_id": order_id})
+        # Orders which weren't migrated can lack sort fields, and other
+        # such orders can't be positioned relative to them.
+        if anchor_order and all(
+            field in anchor_order for field, _ in orders_query.sort
+        ):
+            page_pipeline.append(
+                {"$match": keyset_filter(orders_query, anchor_order, kind)}
+            )
+            backward = kind == BEFORE
+    if not page_pipeline and start > 0:
+        page_pipeline.append({"$skip": start})
+    page_pipeline.append({"$limit": config.ORDERS_COUNT})
+
+    # Count doesn't depend on order, so backward page is taken from
+    # reversed sort, which can still use the same index.
+    sort = {
+        field: -direction if backward else direction
+        for field, direction in orders_query.sort
+    }
+    cursor = database.orders.aggregate(
+        [
+            {"$match": orders_query.match},
+            {"$sort": sort},
+            {
+                "$facet": {
+                    "orders": page_pipeline,
+                    "quantity": [{"$count": "quantity"}],
+                }
+            },
+        ]
+    )
+    result = (await cursor.to_list(length=1))[0]
+    orders = result["orders"]
+    if backward:
+        orders.reverse()
+    quantity = result["quantity"][0]["quantity"] if result["quantity"] else 0
+    return orders, quantity
+
+
+def page_callback_data(
+    buttons_data: str, start: int, invert: bool, anchor: typing.Optional[str] = None
+) -> str:
+    """Get callback data of button showing page of orders.
+
+    Anchor is omitted if it doesn't fit in callback data.
+    """
+    data = "{} {} {}".format(buttons_data, start, 1 if invert else 0)
+    if anchor is not None:
+        anchored_data = f"{data} {anchor}"
+        if len(anchored_data.encode()) <= 64:
+            return anchored_data
+    return data
+
+
 async def orders_list(
-    cursor: Cursor,
+    orders_query: OrdersQuery,
     chat_id: int,
     start: int,
-    quantity: int,
     buttons_data: str,
     user_id: typing.Optional[int] = None,
     message_id: typing.Optional[int] = None,
     invert: typing.Optional[bool] = None,
-) -> None:
+    anchor: typing.Optional[str] = None,
+) -> bool:
     """Send list of orders.
 
-    :param cursor: Cursor of MongoDB query to orders.
+    :param orders_query: Query to orders.
     :param chat_id: Telegram ID of current chat.
     :param start: Start index.
-    :param quantity: Quantity of orders in cursor.
     :param buttons_data: Beginning of callback data of left/right buttons.
-    :param user_id: Telegram ID of current user if cursor is not user-specific.
+    :param user_id: Telegram ID of current user if query is not user-specific.
     :param message_id: Telegram ID of message to edit.
     :param invert: Invert all prices.
+    :param anchor: Anchor of page encoded with ``encode_anchor``.
+    :return: False if there are no orders starting from ``start`` and
+        nothing was sent, True otherwise.
     """
+    orders, quantity = await orders_page(orders_query, start, anchor)
+    if start >= quantity > 0:
+        return False
+
     user = database_user.get()
     if invert is None:
         invert = user.get("invert_book", False)
     else:
-        await database.users.update_one(
-            {"_id": user["_id"]}, {"$set": {"invert_book": invert}}
-        )
+        preference_buffer.set(user["id"], "invert_book", invert)
 
     keyboard = types.InlineKeyboardMarkup(row_width=min(config.ORDERS_COUNT // 2, 8))
 
     inline_orders_buttons = (
         types.InlineKeyboardButton(
             emojize(":arrow_left:"),
-            callback_data="{} {} {}".format(
-                buttons_data, start - config.ORDERS_COUNT, 1 if invert else 0
+            callback_data=page_callback_data(
+                buttons_data,
+                start - config.ORDERS_COUNT,
+                invert,
+                encode_anchor(BEFORE, orders[0]["_id"]) if orders else None,
             ),
         ),
         types.InlineKeyboardButton(
             emojize(":arrow_right:"),
-            callback_data="{} {} {}".format(
-                buttons_data, start + config.ORDERS_COUNT, 1 if invert else 0
+            callback_data=page_callback_data(
+                buttons_data,
+                start + config.ORDERS_COUNT,
+                invert,
+                encode_anchor(AFTER, orders[-1]["_id"]) if orders else None,
             ),
         ),
     )
@@ -136,10 +309,7 @@ async def orders_list(
             await tg.send_message(chat_id, text, reply_markup=keyboard)
         else:
             await tg.edit_message_text(text, chat_id, message_id, reply_markup=keyboard)
-        return
-
-    all_orders = await cursor.to_list(length=start + config.ORDERS_COUNT)
-    orders = all_orders[start:]
+        return True
 
     lines = []
     buttons = []
@@ -148,7 +318,7 @@ async def orders_list(
         line = ""
 
         if user_id is None:
-            if not order.get("archived") and order["expiration_time"] > current_time:
+            if is_active(order, current_time):
                 line += emojize(":arrow_forward: ")
             else:
                 line += emojize(":pause_button: ")
@@ -190,7 +360,12 @@ async def orders_list(
     keyboard.row(
         types.InlineKeyboardButton(
             i18n("invert"),
-            callback_data="{} {} {}".format(buttons_data, start, int(not invert)),
+            callback_data=page_callback_data(
+                buttons_data,
+                start,
+                not invert,
+                encode_anchor(FROM, orders[0]["_id"]) if orders else None,
+            ),
         )
     )
     keyboard.add(*buttons)
@@ -223,101 +398,97 @@ async def orders_list(
             parse_mode=types.ParseMode.MARKDOWN,
             disable_web_page_preview=True,
         )
+    return True
 
 
-async def show_order(
+class RenderedOrder(typing.NamedTuple):
+    """Text and keyboard of order independent of message it is shown in."""
+
+    #: Markdown text of order.
+    text: str
+    #: Rows of buttons' labels and callback data templates with
+    #: ``{location}`` in place of location message ID.
+    keyboard: typing.Tuple[typing.Tuple[typing.Tuple[str, str], ...], ...]
+
+    def markup(self, location_message_id: int) -> types.InlineKeyboardMarkup:
+        """Create keyboard with location message ``location_message_id``."""
+        return types.InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    types.InlineKeyboardButton(
+                        label, callback_data=data.format(location=location_message_id)
+                    )
+                    for label, data in row
+                ]
+                for row in self.keyboard
+            ]
+        )
+
+
+#: Rendered variants of orders mapped to IDs of orders.
+#:
+#: Variants are stored with revision of order and mention of creator
+#: they were rendered with. They expire with cached creators, so
+#: mentions of orders without creator snapshot are not older than
+#: ``CREATOR_CACHE_TTL``.
+order_render_cache: LRUCache[
+    ObjectId, typing.Tuple[int, str, typing.Dict[typing.Tuple, RenderedOrder]]
+] = LRUCache(config.ORDER_RENDER_CACHE_SIZE, config.CREATOR_CACHE_TTL)
+
+
+def invalidate_order(order_id: ObjectId) -> None:
+    """Remove rendered variants of order ``order_id`` from cache."""
+    order_render_cache.pop(order_id)
+
+
+def render_order(
     order: typing.Mapping[str, typing.Any],
-    chat_id: int,
-    user_id: int,
-    message_id: typing.Optional[int] = None,
-    location_message_id: typing.Optional[int] = None,
-    show_id: bool = False,
-    invert: typing.Optional[bool] = None,
-    edit: bool = False,
-    locale: typing.Optional[str] = None,
-):
-    """Send detailed order.
+    creator: typing.Mapping[str, typing.Any],
+    is_creator: bool,
+    show_id: bool,
+    invert: bool,
+    edit: bool,
+    locale: str,
+) -> RenderedOrder:
+    """Render text and keyboard of order.
 
     :param order: Order document.
-    :param chat_id: Telegram ID of chat to send message to.
-    :param user_id: Telegram user ID of message receiver.
-    :param message_id: Telegram ID of message to edit.
-    :param location_message_id: Telegram ID of message with location object.
-        It is deleted when **Hide** inline button is pressed.
+    :param creator: Snapshot of order's creator.
+    :param is_creator: Order is shown to its creator.
     :param show_id: Add ID of order to the top.
     :param invert: Invert price.
-    :param edit: Enter edit mode.
+    :param edit: Show edit mode.
     :param locale: Locale of message receiver.
     """
-    if locale is None:
-        locale = i18n.ctx_locale.get()
-
-    new_edit_msg = None
-    if invert is None:
-        try:
-            user = database_user.get()
-        except LookupError:
-            user = await database.users.find_one({"id": user_id})
-        invert = user.get("invert_order", False)
-    else:
-        user = await database.users.find_one_and_update(
-            {"id": user_id}, {"$set": {"invert_order": invert}}
-        )
-        if "edit" in user:
-            if edit:
-                if user["edit"]["field"] == "price":
-                    new_edit_msg = i18n(
-                        "new_price {of_currency} {per_currency}", locale=locale
-                    )
-                    if invert:
-                        new_edit_msg = new_edit_msg.format(
-                            of_currency=order["buy"], per_currency=order["sell"]
-                        )
-                    else:
-                        new_edit_msg = new_edit_msg.format(
-                            of_currency=order["sell"], per_currency=order["buy"]
-                        )
-            elif user["edit"]["order_message_id"] == message_id:
-                await tg.delete_message(user["chat"], user["edit"]["message_id"])
-                await database.users.update_one(
-                    {"_id": user["_id"]}, {"$unset": {"edit": True, "state": True}}
-                )
-
-    if location_message_id is None:
-        if order.get("lat") is not None and order.get("lon") is not None:
-            location_message = await tg.send_location(
-                chat_id, order["lat"], order["lon"]
-            )
-            location_message_id = location_message.message_id
-        else:
-            location_message_id = -1
-
+    translate = i18n.bound(locale)
     header = ""
     if show_id:
         header += "ID: {}\n".format(markdown.code(order["_id"]))
 
     if order.get("archived"):
-        header += markdown.bold(i18n("archived", locale=locale)) + "\n"
+        header += markdown.bold(translate("archived")) + "\n"
 
-    creator = await database.users.find_one({"id": order["user_id"]})
     header += "{} ({}) ".format(
-        markdown.link(creator["mention"], types.User(id=creator["id"]).url),
-        markdown.code(creator["id"]),
+        markdown.link(creator["mention"], types.User(id=order["user_id"]).url),
+        markdown.code(order["user_id"]),
     )
-    if invert:
-        act = i18n("sells {sell_currency} {buy_currency}", locale=locale)
-    else:
-        act = i18n("buys {buy_currency} {sell_currency}", locale=locale)
-    header += act.format(buy_currency=order["buy"], sell_currency=order["sell"]) + "\n"
+    header += translate.format(
+        "sells {sell_currency} {buy_currency}"
+        if invert
+        else "buys {buy_currency} {sell_currency}",
+        buy_currency=order["buy"],
+        sell_currency=order["sell"],
+    )
+    header += "\n"
 
     lines = [header]
     field_names = {
-        "sum_buy": i18n("buy_amount", locale=locale),
-        "sum_sell": i18n("sell_amount", locale=locale),
-        "price": i18n("price", locale=locale),
-        "payment_system": i18n("payment_system", locale=locale),
-        "duration": i18n("duration", locale=locale),
-        "comments": i18n("comments", locale=locale),
+        "sum_buy": translate("buy_amount"),
+        "sum_sell": translate("sell_amount"),
+        "price": translate("price"),
+        "payment_system": translate("payment_system"),
+        "duration": translate("duration"),
+        "comments": translate("comments"),
     }
     lines_format: typing.Dict[str, typing.Optional[str]] = {}
     for name in field_names:
@@ -346,21 +517,20 @@ async def show_order(
     if "comments" in order:
         lines_format["comments"] = "«{}»".format(order["comments"])
 
-    keyboard = types.InlineKeyboardMarkup(row_width=6)
+    keyboard: typing.List[typing.Tuple[typing.Tuple[str, str], ...]] = []
 
-    keyboard.row(
-        types.InlineKeyboardButton(
-            i18n("invert", locale=locale),
-            callback_data="{} {} {} {}".format(
-                "revert" if invert else "invert",
-                order["_id"],
-                location_message_id,
-                int(edit),
+    keyboard.append(
+        (
+            (
+                translate("invert"),
+                "{} {} {{location}} {}".format(
+                    "revert" if invert else "invert", order["_id"], int(edit)
+                ),
             ),
         )
     )
 
-    if edit and creator["id"] == user_id:
+    if edit and is_creator:
         buttons = []
         for i, (field, value) in enumerate(lines_format.items()):
             if value is not None:
@@ -368,20 +538,18 @@ async def show_order(
             else:
                 lines.append(f"{i + 1}. {field_names[field]} -")
             buttons.append(
-                types.InlineKeyboardButton(
-                    f"{i + 1}",
-                    callback_data="edit {} {} {} 0".format(
-                        order["_id"], field, location_message_id
-                    ),
-                )
+                (f"{i + 1}", "edit {} {} {{location}} 0".format(order["_id"], field))
             )
 
-        keyboard.add(*buttons)
-        keyboard.row(
-            types.InlineKeyboardButton(
-                i18n("finish", locale=locale),
-                callback_data="{} {} {} 0".format(
-                    "invert" if invert else "revert", order["_id"], location_message_id
+        # Keyboard of order has row width of 6.
+        keyboard.extend(tuple(buttons[i : i + 6]) for i in range(0, len(buttons), 6))
+        keyboard.append(
+            (
+                (
+                    translate("finish"),
+                    "{} {} {{location}} 0".format(
+                        "invert" if invert else "revert", order["_id"]
+                    ),
                 ),
             )
         )
@@ -391,74 +559,150 @@ async def show_order(
             if value is not None:
                 lines.append(field_names[field] + " " + value)
 
-        keyboard.row(
-            types.InlineKeyboardButton(
-                i18n("similar", locale=locale),
-                callback_data="similar {}".format(order["_id"]),
-            ),
-            types.InlineKeyboardButton(
-                i18n("match", locale=locale),
-                callback_data="match {}".format(order["_id"]),
-            ),
+        keyboard.append(
+            (
+                (translate("similar"), "similar {}".format(order["_id"])),
+                (translate("match"), "match {}".format(order["_id"])),
+            )
         )
 
-        if creator["id"] == user_id:
-            keyboard.row(
-                types.InlineKeyboardButton(
-                    i18n("edit", locale=locale),
-                    callback_data="{} {} {} 1".format(
-                        "invert" if invert else "revert",
-                        order["_id"],
-                        location_message_id,
+        if is_creator:
+            keyboard.append(
+                (
+                    (
+                        translate("edit"),
+                        "{} {} {{location}} 1".format(
+                            "invert" if invert else "revert", order["_id"]
+                        ),
                     ),
-                ),
-                types.InlineKeyboardButton(
-                    i18n("delete", locale=locale),
-                    callback_data="delete {} {}".format(
-                        order["_id"], location_message_id
+                    (
+                        translate("delete"),
+                        "delete {} {{location}}".format(order["_id"]),
                     ),
-                ),
+                )
             )
-            keyboard.row(
-                types.InlineKeyboardButton(
-                    i18n("unarchive", locale=locale)
-                    if order.get("archived")
-                    else i18n("archive", locale=locale),
-                    callback_data="archive {} {}".format(
-                        order["_id"], location_message_id
+            keyboard.append(
+                (
+                    (
+                        translate("unarchive")
+                        if order.get("archived")
+                        else translate("archive"),
+                        "archive {} {{location}}".format(order["_id"]),
                     ),
-                ),
-                types.InlineKeyboardButton(
-                    i18n("change_duration", locale=locale),
-                    callback_data="edit {} duration {} 1".format(
-                        order["_id"], location_message_id
+                    (
+                        translate("change_duration"),
+                        "edit {} duration {{location}} 1".format(order["_id"]),
                     ),
-                ),
+                )
             )
         elif "price_sell" in order and not order.get("archived"):
             if (
                 get_escrow_instance(order["buy"]) is not None
                 or get_escrow_instance(order["sell"]) is not None
             ):
-                keyboard.row(
-                    types.InlineKeyboardButton(
-                        i18n("escrow", locale=locale),
-                        callback_data="escrow {} sum_buy 0".format(order["_id"]),
+                keyboard.append(
+                    (
+                        (
+                            translate("escrow"),
+                            "escrow {} sum_buy 0".format(order["_id"]),
+                        ),
                     )
                 )
 
-        keyboard.row(
-            types.InlineKeyboardButton(
-                i18n("hide", locale=locale),
-                callback_data="hide {}".format(location_message_id),
+        keyboard.append(((translate("hide"), "hide {location}"),))
+
+    return RenderedOrder("\n".join(lines), tuple(keyboard))
+
+
+async def show_order(
+    order: typing.Mapping[str, typing.Any],
+    chat_id: int,
+    user_id: int,
+    message_id: typing.Optional[int] = None,
+    location_message_id: typing.Optional[int] = None,
+    show_id: bool = False,
+    invert: typing.Optional[bool] = None,
+    edit: bool = False,
+    locale: typing.Optional[str] = None,
+):
+    """Send detailed order.
+
+    Text and keyboard of order are rendered once for each variant of
+    order and taken from ``order_render_cache`` afterwards.
+
+    :param order: Order document.
+    :param chat_id: Telegram ID of chat to send message to.
+    :param user_id: Telegram user ID of message receiver.
+    :param message_id: Telegram ID of message to edit.
+    :param location_message_id: Telegram ID of message with location object.
+        It is deleted when **Hide** inline button is pressed.
+    :param show_id: Add ID of order to the top.
+    :param invert: Invert price.
+    :param edit: Enter edit mode.
+    :param locale: Locale of message receiver.
+    """
+    if locale is None:
+        locale = i18n.ctx_locale.get()
+
+    new_edit_msg = None
+    user = database_user.get(None)
+    if user is None or user["id"] != user_id:
+        user = await database.users.find_one({"id": user_id})
+        preference_buffer.apply(user)
+    if invert is None:
+        invert = user.get("invert_order", False)
+    else:
+        preference_buffer.set(user_id, "invert_order", invert)
+        if "edit" in user:
+            if edit:
+                if user["edit"]["field"] == "price":
+                    new_edit_msg = i18n(
+                        "new_price {of_currency} {per_currency}", locale=locale
+                    )
+                    if invert:
+                        new_edit_msg = new_edit_msg.format(
+                            of_currency=order["buy"], per_currency=order["sell"]
+                        )
+                    else:
+                        new_edit_msg = new_edit_msg.format(
+                            of_currency=order["sell"], per_currency=order["buy"]
+                        )
+            elif user["edit"]["order_message_id"] == message_id:
+                await tg.delete_message(user["chat"], user["edit"]["message_id"])
+                await update_user(user["id"], {"$unset": {"edit": True, "state": True}})
+
+    if location_message_id is None:
+        if order.get("lat") is not None and order.get("lon") is not None:
+            location_message = await tg.send_location(
+                chat_id, order["lat"], order["lon"]
             )
-        )
+            location_message_id = location_message.message_id
+        else:
+            location_message_id = -1
 
-    answer = "\n".join(lines)
+    is_creator = order["user_id"] == user_id
+    invert = bool(invert)
+    creator = order.get("creator")
+    if creator is None:
+        creators = await load_creators([order["user_id"]])
+        creator = creators[order["user_id"]]
+    revision = order.get("revision", 0)
+    variant = (locale, invert, is_creator, edit, show_id)
+    cached = order_render_cache.get(order["_id"])
+    if cached is None or cached[:2] != (revision, creator["mention"]):
+        cached = (revision, creator["mention"], {})
+        order_render_cache.set(order["_id"], cached)
+    rendered = cached[2].get(variant)
+    if rendered is None:
+        rendered = render_order(
+            order, creator, is_creator, show_id, invert, edit, locale
+        )
+        cached[2][variant] = rendered
+    keyboard = rendered.markup(location_message_id)
 
     if message_id is not None:
         await tg.edit_message_text(
-            answer,
+            rendered.text,
             chat_id,
             message_id,
             reply_markup=keyboard,
@@ -481,7 +725,7 @@ async def show_order(
     else:
         await tg.send_message(
             chat_id,
-            answer,
+            rendered.text,
             reply_markup=keyboard,
             parse_mode=types.ParseMode.MARKDOWN,
             disable_web_page_preview=True,
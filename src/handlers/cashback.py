@@ -35,6 +35,24 @@ from src.escrow.blockchain import TransferError
 from src.handlers.base import private_handler
 from src.handlers.base import start_keyboard
 from src.i18n import i18n
+from src.indexes import register_index
+from src.indexes import register_query
+
+
+register_index(
+    "cashback",
+    [
+        ("id", pymongo.ASCENDING),
+        ("currency", pymongo.ASCENDING),
+        ("time", pymongo.DESCENDING),
+    ],
+)
+register_query(
+    "cashback",
+    "addresses",
+    {"id": 0, "currency": "BTC", "address": {"$ne": None}},
+    [("time", pymongo.DESCENDING)],
+)
 
 
 @dp.callback_query_handler(
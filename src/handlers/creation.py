@@ -23,14 +23,13 @@ with ``private_handler`` are called when user sends value.
 """
 import asyncio
 import re
-from datetime import datetime
 from decimal import Decimal
 from time import time
 from typing import Any
 from typing import Mapping
 from typing import MutableMapping
 
-import requests
+import pymongo
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import any_state
@@ -45,7 +44,11 @@ from src import whitelist
 from src.bot import dp
 from src.bot import tg
 from src.config import config
+from src.database import creator_snapshot
 from src.database import database
+from src.database import database_user
+from src.geocoding import geocoder
+from src.geocoding import GeocodingError
 from src.handlers.base import inline_control_buttons
 from src.handlers.base import private_handler
 from src.handlers.base import show_order
@@ -53,13 +56,24 @@ from src.handlers.base import start_keyboard
 from src.handlers.base import state_handler
 from src.handlers.base import state_handlers
 from src.i18n import i18n
+from src.indexes import register_index
+from src.indexes import register_query
+from src.money import currency_fields
 from src.money import money
 from src.money import MoneyValueError
 from src.money import normalize
+from src.money import NO_PRICE
+from src.notifications import expiry_scheduler
+from src.notifications import notify_matches
 from src.notifications import order_notification
+from src.order_book import order_book
 from src.states import OrderCreation
 
 
+register_index("creation", [("user_id", pymongo.ASCENDING)])
+register_query("creation", "creation", {"user_id": 0})
+
+
 CURRENCY_REGEXP = re.compile(r"^(?:([A-Z]+)\.)?([A-Z]+)$")
 
 
@@ -702,39 +716,11 @@ async def text_location(message: types.Message, state: FSMContext):
     If there is only one option, set it and ask for duration. Otherwise
     send a list of these options for user to choose.
     """
-    query = message.text
-
-    language = i18n.ctx_locale.get()
-    location_cache = await database.locations.find_one({"q": query, "lang": language})
-
-    if location_cache:
-        results = location_cache["results"]
-    else:
-        params = {"q": query, "format": "json", "accept-language": language}
-        request = requests.get(
-            "https://nominatim.openstreetmap.org/search",
-            params=params,
-            headers={"User-Agent": "TellerBot"},
-        )
-
-        results = [
-            {
-                "display_name": result["display_name"],
-                "lat": result["lat"],
-                "lon": result["lon"],
-            }
-            for result in request.json()[:10]
-        ]
-
-        # Cache results to reduce dublicate requests
-        await database.locations.insert_one(
-            {
-                "q": query,
-                "lang": language,
-                "results": results,
-                "date": datetime.utcnow(),
-            }
-        )
+    try:
+        results = await geocoder.search(message.text, i18n.ctx_locale.get())
+    except GeocodingError:
+        await tg.send_message(message.chat.id, i18n("try_again"))
+        return
 
     if not results:
         await tg.send_message(message.chat.id, i18n("location_not_found"))
@@ -860,6 +846,8 @@ async def set_order(order: MutableMapping[str, Any], chat_id: int):
         order["duration"] = config.ORDER_DURATION_LIMIT
     order["expiration_time"] = time() + order["duration"] * 24 * 60 * 60
     order["notify"] = True
+    order["creator"] = creator_snapshot(database_user.get())
+    order.update(currency_fields(order["buy"], order["sell"]))
     if "price_sell" not in order and "sum_buy" in order and "sum_sell" in order:
         order["price_sell"] = Decimal128(
             normalize(order["sum_sell"].to_decimal() / order["sum_buy"].to_decimal())
@@ -867,12 +855,16 @@ async def set_order(order: MutableMapping[str, Any], chat_id: int):
         order["price_buy"] = Decimal128(
             normalize(order["sum_buy"].to_decimal() / order["sum_sell"].to_decimal())
         )
+    order["price_key"] = order.get("price_buy", NO_PRICE)
 
     inserted_order = await database.orders.insert_one(order)
     order["_id"] = inserted_order.inserted_id
+    expiry_scheduler.schedule(order["_id"], order["expiration_time"])
+    order_book.update(order)
     await tg.send_message(chat_id, i18n("order_set"), reply_markup=start_keyboard())
     await show_order(order, chat_id, order["user_id"], show_id=True)
     asyncio.create_task(order_notification(order))
+    asyncio.create_task(notify_matches(order))
 
 
 @state_handler(OrderCreation.comments)
@@ -22,6 +22,7 @@ from decimal import Decimal
 from functools import wraps
 from time import time
 
+import pymongo
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import any_state
@@ -46,11 +47,19 @@ from src.escrow.escrow_offer import EscrowOffer
 from src.handlers.base import private_handler
 from src.handlers.base import start_keyboard
 from src.i18n import i18n
+from src.indexes import register_index
+from src.indexes import register_query
 from src.money import money
 from src.money import MoneyValueError
 from src.money import normalize
 
 
+register_index("escrow", [("pending_input_from", pymongo.ASCENDING)], sparse=True)
+register_index("users", [("referrer", pymongo.ASCENDING)], sparse=True)
+register_query("escrow", "pending_input", {"pending_input_from": 0})
+register_query("users", "referrals", {"referrer": 0})
+
+
 async def get_card_number(
     text: str, chat_id: int
 ) -> typing.Optional[typing.Tuple[str, str]]:
@@ -902,20 +911,40 @@ async def add_cashback(
         (sum_fee_up - amount, sender_user, sender_user["send_address"]),
         (amount - sum_fee_down, recipient_user, recipient_user["receive_address"]),
     )
+    categories_of_fees = [
+        (
+            fee,
+            (
+                (rs.PERSONAL_CATEGORY, user["id"], user_address),
+                (rs.REFERRED_CATEGORY, user.get("referrer"), None),
+                (
+                    rs.REFERRED_BY_REFERALS_CATEGORY,
+                    user.get("referrer_of_referrer"),
+                    None,
+                ),
+            ),
+        )
+        for fee, user, user_address in fees
+        if fee
+    ]
+    user_ids = [
+        user_id
+        for _, categories in categories_of_fees
+        for _, user_id, _ in categories
+        if user_id
+    ]
+    cursor = database.users.find(
+        {"id": {"$in": user_ids}}, projection={"id": True, "referral_count": True}
+    )
+    counts = {user["id"]: user.get("referral_count", 0) async for user in cursor}
+
     cashback = []
     current_time = time()
-    for fee, user, user_address in fees:
-        if not fee:
-            continue
-        categories = (
-            (rs.PERSONAL_CATEGORY, user["id"], user_address),
-            (rs.REFERRED_CATEGORY, user.get("referrer"), None),
-            (rs.REFERRED_BY_REFERALS_CATEGORY, user.get("referrer_of_referrer"), None),
-        )
+    for fee, categories in categories_of_fees:
         for category, user_id, address in categories:
             if not user_id:
                 break
-            count = await database.users.count_documents({"referrer": user_id})
+            count = counts.get(user_id, 0)
             if not count:
                 continue
             document = {
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
 """Handlers for showing orders and reacting to query buttons attached to them."""
+import asyncio
 import typing
 from decimal import Decimal
 from functools import wraps
@@ -28,7 +29,6 @@ from aiogram.utils.exceptions import MessageCantBeDeleted
 from aiogram.utils.exceptions import MessageNotModified
 from bson.decimal128 import Decimal128
 from bson.objectid import ObjectId
-from motor.core import AgnosticBaseCursor as Cursor
 
 from src import money
 from src import states
@@ -37,13 +37,36 @@ from src.bot import tg
 from src.config import config
 from src.database import database
 from src.database import database_user
+from src.database import update_user
 from src.escrow import get_escrow_instance
 from src.escrow.escrow_offer import EscrowOffer
+from src.handlers.base import invalidate_order
 from src.handlers.base import orders_list
+from src.handlers.base import OrdersQuery
 from src.handlers.base import private_handler
 from src.handlers.base import show_order
 from src.i18n import i18n
 from src.i18n import plural_i18n
+from src.indexes import register_index
+from src.indexes import register_query
+from src.notifications import expiry_scheduler
+from src.notifications import notify_matches
+from src.order_book import active_filter
+from src.order_book import BookFilter
+from src.order_book import order_book
+
+#: Sort key of orders from the lowest price to the highest.
+PRICE_FIRST = (
+    ("price_key", pymongo.ASCENDING),
+    ("start_time", pymongo.DESCENDING),
+    ("_id", pymongo.DESCENDING),
+)
+
+register_index(
+    "orders",
+    [("buy_base", pymongo.ASCENDING), ("sell_base", pymongo.ASCENDING), *PRICE_FIRST],
+)
+register_query("orders", "pair", {"buy_base": "BTC", "sell_base": "USD"}, PRICE_FIRST)
 
 OrderType = typing.Mapping[str, typing.Any]
 
@@ -71,42 +94,39 @@ def order_handler(
 
 async def show_orders(
     call: types.CallbackQuery,
-    cursor: Cursor,
+    orders_query: OrdersQuery,
     start: int,
-    quantity: int,
     buttons_data: str,
     invert: bool,
     user_id: typing.Optional[int] = None,
+    anchor: typing.Optional[str] = None,
 ):
     """Send list of orders.
 
-    :param cursor: Cursor of MongoDB query to orders.
+    :param orders_query: Query to orders.
     :param chat_id: Telegram chat ID.
     :param start: Start index.
-    :param quantity: Quantity of orders in cursor.
     :param buttons_data: Beginning of callback data of left/right buttons.
-    :param user_id: If cursor is user-specific, Telegram ID of user
-        who created all orders in cursor.
+    :param user_id: If query is user-specific, Telegram ID of user
+        who created all orders in query.
     :param invert: Invert all prices.
+    :param anchor: Anchor of page from callback data.
     """
-    if start >= quantity > 0:
-        await call.answer(i18n("no_more_orders"))
-        return
-
     try:
-        await call.answer()
-        await orders_list(
-            cursor,
+        shown = await orders_list(
+            orders_query,
             call.message.chat.id,
             start,
-            quantity,
             buttons_data,
             user_id=user_id,
             message_id=call.message.message_id,
             invert=invert,
+            anchor=anchor,
         )
     except MessageNotModified:
         await call.answer(i18n("no_previous_orders"))
+    else:
+        await call.answer(None if shown else i18n("no_more_orders"))
 
 
 @dp.callback_query_handler(
@@ -161,32 +181,20 @@ async def invert_button(call: types.CallbackQuery, order: OrderType):
     )
 
 
-async def aggregate_orders(buy: str, sell: str) -> typing.Tuple[Cursor, int]:
-    """Aggregate and query orders with specified currency pair.
+def pair_orders_query(buy: str, sell: str) -> OrdersQuery:
+    """Get query to unexpired orders with specified currency pair.
 
-    Return cursor with unexpired orders sorted by price and creation
-    time and quantity of documents in it.
+    Orders are sorted by price and creation time.
     """
-    query = {
-        "buy": money.gateway_currency_regexp(buy),
-        "sell": money.gateway_currency_regexp(sell),
-        "$or": [{"archived": {"$exists": False}}, {"archived": False}],
-        "expiration_time": {"$gt": time()},
-    }
-    cursor = database.orders.aggregate(
-        [
-            {"$match": query},
-            {"$addFields": {"price_buy": {"$ifNull": ["$price_buy", ""]}}},
-            {
-                "$sort": {
-                    "price_buy": pymongo.ASCENDING,
-                    "start_time": pymongo.DESCENDING,
-                }
-            },
-        ]
+    return OrdersQuery(
+        {
+            **money.currency_filter("buy", buy),
+            **money.currency_filter("sell", sell),
+            **active_filter(time()),
+        },
+        sort=PRICE_FIRST,
+        book_filter=BookFilter(sell=sell, buy=buy, by_price=True),
     )
-    quantity = await database.orders.count_documents(query)
-    return cursor, quantity
 
 
 @dp.callback_query_handler(
@@ -194,25 +202,19 @@ async def aggregate_orders(buy: str, sell: str) -> typing.Tuple[Cursor, int]:
 )
 async def orders_button(call: types.CallbackQuery):
     """React to left/right button query in order book."""
-    query = {
-        "$and": [
-            {
-                "$or": [
-                    {"expiration_time": {"$exists": False}},
-                    {"expiration_time": {"$gt": time()}},
-                ]
-            },
-            {"$or": [{"archived": {"$exists": False}}, {"archived": False}]},
-        ]
-    }
-    cursor = database.orders.find(query).sort("start_time", pymongo.DESCENDING)
-    quantity = await database.orders.count_documents(query)
-
+    query = active_filter(time())
     args = call.data.split()
     start = max(0, int(args[1]))
     invert = bool(int(args[2]))
+    anchor = args[3] if len(args) > 3 else None
     await show_orders(
-        call, cursor, start, quantity, "orders", invert, user_id=call.from_user.id
+        call,
+        OrdersQuery(query, book_filter=BookFilter()),
+        start,
+        "orders",
+        invert,
+        user_id=call.from_user.id,
+        anchor=anchor,
     )
 
 
@@ -222,13 +224,13 @@ async def orders_button(call: types.CallbackQuery):
 async def my_orders_button(call: types.CallbackQuery):
     """React to left/right button query in list of user's orders."""
     query = {"user_id": call.from_user.id}
-    cursor = database.orders.find(query).sort("start_time", pymongo.DESCENDING)
-    quantity = await database.orders.count_documents(query)
-
     args = call.data.split()
     start = max(0, int(args[1]))
     invert = bool(int(args[2]))
-    await show_orders(call, cursor, start, quantity, "my_orders", invert)
+    anchor = args[3] if len(args) > 3 else None
+    await show_orders(
+        call, OrdersQuery(query), start, "my_orders", invert, anchor=anchor
+    )
 
 
 @dp.callback_query_handler(
@@ -239,16 +241,15 @@ async def matched_orders_button(call: types.CallbackQuery):
     args = call.data.split()
     start = max(0, int(args[3]))
     invert = bool(int(args[4]))
-    cursor, quantity = await aggregate_orders(args[1], args[2])
-    await call.answer()
+    anchor = args[5] if len(args) > 5 else None
     await show_orders(
         call,
-        cursor,
+        pair_orders_query(args[1], args[2]),
         start,
-        quantity,
         "matched_orders {} {}".format(args[1], args[2]),
         invert,
         user_id=call.from_user.id,
+        anchor=anchor,
     )
 
 
@@ -261,13 +262,11 @@ async def similar_button(call: types.CallbackQuery, order: OrderType):
 
     Similar orders are ones that have the same currency pair.
     """
-    cursor, quantity = await aggregate_orders(order["buy"], order["sell"])
     await call.answer()
     await orders_list(
-        cursor,
+        pair_orders_query(order["buy"], order["sell"]),
         call.message.chat.id,
         0,
-        quantity,
         "matched_orders {} {}".format(order["buy"], order["sell"]),
         user_id=call.from_user.id,
     )
@@ -280,13 +279,11 @@ async def match_button(call: types.CallbackQuery, order: OrderType):
 
     Matched orders are ones that have the inverted currency pair.
     """
-    cursor, quantity = await aggregate_orders(order["sell"], order["buy"])
     await call.answer()
     await orders_list(
-        cursor,
+        pair_orders_query(order["sell"], order["buy"]),
         call.message.chat.id,
         0,
-        quantity,
         "matched_orders {} {}".format(order["sell"], order["buy"]),
         user_id=call.from_user.id,
     )
@@ -457,8 +454,8 @@ async def edit_button(call: types.CallbackQuery):
         answer,
         reply_markup=keyboard,
     )
-    await database.users.update_one(
-        {"_id": user["_id"]},
+    await update_user(
+        user["id"],
         {
             "$set": {
                 "edit.order_message_id": call.message.message_id,
@@ -474,12 +471,34 @@ async def edit_button(call: types.CallbackQuery):
     )
 
 
-async def finish_edit(user, update_dict):
-    """Update and show order after editing."""
+def changes_filter(update_dict) -> typing.Dict[str, typing.Any]:
+    """Get filter of documents changed by ``$set`` and ``$unset`` in ``update_dict``."""
+    conditions: typing.List[typing.Dict[str, typing.Any]] = [
+        {field: {"$ne": value}} for field, value in update_dict.get("$set", {}).items()
+    ]
+    conditions.extend(
+        {field: {"$exists": True}} for field in update_dict.get("$unset", {})
+    )
+    return {"$or": conditions}
+
+
+async def finish_edit(user, update_dict) -> typing.Optional[OrderType]:
+    """Update and show order after editing.
+
+    Revision of order is incremented only if update changes it.
+
+    :return: Updated order or None if it wasn't modified.
+    """
     edit = user["edit"]
-    result = await database.orders.update_one({"_id": edit["order_id"]}, update_dict)
+    order = None
+    result = await database.orders.update_one(
+        {"_id": edit["order_id"], **changes_filter(update_dict)},
+        {**update_dict, "$inc": {"revision": 1}},
+    )
     if result.modified_count:
         order = await database.orders.find_one({"_id": edit["order_id"]})
+        order_book.update(order)
+        invalidate_order(order["_id"])
         try:
             await show_order(
                 order,
@@ -492,9 +511,8 @@ async def finish_edit(user, update_dict):
             )
         except MessageNotModified:
             pass
-    await database.users.update_one(
-        {"_id": user["_id"]}, {"$unset": {"edit": True, "state": True}}
-    )
+    await update_user(user["id"], {"$unset": {"edit": True, "state": True}})
+    return order
 
 
 @dp.callback_query_handler(
@@ -503,19 +521,16 @@ async def finish_edit(user, update_dict):
 async def default_duration(call: types.CallbackQuery, state: FSMContext):
     """Repeat default duration."""
     user = database_user.get()
-    order = await database.orders.find_one({"_id": user["edit"]["order_id"]})
+    edit = user["edit"]
+    order = await database.orders.find_one({"_id": edit["order_id"]})
+    expiration_time = time() + order["duration"] * 24 * 60 * 60
     await call.answer()
     await finish_edit(
-        user,
-        {
-            "$set": {
-                "expiration_time": time() + order["duration"] * 24 * 60 * 60,
-                "notify": True,
-            }
-        },
+        user, {"$set": {"expiration_time": expiration_time, "notify": True}}
     )
+    expiry_scheduler.schedule(order["_id"], expiration_time)
     try:
-        await tg.delete_message(user["chat"], user["edit"]["message_id"])
+        await tg.delete_message(user["chat"], edit["message_id"])
     except MessageCantBeDeleted:
         return
 
@@ -526,15 +541,19 @@ async def default_duration(call: types.CallbackQuery, state: FSMContext):
 async def unset_button(call: types.CallbackQuery, state: FSMContext):
     """React to "Unset" button by unsetting the edit field."""
     user = database_user.get()
-    field = user["edit"]["field"]
+    edit = user["edit"]
+    field = edit["field"]
     if field == "price":
-        unset_dict = {"price_buy": True, "price_sell": True}
+        update = {
+            "$unset": {"price_buy": True, "price_sell": True},
+            "$set": {"price_key": money.NO_PRICE},
+        }
     else:
-        unset_dict = {field: True}
+        update = {"$unset": {field: True}}
     await call.answer()
-    await finish_edit(user, {"$unset": unset_dict})
+    await finish_edit(user, update)
     try:
-        await tg.delete_message(user["chat"], user["edit"]["message_id"])
+        await tg.delete_message(user["chat"], edit["message_id"])
     except MessageCantBeDeleted:
         return
 
@@ -587,6 +606,7 @@ async def edit_field(message: types.Message, state: FSMContext):
                 price_sell = money.normalize(Decimal(1) / price)
                 set_dict["price_buy"] = Decimal128(price)
                 set_dict["price_sell"] = Decimal128(price_sell)
+                set_dict["price_key"] = set_dict["price_buy"]
 
                 if order.get("sum_currency") == "buy":
                     set_dict["sum_sell"] = Decimal128(
@@ -600,6 +620,7 @@ async def edit_field(message: types.Message, state: FSMContext):
                 price_buy = money.normalize(Decimal(1) / price)
                 set_dict["price_buy"] = Decimal128(price_buy)
                 set_dict["price_sell"] = Decimal128(price)
+                set_dict["price_key"] = set_dict["price_buy"]
 
                 if order.get("sum_currency") == "sell":
                     set_dict["sum_buy"] = Decimal128(
@@ -653,7 +674,11 @@ async def edit_field(message: types.Message, state: FSMContext):
         set_dict["comments"] = comments
 
     if set_dict:
-        await finish_edit(user, {"$set": set_dict})
+        order = await finish_edit(user, {"$set": set_dict})
+        if "expiration_time" in set_dict:
+            expiry_scheduler.schedule(edit["order_id"], set_dict["expiration_time"])
+        if order is not None and "price_buy" in set_dict:
+            asyncio.create_task(notify_matches(order))
         await message.delete()
         try:
             await tg.delete_message(user["chat"], edit["message_id"])
@@ -677,6 +702,7 @@ async def archive_button(call: types.CallbackQuery, order: OrderType):
         update_dict = {"$unset": {"archived": True}, "$set": {"notify": True}}
     else:
         update_dict = {"$set": {"archived": True, "notify": False}}
+    update_dict["$inc"] = {"revision": 1}
     order = await database.orders.find_one_and_update(
         {"_id": ObjectId(args[1]), "user_id": call.from_user.id},
         update_dict,
@@ -688,6 +714,13 @@ async def archive_button(call: types.CallbackQuery, order: OrderType):
         )
         return
 
+    if archived:
+        expiry_scheduler.schedule(order["_id"], order["expiration_time"])
+    else:
+        expiry_scheduler.unschedule(order["_id"])
+    order_book.update(order)
+    invalidate_order(order["_id"])
+
     await call.answer()
     await show_order(
         order,
@@ -747,6 +780,9 @@ async def confirm_delete_button(call: types.CallbackQuery):
     if not order:
         await call.answer(i18n("delete_order_error"))
         return
+    expiry_scheduler.unschedule(order["_id"])
+    order_book.remove(order["_id"])
+    invalidate_order(order["_id"])
 
     location_message_id = int(call.data.split()[2])
     keyboard = types.InlineKeyboardMarkup()
@@ -40,11 +40,61 @@ from src.bot import tg
 from src.config import config
 from src.database import database
 from src.database import database_user
+from src.database import update_user
+from src.handlers.base import NEWEST_FIRST
 from src.handlers.base import orders_list
+from src.handlers.base import OrdersQuery
 from src.handlers.base import private_handler
 from src.handlers.base import start_keyboard
 from src.i18n import i18n
-from src.money import gateway_currency_regexp
+from src.indexes import register_index
+from src.indexes import register_query
+from src.money import currency_filter
+from src.order_book import active_filter
+from src.order_book import BookFilter
+from src.subscriptions import subscription_index
+
+
+register_index(
+    "users", [("referral_code", pymongo.ASCENDING)], unique=True, sparse=True
+)
+register_index(
+    "orders",
+    [
+        ("user_id", pymongo.ASCENDING),
+        ("start_time", pymongo.DESCENDING),
+        ("_id", pymongo.DESCENDING),
+    ],
+)
+register_index(
+    "orders",
+    [
+        ("sell_base", pymongo.ASCENDING),
+        ("buy_base", pymongo.ASCENDING),
+        ("start_time", pymongo.DESCENDING),
+        ("_id", pymongo.DESCENDING),
+    ],
+)
+register_index(
+    "orders",
+    [
+        ("buy_base", pymongo.ASCENDING),
+        ("start_time", pymongo.DESCENDING),
+        ("_id", pymongo.DESCENDING),
+    ],
+)
+register_query("users", "referral_code", {"referral_code": "code"})
+register_query("orders", "my_orders", {"user_id": 0}, NEWEST_FIRST)
+register_query("orders", "recent_orders", {"user_id": 0, "start_time": {"$gt": 0}})
+register_query(
+    "orders", "book_pair", {"sell_base": "BTC", "buy_base": "USD"}, NEWEST_FIRST
+)
+register_query(
+    "orders",
+    "book_currency",
+    {"$or": [{"sell_base": "BTC"}, {"buy_base": "BTC"}]},
+    NEWEST_FIRST,
+)
 
 
 def locale_keyboard():
@@ -89,6 +139,8 @@ async def handle_start_command(message: types.Message, state: FSMContext):
     )
 
     if not result.matched_count:
+        if "referrer" in user:
+            await update_user(user["referrer"], {"$inc": {"referral_count": 1}})
         await tg.send_message(
             message.chat.id, i18n("choose_language"), reply_markup=locale_keyboard()
         )
@@ -106,9 +158,7 @@ async def handle_start_command(message: types.Message, state: FSMContext):
 async def locale_button(call: types.CallbackQuery):
     """Choose language from list."""
     locale = call.data.split()[1]
-    await database.users.update_one(
-        {"id": call.from_user.id}, {"$set": {"locale": locale}}
-    )
+    await update_user(call.from_user.id, {"$set": {"locale": locale}})
     i18n.ctx_locale.set(locale)
     await call.answer()
     await tg.send_message(
@@ -181,30 +231,43 @@ async def handle_book(
         =============  =================================================
 
     """
-    query = {
-        "$or": [{"archived": {"$exists": False}}, {"archived": False}],
-        "expiration_time": {"$gt": time()},
-    }
+    query = active_filter(time())
 
+    book_filter = BookFilter()
     if command is not None:
         source = message.text.upper().split()
         if len(source) == 2:
             currency = source[1]
             if currency != "*":
-                regexp = gateway_currency_regexp(currency)
-                query = {"$and": [query, {"$or": [{"sell": regexp}, {"buy": regexp}]}]}
+                book_filter = BookFilter(currency=currency)
+                query = {
+                    "$and": [
+                        query,
+                        {
+                            "$or": [
+                                currency_filter("sell", currency),
+                                currency_filter("buy", currency),
+                            ]
+                        },
+                    ]
+                }
         elif len(source) >= 3:
             sell, buy = source[1], source[2]
             if sell != "*":
-                query["sell"] = gateway_currency_regexp(sell)
+                query.update(currency_filter("sell", sell))
             if buy != "*":
-                query["buy"] = gateway_currency_regexp(buy)
+                query.update(currency_filter("buy", buy))
+            book_filter = BookFilter(
+                sell=sell if sell != "*" else None, buy=buy if buy != "*" else None
+            )
 
-    cursor = database.orders.find(query).sort("start_time", pymongo.DESCENDING)
-    quantity = await database.orders.count_documents(query)
     await state.finish()
     await orders_list(
-        cursor, message.chat.id, 0, quantity, "orders", user_id=message.from_user.id
+        OrdersQuery(query, book_filter=book_filter),
+        message.chat.id,
+        0,
+        "orders",
+        user_id=message.from_user.id,
     )
 
 
@@ -215,10 +278,8 @@ async def handle_book(
 async def handle_my_orders(message: types.Message, state: FSMContext):
     """Show user's orders."""
     query = {"user_id": message.from_user.id}
-    cursor = database.orders.find(query).sort("start_time", pymongo.DESCENDING)
-    quantity = await database.orders.count_documents(query)
     await state.finish()
-    await orders_list(cursor, message.chat.id, 0, quantity, "my_orders")
+    await orders_list(OrdersQuery(query), message.chat.id, 0, "my_orders")
 
 
 @private_handler(commands=["link"], state=any_state)
@@ -234,9 +295,7 @@ async def get_referral_link(message: types.Message):
             cryptogen = SystemRandom()
             code = "".join(cryptogen.choice(ascii_lowercase) for _ in range(7))
             try:
-                await database.users.update_one(
-                    {"_id": user["_id"]}, {"$set": {"referral_code": code}}
-                )
+                await update_user(user["id"], {"$set": {"referral_code": code}})
             except DuplicateKeyError:
                 continue
             else:
@@ -331,10 +390,7 @@ async def search_by_creator(message: types.Message, state: FSMContext):
     In contrast to usernames and user IDs, names aren't unique and
     therefore not supported.
     """
-    query: typing.Dict[str, typing.Any] = {
-        "$or": [{"archived": {"$exists": False}}, {"archived": False}],
-        "expiration_time": {"$gt": time()},
-    }
+    query: typing.Dict[str, typing.Any] = active_filter(time())
     source = message.text.split()
     try:
         creator = source[1]
@@ -360,11 +416,13 @@ async def search_by_creator(message: types.Message, state: FSMContext):
         )
         return
 
-    cursor = database.orders.find(query).sort("start_time", pymongo.DESCENDING)
-    quantity = await database.orders.count_documents(query)
     await state.finish()
     await orders_list(
-        cursor, message.chat.id, 0, quantity, "orders", user_id=message.from_user.id
+        OrdersQuery(query),
+        message.chat.id,
+        0,
+        "orders",
+        user_id=message.from_user.id,
     )
 
 
@@ -432,6 +490,7 @@ async def subcribe_to_pair(
             upsert=True,
         )
         if not update_result.matched_count or update_result.modified_count:
+            subscription_index.add(message.from_user.id, sub)
             await tg.send_message(
                 message.chat.id,
                 i18n("subscription_added"),
@@ -448,6 +507,7 @@ async def subcribe_to_pair(
             {"id": message.from_user.id}, {"$pull": {"subscriptions": sub}}
         )
         if delete_result.modified_count:
+            subscription_index.remove(message.from_user.id, sub)
             await tg.send_message(
                 message.chat.id,
                 i18n("subscription_deleted"),
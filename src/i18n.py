@@ -24,6 +24,76 @@ from aiogram.contrib.middlewares.i18n import I18nMiddleware
 from src.database import database_user
 
 
+def english_plural(n: int) -> int:
+    """Get index of plural form of untranslated message."""
+    return int(n != 1)
+
+
+class MessageCatalog:
+    """Messages of one locale with fallbacks resolved.
+
+    Messages are looked up in a flat dictionary instead of going
+    through chain of fallback translations.
+    """
+
+    def __init__(
+        self,
+        messages: typing.Mapping[str, str],
+        plurals: typing.Mapping[
+            str, typing.Tuple[typing.Callable[[int], int], typing.Sequence[str]]
+        ],
+    ):
+        """Create catalog with translated ``messages`` and ``plurals``.
+
+        :param messages: Translations of singular messages.
+        :param plurals: Plural function and forms of plural messages.
+        """
+        self.messages = messages
+        self.plurals = plurals
+        self.formatters: typing.Dict[str, typing.Callable[..., str]] = {
+            msgid: message.format for msgid, message in messages.items()
+        }
+
+    @classmethod
+    def from_translations(
+        cls, *translations: gettext.GNUTranslations
+    ) -> "MessageCatalog":
+        """Flatten ``translations`` ordered from the fallback to the preferred."""
+        messages: typing.Dict[str, str] = {}
+        plurals: typing.Dict[
+            str, typing.Tuple[typing.Callable[[int], int], typing.List[str]]
+        ] = {}
+        for translation in translations:
+            forms: typing.Dict[str, typing.List[str]] = {}
+            for key, message in translation._catalog.items():  # type: ignore
+                if isinstance(key, tuple):
+                    forms.setdefault(key[0], []).append(message)
+                elif key:
+                    messages[key] = message
+            for msgid, msgstrs in forms.items():
+                plurals[msgid] = (translation.plural, msgstrs)  # type: ignore
+        return cls(messages, plurals)
+
+    def __call__(
+        self, singular: str, plural: typing.Optional[str] = None, n: int = 1
+    ) -> str:
+        """Get translation of message."""
+        if plural is None:
+            return self.messages.get(singular, singular)
+        entry = self.plurals.get(singular)
+        if entry is None:
+            return singular if english_plural(n) == 0 else plural
+        plural_function, forms = entry
+        return forms[plural_function(n)]
+
+    def format(self, msgid: str, **kwargs) -> str:  # noqa: A003
+        """Get translation of message ``msgid`` with placeholders replaced."""
+        formatter = self.formatters.get(msgid)
+        if formatter is None:
+            return msgid.format(**kwargs)
+        return formatter(**kwargs)
+
+
 class I18nMiddlewareManual(I18nMiddleware):
     """I18n middleware which gets user locale from database."""
 
@@ -34,6 +104,9 @@ class I18nMiddlewareManual(I18nMiddleware):
         self.domain = domain
         self.path = path
         self.default = default
+        self.locales: typing.Dict[str, gettext.NullTranslations] = {}
+        self.catalogs: typing.Dict[str, MessageCatalog] = {}
+        self.untranslated = MessageCatalog({}, {})
 
     def find_locales(self) -> typing.Dict[str, gettext.NullTranslations]:
         """Load all compiled locales from path and add default fallbacks."""
@@ -42,6 +115,34 @@ class I18nMiddlewareManual(I18nMiddleware):
             translation.add_fallback(translations[self.default])
         return translations
 
+    def reload(self):
+        """Load locales and build their catalogs with resolved fallbacks."""
+        super().reload()
+        default = self.locales[self.default]
+        self.catalogs = {
+            locale: MessageCatalog.from_translations(default, translation)
+            for locale, translation in self.locales.items()
+        }
+
+    def bound(self, locale: typing.Optional[str] = None) -> MessageCatalog:
+        """Get catalog of ``locale`` or locale of current context."""
+        if locale is None:
+            locale = self.ctx_locale.get()
+        return self.catalogs.get(locale, self.untranslated)
+
+    def gettext(
+        self,
+        singular: str,
+        plural: typing.Optional[str] = None,
+        n: int = 1,
+        locale: typing.Optional[str] = None,
+    ) -> str:
+        """Get translation of message from catalog of locale."""
+        catalog = self.bound(locale)
+        if plural is None:
+            return catalog.messages.get(singular, singular)
+        return catalog(singular, plural, n)
+
     async def get_user_locale(
         self, action: str, args: typing.Tuple[typing.Any]
     ) -> typing.Optional[str]:
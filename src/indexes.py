@@ -0,0 +1,172 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Registry of database indexes and query shapes they serve.
+
+Modules querying collections register indexes their queries need with
+``register_index`` and canonical shapes of these queries with
+``register_query``. Registered indexes are created at startup with
+``reconcile`` and plans of registered queries can be checked with
+``explain``.
+"""
+import logging
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
+
+log = logging.getLogger(__name__)
+
+IndexKeys = typing.Sequence[typing.Tuple[str, typing.Any]]
+
+#: Options of index which are compared with options of existing index.
+COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression")
+
+
+class IndexSpec(typing.NamedTuple):
+    """Specification of index."""
+
+    collection: str
+    keys: IndexKeys
+    options: typing.Mapping[str, typing.Any]
+
+    @property
+    def name(self) -> str:
+        """Get name of index which is generated by MongoDB if not specified."""
+        return self.options.get("name") or "_".join(
+            f"{field}_{direction}" for field, direction in self.keys
+        )
+
+
+class QueryShape(typing.NamedTuple):
+    """Canonical shape of query to collection."""
+
+    collection: str
+    name: str
+    query: typing.Mapping[str, typing.Any]
+    sort: typing.Optional[IndexKeys] = None
+
+
+INDEXES: typing.List[IndexSpec] = []
+QUERY_SHAPES: typing.List[QueryShape] = []
+
+
+def register_index(collection: str, keys: IndexKeys, **options) -> None:
+    """Register index of ``collection`` with ``keys`` and creation ``options``."""
+    INDEXES.append(IndexSpec(collection, list(keys), options))
+
+
+def register_query(
+    collection: str,
+    name: str,
+    query: typing.Mapping[str, typing.Any],
+    sort: typing.Optional[IndexKeys] = None,
+) -> None:
+    """Register shape ``name`` of ``query`` to ``collection`` for ``explain``."""
+    QUERY_SHAPES.append(QueryShape(collection, name, query, sort))
+
+
+async def reconcile(database: AsyncIOMotorDatabase) -> None:
+    """Create missing registered indexes and warn about unregistered ones.
+
+    Expiration time of existing TTL indexes is updated in place. Other
+    differences from registered indexes are only reported, because
+    changing them requires rebuilding the index.
+    """
+    collections: typing.Dict[str, typing.List[IndexSpec]] = {}
+    for index in INDEXES:
+        collections.setdefault(index.collection, []).append(index)
+
+    for collection_name in sorted(
+        set(collections) | set(await database.list_collection_names())
+    ):
+        collection = database[collection_name]
+        existing = await collection.index_information()
+        for index in collections.get(collection_name, []):
+            info = existing.pop(index.name, None)
+            if info is None:
+                try:
+                    await collection.create_index(
+                        index.keys, name=index.name, **index.options
+                    )
+                except OperationFailure as error:
+                    log.error(
+                        "Failed to create index %s.%s: %s",
+                        collection_name,
+                        index.name,
+                        error,
+                    )
+                else:
+                    log.info("Created index %s.%s", collection_name, index.name)
+            elif [tuple(key) for key in info["key"]] != [
+                tuple(key) for key in index.keys
+            ]:
+                log.warning(
+                    "Index %s.%s has keys %s instead of %s",
+                    collection_name,
+                    index.name,
+                    info["key"],
+                    index.keys,
+                )
+            else:
+                expire_after = index.options.get("expireAfterSeconds")
+                if expire_after not in (None, info.get("expireAfterSeconds")):
+                    await database.command(
+                        "collMod",
+                        collection_name,
+                        index={"name": index.name, "expireAfterSeconds": expire_after},
+                    )
+                    log.info(
+                        "Updated expiration of index %s.%s", collection_name, index.name
+                    )
+                for option in COMPARED_OPTIONS:
+                    if index.options.get(option) != info.get(option):
+                        log.warning(
+                            "Index %s.%s has %s %s instead of %s, drop it to recreate",
+                            collection_name,
+                            index.name,
+                            option,
+                            info.get(option),
+                            index.options.get(option),
+                        )
+        existing.pop("_id_", None)
+        for name in existing:
+            log.warning("Unexpected index %s.%s", collection_name, name)
+
+
+def _plan_stages(plan: typing.Mapping[str, typing.Any]) -> typing.List[str]:
+    stage = plan["stage"]
+    if "indexName" in plan:
+        stage += f"({plan['indexName']})"
+    stages = [stage]
+    if "inputStage" in plan:
+        stages.extend(_plan_stages(plan["inputStage"]))
+    for input_stage in plan.get("inputStages", []):
+        stages.extend(_plan_stages(input_stage))
+    return stages
+
+
+async def explain(database: AsyncIOMotorDatabase) -> None:
+    """Print winning plans of registered query shapes."""
+    for shape in QUERY_SHAPES:
+        cursor = database[shape.collection].find(shape.query)
+        if shape.sort:
+            cursor = cursor.sort(list(shape.sort))
+        plan = await cursor.explain()
+        stages = _plan_stages(plan["queryPlanner"]["winningPlan"])
+        print(  # noqa: T001
+            "{}.{}: {}".format(shape.collection, shape.name, " <- ".join(stages))
+        )
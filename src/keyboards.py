@@ -0,0 +1,99 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Cache of keyboards serialized for each locale."""
+import json
+import typing
+from functools import wraps
+
+from aiogram.types import ReplyKeyboardMarkup
+
+from src.i18n import i18n
+
+
+class SerializedMarkup(str):
+    """Reply markup serialized to JSON.
+
+    Strings are sent to Telegram as is, so serialized markup can be
+    passed in place of markup object without being encoded again.
+    """
+
+
+class CachedKeyboard:
+    """Keyboard builder with results cached by locale and arguments."""
+
+    def __init__(
+        self,
+        build: typing.Callable[..., ReplyKeyboardMarkup],
+        variants: typing.Iterable[typing.Tuple],
+    ):
+        """Cache keyboards built by ``build`` with arguments in ``variants``."""
+        self.build = build
+        self.variants = variants
+        self._cache: typing.Dict[typing.Tuple, SerializedMarkup] = {}
+
+    def get(self, *args) -> SerializedMarkup:
+        """Get keyboard built with ``args`` in locale of current context."""
+        key = (i18n.ctx_locale.get(), *args)
+        markup = self._cache.get(key)
+        if markup is None:
+            markup = SerializedMarkup(json.dumps(self.build(*args).to_python()))
+            self._cache[key] = markup
+        return markup
+
+    def warm(self, locale: str) -> None:
+        """Build keyboards with all variants of arguments in ``locale``."""
+        token = i18n.ctx_locale.set(locale)
+        try:
+            for args in self.variants:
+                self.get(*args)
+        finally:
+            i18n.ctx_locale.reset(token)
+
+
+KEYBOARDS: typing.List[CachedKeyboard] = []
+
+
+def cached_keyboard(
+    variants: typing.Iterable[typing.Tuple] = ((),)
+) -> typing.Callable[
+    [typing.Callable[..., ReplyKeyboardMarkup]], typing.Callable[..., SerializedMarkup]
+]:
+    """Cache keyboards returned by decorated function as serialized markup.
+
+    :param variants: Arguments keyboards are built with at startup.
+    """
+
+    def decorator(
+        build: typing.Callable[..., ReplyKeyboardMarkup]
+    ) -> typing.Callable[..., SerializedMarkup]:
+        keyboard = CachedKeyboard(build, variants)
+        KEYBOARDS.append(keyboard)
+
+        @wraps(build)
+        def wrapper(*args) -> SerializedMarkup:
+            return keyboard.get(*args)
+
+        return wrapper
+
+    return decorator
+
+
+def build_keyboards() -> None:
+    """Build all variants of cached keyboards in every available locale."""
+    for locale in i18n.available_locales:
+        for keyboard in KEYBOARDS:
+            keyboard.warm(locale)
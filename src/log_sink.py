@@ -0,0 +1,146 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Buffered writer of history documents."""
+import asyncio
+import logging
+import typing
+from collections import deque
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError
+from pymongo.errors import PyMongoError
+
+from src.config import config
+from src.database import database
+
+log = logging.getLogger(__name__)
+
+#: Discard the oldest queued document when queue is full.
+DROP_OLDEST = "drop_oldest"
+#: Discard the document being queued when queue is full.
+DROP_NEWEST = "drop_newest"
+#: Make producer wait until queue is flushed when it is full.
+BLOCK = "block"
+
+
+class LogSink:
+    """Queue of documents flushed to collection in background.
+
+    Documents are inserted with unordered ``insert_many`` when queue
+    has at least ``batch_size`` documents or every ``flush_interval``
+    seconds, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        collection: AsyncIOMotorCollection,
+        max_size: int,
+        batch_size: int,
+        flush_interval: float,
+        overflow_policy: str = DROP_OLDEST,
+    ):
+        """Create empty queue of at most ``max_size`` documents."""
+        if overflow_policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.collection = collection
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        #: Number of documents discarded because queue was full.
+        self.dropped = 0
+        #: Number of documents inserted to collection.
+        self.written = 0
+        #: Number of documents which failed to be inserted.
+        self.failed = 0
+        self._queue: typing.Deque[typing.Dict[str, typing.Any]] = deque()
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: typing.Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """Get number of queued documents."""
+        return len(self._queue)
+
+    async def put(self, document: typing.Dict[str, typing.Any]) -> None:
+        """Queue ``document`` applying overflow policy if queue is full."""
+        if len(self._queue) >= self.max_size:
+            if self.overflow_policy == DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self.overflow_policy == DROP_OLDEST:
+                self._queue.popleft()
+                self.dropped += 1
+            else:
+                await self.flush()
+        self._queue.append(document)
+        if len(self._queue) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self) -> None:
+        """Insert all queued documents."""
+        async with self._flush_lock:
+            while self._queue:
+                batch_size = min(self.batch_size, len(self._queue))
+                batch = [self._queue.popleft() for _ in range(batch_size)]
+                try:
+                    await self.collection.insert_many(batch, ordered=False)
+                except BulkWriteError as error:
+                    inserted = error.details["nInserted"]
+                    self.written += inserted
+                    self.failed += batch_size - inserted
+                    log.error("Failed to insert %d logs", batch_size - inserted)
+                except PyMongoError:
+                    self.failed += batch_size
+                    log.exception("Failed to insert %d logs", batch_size)
+                else:
+                    self.written += batch_size
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Start flushing queue in background asynchronous task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop background flushing and insert remaining documents."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+log_sink = LogSink(
+    database.logs,
+    max_size=config.LOG_QUEUE_SIZE,
+    batch_size=config.LOG_BATCH_SIZE,
+    flush_interval=float(config.LOG_FLUSH_INTERVAL),
+    overflow_policy=config.LOG_OVERFLOW_POLICY,
+)
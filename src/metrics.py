@@ -0,0 +1,101 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Periodic reporting of runtime metrics to log."""
+import asyncio
+import logging
+import typing
+
+from src.config import config
+from src.geocoding import geocoder
+from src.log_sink import log_sink
+from src.send_scheduler import send_scheduler
+
+log = logging.getLogger(__name__)
+
+
+class MetricsReporter:
+    """Reporter logging metrics of bot components every ``interval`` seconds."""
+
+    def __init__(self, interval: float):
+        """Create reporter which isn't started yet."""
+        self.interval = interval
+        self._task: typing.Optional[asyncio.Task] = None
+        self._log_losses = (0, 0)
+
+    def report(self) -> None:
+        """Log current metrics."""
+        backlog = send_scheduler.backlog
+        log.info(
+            "Send scheduler: %d interactive and %d bulk messages waiting, "
+            "%d sent, %d retried after flood control",
+            backlog["interactive"],
+            backlog["bulk"],
+            send_scheduler.sent,
+            send_scheduler.retried,
+        )
+        cache = geocoder.cache
+        if cache is not None:
+            log.info(
+                "Geocoding cache: %.1f%% hit rate, %d in memory, "
+                "%d in database, %d misses",
+                cache.hit_rate * 100,
+                cache.local.hits,
+                cache.hits,
+                cache.misses,
+            )
+        if log_sink.depth or log_sink.written or log_sink.dropped or log_sink.failed:
+            log.info(
+                "Log sink: %d queued, %d written, %d dropped, %d failed",
+                log_sink.depth,
+                log_sink.written,
+                log_sink.dropped,
+                log_sink.failed,
+            )
+        dropped, failed = self._log_losses
+        if log_sink.dropped > dropped or log_sink.failed > failed:
+            log.warning(
+                "Log sink lost %d logs since last report: "
+                "%d dropped because queue was full and %d failed to be inserted",
+                log_sink.dropped - dropped + log_sink.failed - failed,
+                log_sink.dropped - dropped,
+                log_sink.failed - failed,
+            )
+        self._log_losses = (log_sink.dropped, log_sink.failed)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.report()
+
+    def start(self) -> None:
+        """Start reporting in background asynchronous task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop reporting and log final metrics."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.report()
+
+
+metrics_reporter = MetricsReporter(float(config.METRICS_INTERVAL))
@@ -0,0 +1,160 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Migrations of existing documents to current schema.
+
+Every migration only updates documents which haven't been migrated
+yet, so all of them can be safely run again.
+"""
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateMany
+from pymongo import UpdateOne
+
+from src.database import creator_snapshot
+from src.money import currency_fields
+from src.money import NO_PRICE
+
+#: Number of updates sent in one bulk write.
+BATCH_SIZE = 1000
+
+
+async def bulk_write(
+    collection: AsyncIOMotorCollection,
+    requests: typing.AsyncIterable[typing.Union[UpdateOne, UpdateMany]],
+) -> int:
+    """Send ``requests`` to ``collection`` in unordered bulk writes.
+
+    :return: Number of updated documents.
+    """
+    updated = 0
+    batch: typing.List[typing.Union[UpdateOne, UpdateMany]] = []
+    async for request in requests:
+        batch.append(request)
+        if len(batch) >= BATCH_SIZE:
+            result = await collection.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+    if batch:
+        result = await collection.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+    return updated
+
+
+async def bulk_update(
+    collection: AsyncIOMotorCollection,
+    query: typing.Mapping[str, typing.Any],
+    projection: typing.Mapping[str, typing.Any],
+    get_update: typing.Callable[
+        [typing.Mapping[str, typing.Any]], typing.Mapping[str, typing.Any]
+    ],
+) -> int:
+    """Update documents matching ``query`` with updates returned by ``get_update``.
+
+    :return: Number of updated documents.
+    """
+
+    async def requests() -> typing.AsyncIterator[UpdateOne]:
+        async for document in collection.find(query, projection=projection):
+            yield UpdateOne({"_id": document["_id"]}, get_update(document))
+
+    return await bulk_write(collection, requests())
+
+
+async def split_order_currencies(database: AsyncIOMotorDatabase) -> int:
+    """Store base currencies and gateways of orders in separate fields."""
+    return await bulk_update(
+        database.orders,
+        {"buy_base": {"$exists": False}},
+        {"buy": True, "sell": True},
+        lambda order: {"$set": currency_fields(order["buy"], order["sell"])},
+    )
+
+
+async def add_order_price_keys(database: AsyncIOMotorDatabase) -> int:
+    """Store sortable price key of orders."""
+    return await bulk_update(
+        database.orders,
+        {"price_key": {"$exists": False}},
+        {"price_buy": True},
+        lambda order: {"$set": {"price_key": order.get("price_buy", NO_PRICE)}},
+    )
+
+
+async def add_order_creators(database: AsyncIOMotorDatabase) -> int:
+    """Store snapshot of creator in their orders."""
+
+    async def requests() -> typing.AsyncIterator[UpdateMany]:
+        cursor = database.users.find(
+            {"mention": {"$exists": True}},
+            projection={"id": True, "mention": True, "has_username": True},
+        )
+        async for user in cursor:
+            yield UpdateMany(
+                {"user_id": user["id"], "creator": {"$exists": False}},
+                {"$set": {"creator": creator_snapshot(user)}},
+            )
+
+    return await bulk_write(database.orders, requests())
+
+
+async def count_referrals(database: AsyncIOMotorDatabase) -> int:
+    """Store number of referrals of users in ``referral_count``.
+
+    Counts are recomputed from scratch and users without referrals get
+    zero count. Bot must be stopped, since it increments counts of
+    referrers of new users.
+    """
+    referrer_ids: typing.List[int] = []
+
+    async def requests() -> typing.AsyncIterator[UpdateOne]:
+        cursor = database.users.aggregate(
+            [
+                {"$match": {"referrer": {"$exists": True}}},
+                {"$group": {"_id": "$referrer", "count": {"$sum": 1}}},
+            ]
+        )
+        async for referrer in cursor:
+            referrer_ids.append(referrer["_id"])
+            yield UpdateOne(
+                {"id": referrer["_id"]}, {"$set": {"referral_count": referrer["count"]}}
+            )
+
+    updated = await bulk_write(database.users, requests())
+    result = await database.users.update_many(
+        {"id": {"$nin": referrer_ids}, "referral_count": {"$ne": 0}},
+        {"$set": {"referral_count": 0}},
+    )
+    return updated + result.modified_count
+
+
+MIGRATIONS: typing.List[
+    typing.Callable[[AsyncIOMotorDatabase], typing.Awaitable[int]]
+] = [
+    split_order_currencies,
+    add_order_price_keys,
+    add_order_creators,
+    count_referrals,
+]
+
+
+async def migrate(database: AsyncIOMotorDatabase) -> None:
+    """Run all migrations and print number of documents updated by them."""
+    for migration in MIGRATIONS:
+        updated = await migration(database)
+        print(f"{migration.__name__}: {updated}")  # noqa: T001
@@ -15,18 +15,48 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
 import decimal
-import re
+import typing
 from decimal import Decimal
 
+from bson.decimal128 import Decimal128
+
 from src.i18n import i18n
 
 HIGH_EXP = Decimal("1e15")
 LOW_EXP = Decimal("1e-8")
 
+#: Price key of orders without price, which is greater than any price.
+NO_PRICE = Decimal128("Infinity")
+
+
+def split_currency(currency: str) -> typing.Tuple[typing.Optional[str], str]:
+    """Split ``currency`` into gateway or None if it's absent and base currency."""
+    gateway, _, base = currency.rpartition(".")
+    return gateway or None, base
+
+
+def currency_fields(buy: str, sell: str) -> typing.Dict[str, typing.Optional[str]]:
+    """Get fields of order with base currencies and gateways of ``buy`` and ``sell``."""
+    buy_gateway, buy_base = split_currency(buy)
+    sell_gateway, sell_base = split_currency(sell)
+    return {
+        "buy_base": buy_base,
+        "buy_gateway": buy_gateway,
+        "sell_base": sell_base,
+        "sell_gateway": sell_gateway,
+    }
+
+
+def currency_filter(field: str, currency: str) -> typing.Dict[str, str]:
+    """Get filter of orders with ``currency`` in ``field``.
 
-def gateway_currency_regexp(currency):
-    """Return regexp that ignores gateway if it isn't specified."""
-    return currency if "." in currency else re.compile(fr"^(\w+\.)?{currency}$")
+    Gateway is ignored if ``currency`` doesn't specify it.
+    """
+    gateway, base = split_currency(currency)
+    query = {f"{field}_base": base}
+    if gateway is not None:
+        query[f"{field}_gateway"] = gateway
+    return query
 
 
 def normalize(money: Decimal, exp: Decimal = LOW_EXP) -> Decimal:
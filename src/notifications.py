@@ -15,44 +15,148 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
 import asyncio
+import heapq
 import typing
 from time import time
 
+import pymongo
+from aiogram import types
 from aiogram.utils.exceptions import TelegramAPIError
+from bson.objectid import ObjectId
 
 from src.bot import tg
+from src.config import config
 from src.database import database
 from src.handlers.base import show_order
 from src.i18n import i18n
-from src.money import gateway_currency_regexp
+from src.i18n import plural_i18n
+from src.indexes import register_index
+from src.indexes import register_query
+from src.order_book import order_book
+from src.send_scheduler import BULK
+from src.send_scheduler import send_priority
+from src.subscriptions import subscription_index
 
 
-async def run_loop():
-    """Notify order creators about expired orders in infinite loop."""
-    while True:
+register_index(
+    "orders", [("notify", pymongo.ASCENDING), ("expiration_time", pymongo.ASCENDING)]
+)
+register_query("orders", "expired", {"notify": True, "expiration_time": {"$lte": 0}})
+
+
+class ExpiryScheduler:
+    """Schedule of notifications about expired orders.
+
+    Expiration times are kept in a heap, so background task sleeps
+    until the earliest of them. Heap entries are not removed when
+    order is rescheduled and are skipped instead if they don't match
+    the latest scheduled expiration time.
+    """
+
+    def __init__(self):
+        """Create empty schedule."""
+        self._heap: typing.List[typing.Tuple[float, ObjectId]] = []
+        self._scheduled: typing.Dict[ObjectId, float] = {}
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, order_id: ObjectId, expiration_time: float) -> None:
+        """Schedule notification about order ``order_id`` at ``expiration_time``."""
+        if self._scheduled.get(order_id) == expiration_time:
+            return
+        self._scheduled[order_id] = expiration_time
+        heapq.heappush(self._heap, (expiration_time, order_id))
+        if self._heap[0][1] == order_id:
+            self._wakeup.set()
+
+    def unschedule(self, order_id: ObjectId) -> None:
+        """Cancel notification about order ``order_id``."""
+        self._scheduled.pop(order_id, None)
+
+    async def load(self) -> None:
+        """Schedule notifications about all orders with enabled notifications.
+
+        Orders without expiration time never expire and are skipped.
+        """
         cursor = database.orders.find(
-            {"expiration_time": {"$lte": time()}, "notify": True}
+            {"notify": True, "expiration_time": {"$exists": True}},
+            projection={"expiration_time": True},
         )
-        sent = False
         async for order in cursor:
-            user = await database.users.find_one({"id": order["user_id"]})
-            message = i18n("order_expired", locale=user["locale"])
-            message += "\nID: {}".format(order["_id"])
+            self.schedule(order["_id"], order["expiration_time"])
+
+    def _pop_expired(self) -> typing.List[ObjectId]:
+        current_time = time()
+        expired = []
+        while self._heap and self._heap[0][0] <= current_time:
+            expiration_time, order_id = heapq.heappop(self._heap)
+            if self._scheduled.get(order_id) == expiration_time:
+                del self._scheduled[order_id]
+                expired.append(order_id)
+        return expired
+
+    async def run(self) -> None:
+        """Notify order creators about expired orders in infinite loop."""
+        send_priority.set(BULK)
+        await self.load()
+        while True:
+            for order_id in self._pop_expired():
+                await notify_expired(order_id)
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time() if self._heap else None
             try:
-                if sent:
-                    await asyncio.sleep(1)  # Avoid Telegram limit
-                await tg.send_message(user["chat"], message)
-            except TelegramAPIError:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
                 pass
-            else:
-                await show_order(order, user["chat"], user["id"], locale=user["locale"])
-                sent = True
-            finally:
-                await database.orders.update_one(
-                    {"_id": order["_id"]}, {"$set": {"notify": False}}
-                )
-        if not sent:
-            await asyncio.sleep(1)  # Reduce database load
+
+
+expiry_scheduler = ExpiryScheduler()
+
+
+async def notify_expired(order_id: ObjectId) -> bool:
+    """Notify creator of order ``order_id`` if it is expired.
+
+    :return: True if notification was sent and False otherwise.
+    """
+    order = await database.orders.find_one_and_update(
+        {"_id": order_id, "expiration_time": {"$lte": time()}, "notify": True},
+        {"$set": {"notify": False}},
+    )
+    if not order:
+        return False
+    user = await database.users.find_one({"id": order["user_id"]})
+    message = i18n("order_expired", locale=user["locale"])
+    message += "\nID: {}".format(order["_id"])
+    try:
+        await tg.send_message(user["chat"], message)
+    except TelegramAPIError:
+        return False
+    await show_order(order, user["chat"], user["id"], locale=user["locale"])
+    return True
+
+
+async def run_loop():
+    """Notify order creators about expired orders in infinite loop."""
+    await expiry_scheduler.run()
+
+
+#: Number of subscribers notified between checks that order is still active.
+NOTIFICATION_BATCH_SIZE = 30
+
+
+async def notify_subscriber(
+    order: typing.Mapping[str, typing.Any], user: typing.Mapping[str, typing.Any]
+) -> None:
+    """Show ``order`` to subscribed ``user``."""
+    try:
+        await show_order(
+            order,
+            user["chat"],
+            user["id"],
+            show_id=True,
+            locale=user.get("locale", i18n.default),
+        )
+    except TelegramAPIError:
+        pass
 
 
 async def order_notification(order: typing.Mapping[str, typing.Any]):
@@ -60,25 +164,87 @@ async def order_notification(order: typing.Mapping[str, typing.Any]):
 
     Subscriptions to these notifications are managed with
     **/subscribe** or **/unsubscribe** commands of ``start_menu``
-    handlers.
+    handlers. Subscribers are notified in batches and notification
+    stops if order is archived or deleted.
     """
-    users = database.subscriptions.find(
-        {
-            "subscriptions": {
-                "$elemMatch": {
-                    "buy": {"$in": [gateway_currency_regexp(order["buy"]), None]},
-                    "sell": {"$in": [gateway_currency_regexp(order["sell"]), None]},
-                }
-            },
-        }
-    )
-    async for user in users:
-        if user["id"] == order["user_id"]:
-            continue
+    send_priority.set(BULK)
+    user_ids = [
+        user_id
+        for user_id in subscription_index.subscribers(order["sell"], order["buy"])
+        if user_id != order["user_id"]
+    ]
+    for i in range(0, len(user_ids), NOTIFICATION_BATCH_SIZE):
         order = await database.orders.find_one({"_id": order["_id"]})  # Update order
         if not order or order.get("archived"):
             return
-        await show_order(
-            order, user["chat"], user["id"], show_id=True, locale=user["locale"]
+        cursor = database.users.find(
+            {"id": {"$in": user_ids[i : i + NOTIFICATION_BATCH_SIZE]}},
+            projection={"id": True, "chat": True, "locale": True},
         )
-        await asyncio.sleep(1)  # Avoid Telegram limit
+        await asyncio.gather(*[notify_subscriber(order, user) async for user in cursor])
+
+
+async def notify_counter_creator(
+    order: typing.Mapping[str, typing.Any],
+    counter: typing.Mapping[str, typing.Any],
+    user: typing.Mapping[str, typing.Any],
+) -> None:
+    """Show ``order`` crossing ``counter`` to its creator ``user``."""
+    locale = user.get("locale", i18n.default)
+    message = i18n("order_crossed", locale=locale)
+    message += "\nID: {}".format(counter["_id"])
+    try:
+        await tg.send_message(user["chat"], message)
+        await show_order(order, user["chat"], user["id"], show_id=True, locale=locale)
+    except TelegramAPIError:
+        pass
+
+
+async def notify_matches(order: typing.Mapping[str, typing.Any]):
+    """Notify creators of ``order`` and orders crossing it about match.
+
+    Creator of ``order`` is told how many orders cross it. Creators of
+    the first ``ORDERS_COUNT`` crossing orders in price-time priority
+    are shown ``order`` once regardless of number of their orders.
+    """
+    matches = order_book.crossing(order)
+    if not matches:
+        return
+    send_priority.set(BULK)
+    counters: typing.Dict[int, typing.Mapping[str, typing.Any]] = {}
+    for counter in matches[: config.ORDERS_COUNT]:
+        counters.setdefault(counter["user_id"], counter)
+    cursor = database.users.find(
+        {"id": {"$in": [order["user_id"], *counters]}},
+        projection={"id": True, "chat": True, "locale": True},
+    )
+    users = {user["id"]: user async for user in cursor}
+
+    creator = users.get(order["user_id"])
+    if creator is not None:
+        locale = creator.get("locale", i18n.default)
+        keyboard = types.InlineKeyboardMarkup()
+        keyboard.row(
+            types.InlineKeyboardButton(
+                i18n("match", locale=locale),
+                callback_data="match {}".format(order["_id"]),
+            )
+        )
+        message = plural_i18n(
+            "crossing_orders_singular {count}",
+            "crossing_orders_plural {count}",
+            len(matches),
+            locale=locale,
+        ).format(count=len(matches))
+        try:
+            await tg.send_message(creator["chat"], message, reply_markup=keyboard)
+        except TelegramAPIError:
+            pass
+
+    await asyncio.gather(
+        *[
+            notify_counter_creator(order, counter, users[user_id])
+            for user_id, counter in counters.items()
+            if user_id in users
+        ]
+    )
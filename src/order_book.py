@@ -0,0 +1,427 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""In-memory book of active orders."""
+import asyncio
+import heapq
+import itertools
+import logging
+import typing
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
+from decimal import localcontext
+from time import time
+
+from bson.objectid import ObjectId
+
+from src.config import config
+from src.database import database
+from src.money import NO_PRICE
+from src.money import split_currency
+
+log = logging.getLogger(__name__)
+
+#: Page of book starting after anchor order.
+AFTER = ">"
+#: Page of book ending before anchor order.
+BEFORE = "<"
+#: Page of book starting with anchor order.
+FROM = "="
+
+#: Number of significant digits of Decimal128.
+DECIMAL128_DIGITS = 34
+
+OrderType = typing.Mapping[str, typing.Any]
+SortKey = typing.Tuple[typing.Any, ...]
+Entry = typing.Tuple[SortKey, ObjectId]
+
+
+class BookFilter(typing.NamedTuple):
+    """Filter of active orders answered by order book.
+
+    Currencies may be given with or without gateway, in which case
+    gateway is ignored.
+    """
+
+    #: Currency which orders sell.
+    sell: typing.Optional[str] = None
+    #: Currency which orders buy.
+    buy: typing.Optional[str] = None
+    #: Currency which orders either sell or buy.
+    currency: typing.Optional[str] = None
+    #: Sort orders by price instead of creation time.
+    by_price: bool = False
+
+
+def active_filter(current_time: float) -> typing.Dict[str, typing.Any]:
+    """Get filter of orders which are neither archived nor expired.
+
+    Filter selects orders for which ``is_active`` is True.
+    """
+    return {
+        "$or": [{"archived": {"$exists": False}}, {"archived": False}],
+        "expiration_time": {"$gt": current_time},
+    }
+
+
+def is_active(order: OrderType, current_time: float) -> bool:
+    """Check if ``order`` is neither archived nor expired.
+
+    Orders without expiration time are considered expired, as in
+    queries of active orders.
+    """
+    return not order.get("archived") and order.get("expiration_time", 0) > current_time
+
+
+def _id_key(order_id: ObjectId) -> int:
+    # Negated, so that ascending order of keys is descending order of IDs.
+    return -int.from_bytes(order_id.binary, "big")
+
+
+def newest_key(order: OrderType) -> SortKey:
+    """Get key sorting orders from the newest to the oldest."""
+    return (-order["start_time"], _id_key(order["_id"]))
+
+
+def price_key(order: OrderType) -> SortKey:
+    """Get key sorting orders by price and then from the newest to the oldest."""
+    price = order.get("price_key", order.get("price_buy", NO_PRICE))
+    return (price.to_decimal(), *newest_key(order))
+
+
+def _currency_matches(order_currency: str, currency: str) -> bool:
+    gateway, base = split_currency(currency)
+    if gateway is None:
+        return split_currency(order_currency)[1] == base
+    return order_currency == currency
+
+
+def compatible_currencies(first: str, second: str) -> bool:
+    """Check if ``first`` and ``second`` are the same currency.
+
+    Currency without gateway is compatible with any gateway.
+    """
+    first_gateway, first_base = split_currency(first)
+    second_gateway, second_base = split_currency(second)
+    return first_base == second_base and (
+        first_gateway is None
+        or second_gateway is None
+        or first_gateway == second_gateway
+    )
+
+
+def crosses(order: OrderType, counter: OrderType) -> bool:
+    """Check if prices of ``order`` and ``counter`` with inverted pair cross.
+
+    Prices cross if each order gets at least as much as it asks, that
+    is if product of their buy prices doesn't exceed one. Product is
+    computed with enough precision to be exact, so prices which cross
+    only after rounding don't match.
+    """
+    with localcontext() as context:
+        context.prec = 2 * DECIMAL128_DIGITS
+        product = order["price_buy"].to_decimal() * counter["price_buy"].to_decimal()
+        return product <= 1
+
+
+class OrderBook:
+    """Active orders sorted in memory by currency pairs.
+
+    Every order is placed in sorted lists of all orders, orders with
+    its sell currency, orders with its buy currency and orders with its
+    pair, so pages and counts are answered with binary search without
+    querying database. Database remains source of truth: book is
+    updated after every write to active orders and is periodically
+    reloaded to correct any drift.
+    """
+
+    def __init__(self):
+        """Create empty book."""
+        self.loaded = False
+        self._orders: typing.Dict[ObjectId, OrderType] = {}
+        self._lists: typing.Dict[typing.Tuple[str, ...], typing.List[Entry]] = {}
+        self._by_user: typing.Dict[int, typing.Set[ObjectId]] = {}
+        self._expirations: typing.List[typing.Tuple[float, ObjectId]] = []
+        self._changed_while_loading: typing.Optional[typing.Set[ObjectId]] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Get number of orders in book."""
+        return len(self._orders)
+
+    @staticmethod
+    def _placements(
+        order: OrderType,
+    ) -> typing.Iterator[typing.Tuple[typing.Tuple[str, ...], SortKey]]:
+        sell = split_currency(order["sell"])[1]
+        buy = split_currency(order["buy"])[1]
+        key = newest_key(order)
+        yield ("all",), key
+        yield ("sell", sell), key
+        yield ("buy", buy), key
+        yield ("pair", sell, buy), key
+        yield ("pair_price", sell, buy), price_key(order)
+
+    def _insert(self, order: OrderType) -> None:
+        self._orders[order["_id"]] = order
+        self._by_user.setdefault(order["user_id"], set()).add(order["_id"])
+        for name, key in self._placements(order):
+            insort(self._lists.setdefault(name, []), (key, order["_id"]))
+        heapq.heappush(self._expirations, (order["expiration_time"], order["_id"]))
+
+    def _delete(self, order_id: ObjectId) -> None:
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return
+        user_orders = self._by_user[order["user_id"]]
+        user_orders.discard(order_id)
+        if not user_orders:
+            del self._by_user[order["user_id"]]
+        for name, key in self._placements(order):
+            entries = self._lists[name]
+            del entries[bisect_left(entries, (key, order_id))]
+            if not entries:
+                del self._lists[name]
+
+    def update(self, order: OrderType) -> None:
+        """Reflect written state of ``order`` in book."""
+        if self._changed_while_loading is not None:
+            self._changed_while_loading.add(order["_id"])
+        self._delete(order["_id"])
+        if is_active(order, time()):
+            self._insert(order)
+
+    def remove(self, order_id: ObjectId) -> None:
+        """Remove order ``order_id`` from book."""
+        if self._changed_while_loading is not None:
+            self._changed_while_loading.add(order_id)
+        self._delete(order_id)
+
+    async def refresh(self, order_id: ObjectId) -> None:
+        """Read order ``order_id`` from database and reflect it in book."""
+        order = await database.orders.find_one({"_id": order_id})
+        if order is None:
+            self.remove(order_id)
+        else:
+            self.update(order)
+
+    def update_creator(self, user_id: int, creator: typing.Dict[str, typing.Any]):
+        """Replace snapshot of creator ``user_id`` in their orders with ``creator``.
+
+        If mention of creator changed, it is also marked as not being
+        username of other creators with the same mention.
+        """
+        order_ids = self._by_user.get(user_id, ())
+        changed = [
+            self._orders[order_id]
+            for order_id in order_ids
+            if self._orders[order_id].get("creator") != creator
+        ]
+        if not changed:
+            return
+        mention_changed = any(
+            order.get("creator", {}).get("mention") != creator["mention"]
+            for order in changed
+        )
+        for order in changed:
+            order["creator"] = creator
+        if mention_changed:
+            for order in self._orders.values():
+                other = order.get("creator")
+                if (
+                    order["user_id"] != user_id
+                    and other is not None
+                    and other["mention"] == creator["mention"]
+                ):
+                    order["creator"] = {**other, "has_username": False}
+
+    def _expire(self) -> None:
+        # Heap entries of removed or rescheduled orders are skipped.
+        current_time = time()
+        while self._expirations and self._expirations[0][0] <= current_time:
+            expiration_time, order_id = heapq.heappop(self._expirations)
+            order = self._orders.get(order_id)
+            if order is not None and order["expiration_time"] == expiration_time:
+                self._delete(order_id)
+
+    async def load(self) -> None:
+        """Replace book with active orders from database.
+
+        Orders updated while database is read are read again after
+        replacement, so that their updates are not lost.
+        """
+        self._changed_while_loading = set()
+        try:
+            fresh = OrderBook()
+            cursor = database.orders.find(active_filter(time()))
+            async for order in cursor:
+                fresh._insert(order)
+            changed = self._changed_while_loading
+        finally:
+            self._changed_while_loading = None
+
+        if self.loaded:
+            self._expire()
+            drift = sum(
+                self._orders.get(order_id) != order
+                for order_id, order in fresh._orders.items()
+            ) + sum(order_id not in fresh._orders for order_id in self._orders)
+            if drift:
+                log.warning("Order book drifted from database by %d orders", drift)
+        self._orders = fresh._orders
+        self._lists = fresh._lists
+        self._by_user = fresh._by_user
+        self._expirations = fresh._expirations
+        self.loaded = True
+        for order_id in changed:
+            await self.refresh(order_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(config.ORDER_BOOK_RECONCILE_INTERVAL)
+            try:
+                await self.load()
+            except Exception:
+                log.exception("Failed to reconcile order book")
+
+    async def start(self) -> None:
+        """Load book and start reconciling it with database in background."""
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def _entries(self, book_filter: BookFilter) -> typing.Optional[typing.List[Entry]]:
+        def bucket(*name: str) -> typing.List[Entry]:
+            return self._lists.get(name, [])
+
+        if book_filter.currency is not None:
+            base = split_currency(book_filter.currency)[1]
+            # Currencies of pair are distinct, so merged lists are disjoint.
+            entries = list(heapq.merge(bucket("sell", base), bucket("buy", base)))
+            if "." in book_filter.currency:
+                entries = [
+                    entry
+                    for entry in entries
+                    if _currency_matches(
+                        self._orders[entry[1]]["sell"], book_filter.currency
+                    )
+                    or _currency_matches(
+                        self._orders[entry[1]]["buy"], book_filter.currency
+                    )
+                ]
+            return entries if not book_filter.by_price else None
+
+        sell, buy = book_filter.sell, book_filter.buy
+        if sell is not None and buy is not None:
+            name = "pair_price" if book_filter.by_price else "pair"
+            entries = bucket(name, split_currency(sell)[1], split_currency(buy)[1])
+        elif book_filter.by_price:
+            return None
+        elif sell is not None:
+            entries = bucket("sell", split_currency(sell)[1])
+        elif buy is not None:
+            entries = bucket("buy", split_currency(buy)[1])
+        else:
+            entries = bucket("all")
+
+        for field, currency in (("sell", sell), ("buy", buy)):
+            if currency is not None and "." in currency:
+                entries = [
+                    entry
+                    for entry in entries
+                    if _currency_matches(self._orders[entry[1]][field], currency)
+                ]
+        return entries
+
+    def crossing(self, order: OrderType) -> typing.List[OrderType]:
+        """Get orders of other users crossing ``order`` in price-time priority.
+
+        Orders of inverted pair are sorted by buy price, so crossing
+        orders are the prefix of the list, end of which is found with
+        binary search. Orders with the same price are ranked from the
+        oldest to the newest.
+        """
+        if not self.loaded or "price_buy" not in order:
+            return []
+        self._expire()
+        sell = split_currency(order["sell"])[1]
+        buy = split_currency(order["buy"])[1]
+        entries = self._lists.get(("pair_price", buy, sell), [])
+
+        low, high = 0, len(entries)
+        while low < high:
+            middle = (low + high) // 2
+            counter = self._orders[entries[middle][1]]
+            if "price_buy" in counter and crosses(order, counter):
+                low = middle + 1
+            else:
+                high = middle
+
+        result = []
+        # Orders with the same price are sorted from the newest.
+        for _, group in itertools.groupby(entries[:low], key=lambda entry: entry[0][0]):
+            for _, counter_id in reversed(list(group)):
+                counter = self._orders[counter_id]
+                if (
+                    counter["user_id"] != order["user_id"]
+                    and compatible_currencies(counter["sell"], order["buy"])
+                    and compatible_currencies(counter["buy"], order["sell"])
+                ):
+                    result.append(counter)
+        return result
+
+    def page(
+        self,
+        book_filter: BookFilter,
+        start: int,
+        anchor: typing.Optional[typing.Tuple[str, ObjectId]] = None,
+    ) -> typing.Optional[typing.Tuple[typing.List[OrderType], int]]:
+        """Get page of orders and quantity of all orders matching ``book_filter``.
+
+        Page is positioned relative to anchor order if it is still in
+        book. Otherwise, first ``start`` orders are skipped.
+
+        :return: Page and quantity or None if book can't answer query.
+        """
+        if not self.loaded:
+            return None
+        self._expire()
+        entries = self._entries(book_filter)
+        if entries is None:
+            return None
+
+        limit = config.ORDERS_COUNT
+        anchor_order = self._orders.get(anchor[1]) if anchor else None
+        if anchor_order is not None:
+            kind, order_id = anchor
+            sort_key = price_key if book_filter.by_price else newest_key
+            entry = (sort_key(anchor_order), order_id)
+            if kind == BEFORE:
+                end = bisect_left(entries, entry)
+                page = entries[max(0, end - limit) : end]
+            elif kind == AFTER:
+                begin = bisect_right(entries, entry)
+                page = entries[begin : begin + limit]
+            else:
+                begin = bisect_left(entries, entry)
+                page = entries[begin : begin + limit]
+        else:
+            page = entries[start : start + limit]
+        return [self._orders[order_id] for _, order_id in page], len(entries)
+
+
+order_book = OrderBook()
@@ -0,0 +1,175 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Rate limiting of messages sent to Telegram."""
+import asyncio
+import math
+import typing
+from collections import deque
+from collections import OrderedDict
+from contextvars import ContextVar
+from time import monotonic
+
+from src.cache import LRUCache
+from src.config import config
+
+#: Priority of replies to users' actions.
+INTERACTIVE = 0
+#: Priority of notifications sent to many users.
+BULK = 1
+
+#: Priority of messages sent in current context.
+send_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """Token bucket refilled with ``rate`` tokens per second up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float):
+        """Create full bucket."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Get number of seconds until token is available."""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        """Take one token from bucket."""
+        self._refill(now)
+        self.tokens -= 1
+
+
+class SendScheduler:
+    """Scheduler of sending messages within global and per-chat rate limits.
+
+    Senders wait in queues of their priority grouped by chat. Waiters
+    of higher priority are let through first unless their chat is
+    throttled, in which case waiters of other chats are not held up.
+    """
+
+    def __init__(self, rate: float, chat_rate: float, chat_burst: float):
+        """Create scheduler with limits on messages per second."""
+        self._global = TokenBucket(rate, rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        # Full buckets don't differ from new ones, so they can expire
+        # after the time it takes to refill them.
+        self._chats: LRUCache[typing.Union[int, str], TokenBucket] = LRUCache(
+            100_000, chat_burst / chat_rate
+        )
+        self._queues: typing.List[
+            "OrderedDict[typing.Union[int, str], typing.Deque[asyncio.Future]]"
+        ] = [OrderedDict(), OrderedDict()]
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: typing.Optional[asyncio.Task] = None
+        #: Number of messages let through.
+        self.sent = 0
+        #: Number of requests retried after flood control error.
+        self.retried = 0
+
+    @property
+    def backlog(self) -> typing.Dict[str, int]:
+        """Get number of waiting senders of each priority."""
+        return {
+            name: sum(len(waiters) for waiters in self._queues[priority].values())
+            for name, priority in (("interactive", INTERACTIVE), ("bulk", BULK))
+        }
+
+    def _chat_bucket(self, chat_id: typing.Union[int, str]) -> TokenBucket:
+        bucket = self._chats.peek(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id: typing.Union[int, str]) -> None:
+        """Wait until message can be sent to chat ``chat_id``."""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[send_priority.get()]
+        queue.setdefault(chat_id, deque()).append(future)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        await future
+
+    def pause(self, seconds: float) -> None:
+        """Stop letting messages through for ``seconds``."""
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+        self.retried += 1
+
+    def _grant(self) -> typing.Optional[float]:
+        """Let through as many waiters as limits allow.
+
+        :return: Number of seconds until next waiter can be let through
+            or None if there are no waiters.
+        """
+        while any(self._queues):
+            now = monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                return global_delay
+
+            next_delay = math.inf
+            for queue in self._queues:
+                for chat_id, waiters in queue.items():
+                    bucket = self._chat_bucket(chat_id)
+                    chat_delay = bucket.delay(now)
+                    if chat_delay == 0:
+                        break
+                    next_delay = min(next_delay, chat_delay)
+                else:
+                    continue
+                break
+            else:
+                return next_delay
+
+            future = waiters.popleft()
+            if not waiters:
+                del queue[chat_id]
+            if future.done():
+                continue
+            self._global.consume(now)
+            bucket.consume(now)
+            self._chats.set(chat_id, bucket)
+            self.sent += 1
+            future.set_result(None)
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            delay = self._grant()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+send_scheduler = SendScheduler(
+    float(config.MESSAGES_PER_SECOND),
+    float(config.CHAT_MESSAGES_PER_SECOND),
+    float(config.CHAT_MESSAGES_BURST),
+)
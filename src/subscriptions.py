@@ -0,0 +1,118 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Subscriptions to notifications about new orders."""
+import itertools
+import typing
+from collections import Counter
+from collections import defaultdict
+
+import pymongo
+
+from src.database import database
+from src.indexes import register_index
+from src.indexes import register_query
+from src.money import split_currency
+
+
+register_index("subscriptions", [("id", pymongo.ASCENDING)])
+register_query("subscriptions", "subscription", {"id": 0})
+
+
+class SubscriptionIndex:
+    """In-memory index of subscriptions to currency pairs.
+
+    Subscribers are grouped by subscribed pair, so users interested in
+    order are found with a few dictionary lookups. Order currency
+    without gateway matches subscribed currency with any gateway,
+    order currency with gateway matches only the same currency and
+    ``None`` matches any currency.
+    """
+
+    def __init__(self):
+        """Create empty index."""
+        self._pairs: typing.Dict[
+            typing.Tuple[typing.Optional[str], typing.Optional[str]], typing.Set[int]
+        ] = {}
+        #: Subscribed currencies with gateways mapped to their base
+        #: currencies and counted by number of subscribed pairs.
+        self._gateways: typing.DefaultDict[str, typing.Counter[str]] = defaultdict(
+            Counter
+        )
+
+    def _gateway_currencies(
+        self, pair: typing.Tuple[typing.Optional[str], typing.Optional[str]]
+    ) -> typing.Iterator[typing.Tuple[str, str]]:
+        for currency in pair:
+            if currency is not None:
+                gateway, base = split_currency(currency)
+                if gateway is not None:
+                    yield base, currency
+
+    def add(self, user_id: int, subscription: typing.Mapping[str, typing.Any]) -> None:
+        """Add subscription of user ``user_id``."""
+        pair = (subscription["sell"], subscription["buy"])
+        subscribers = self._pairs.get(pair)
+        if subscribers is None:
+            subscribers = self._pairs[pair] = set()
+            for base, currency in self._gateway_currencies(pair):
+                self._gateways[base][currency] += 1
+        subscribers.add(user_id)
+
+    def remove(
+        self, user_id: int, subscription: typing.Mapping[str, typing.Any]
+    ) -> None:
+        """Remove subscription of user ``user_id``."""
+        pair = (subscription["sell"], subscription["buy"])
+        subscribers = self._pairs.get(pair)
+        if subscribers is None:
+            return
+        subscribers.discard(user_id)
+        if subscribers:
+            return
+        del self._pairs[pair]
+        for base, currency in self._gateway_currencies(pair):
+            currencies = self._gateways[base]
+            currencies[currency] -= 1
+            if currencies[currency] <= 0:
+                del currencies[currency]
+            if not currencies:
+                del self._gateways[base]
+
+    async def load(self) -> None:
+        """Add all subscriptions from database."""
+        self._pairs.clear()
+        self._gateways.clear()
+        async for document in database.subscriptions.find():
+            for subscription in document["subscriptions"]:
+                self.add(document["id"], subscription)
+
+    def _currency_keys(self, currency: str) -> typing.List[typing.Optional[str]]:
+        if split_currency(currency)[0] is not None:
+            return [None, currency]
+        return [None, currency, *self._gateways.get(currency, ())]
+
+    def subscribers(self, sell: str, buy: str) -> typing.Set[int]:
+        """Get IDs of users subscribed to orders selling ``sell`` for ``buy``."""
+        result: typing.Set[int] = set()
+        for pair in itertools.product(
+            self._currency_keys(sell), self._currency_keys(buy)
+        ):
+            result.update(self._pairs.get(pair, ()))
+        return result
+
+
+subscription_index = SubscriptionIndex()
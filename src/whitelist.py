@@ -23,6 +23,7 @@ from aiogram.types import ReplyKeyboardMarkup
 from aiogram.utils.emoji import emojize
 
 from src.i18n import i18n
+from src.keyboards import cached_keyboard
 
 FIAT: Tuple[str, ...] = ("CNY", "EUR", "RUB", "UAH", "USD")
 
@@ -43,6 +44,7 @@ CRYPTOCURRENCY: Mapping[str, Tuple[str, ...]] = {
 }
 
 
+@cached_keyboard([("sell",), ("buy",)])
 def currency_keyboard(currency_type: str) -> ReplyKeyboardMarkup:
     """Get keyboard with currencies from whitelists."""
     keyboard = ReplyKeyboardMarkup(
@@ -61,6 +63,14 @@ def currency_keyboard(currency_type: str) -> ReplyKeyboardMarkup:
     return keyboard
 
 
+@cached_keyboard(
+    [
+        (currency, currency_type)
+        for currency, gateways in CRYPTOCURRENCY.items()
+        if gateways
+        for currency_type in ("sell", "buy")
+    ]
+)
 def gateway_keyboard(currency: str, currency_type: str) -> ReplyKeyboardMarkup:
     """Get keyboard with gateways of ``currency`` from whitelist."""
     keyboard = ReplyKeyboardMarkup(
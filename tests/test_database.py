@@ -0,0 +1,148 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of buffered writes to user documents."""
+import asyncio
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from src import database
+from src.database import apply_update
+from src.database import PreferenceBuffer
+from src.database import UserUpdateBuffer
+
+
+def merged(*updates):
+    """Merge ``updates`` into empty buffer and get merged update."""
+    buffer = UserUpdateBuffer({"_id": 1, "id": 1})
+    for update in updates:
+        buffer.merge(update)
+    return {operator: fields for operator, fields in buffer.update.items() if fields}
+
+
+def test_merge_later_write_overrides_field():
+    """Later write to the same field replaces earlier one."""
+    assert merged(
+        {"$set": {"state": "a"}}, {"$unset": {"state": True}}, {"$set": {"state": "b"}}
+    ) == {"$set": {"state": "b"}}
+
+
+def test_merge_parent_write_overrides_embedded_fields():
+    """Write to parent field drops earlier writes to its embedded fields."""
+    assert merged({"$set": {"data.a": 1, "data.b": 2}}, {"$unset": {"data": True}}) == {
+        "$unset": {"data": True}
+    }
+
+
+def test_merge_embedded_write_into_set_parent():
+    """Write to embedded field of set parent is applied to its value."""
+    assert merged(
+        {"$set": {"data": {"a": 1, "b": 2}}},
+        {"$set": {"data.c": 3}},
+        {"$unset": {"data.a": True}},
+    ) == {"$set": {"data": {"b": 2, "c": 3}}}
+
+
+def test_merge_embedded_set_into_unset_parent():
+    """Setting embedded field of unset parent sets parent to new document."""
+    assert merged({"$unset": {"data": True}}, {"$set": {"data.a": 1}}) == {
+        "$set": {"data": {"a": 1}}
+    }
+
+
+def test_merge_embedded_unset_of_unset_parent():
+    """Unsetting embedded field of unset parent keeps parent unset."""
+    assert merged({"$unset": {"data": True}}, {"$unset": {"data.a": True}}) == {
+        "$unset": {"data": True}
+    }
+
+
+def test_merge_matches_sequential_updates():
+    """Merged update has the same result as updates applied one by one."""
+    updates = [
+        {"$set": {"data": {"a": 1}, "state": "x"}},
+        {"$set": {"data.b": {"c": 2}}},
+        {"$unset": {"data.b.c": True, "state": True}},
+        {"$set": {"edit.field": "price"}},
+    ]
+    expected = {"id": 1, "data": {"old": True}, "edit": {"order_id": 2}}
+    actual = {"id": 1, "data": {"old": True}, "edit": {"order_id": 2}}
+    for update in updates:
+        apply_update(expected, update)
+    apply_update(actual, merged(*updates))
+    assert actual == expected
+
+
+@pytest.mark.parametrize("operator", ["$inc", "$push", "$setOnInsert"])
+def test_merge_rejects_other_operators(operator):
+    """Operators other than ``$set`` and ``$unset`` are not buffered."""
+    buffer = UserUpdateBuffer({"_id": 1, "id": 1})
+    buffer.merge({"$set": {"state": "a"}})
+    with pytest.raises(ValueError):
+        buffer.merge({operator: {"referral_count": 1}})
+    assert buffer.update["$set"] == {"state": "a"}
+
+
+class FakeUsers:
+    """Users collection with bulk writes waiting for ``written`` event."""
+
+    def __init__(self, fail: bool):
+        """Create collection which fails writes if ``fail`` is True."""
+        self.fail = fail
+        self.started = asyncio.Event()
+        self.written = asyncio.Event()
+        self.requests = []
+
+    async def bulk_write(self, requests, ordered=True):
+        """Wait for event and then fail or record ``requests``."""
+        self.started.set()
+        await self.written.wait()
+        if self.fail:
+            raise PyMongoError("database is unavailable")
+        self.requests.extend(requests)
+
+
+class FakeDatabase:
+    """Database with fake users collection."""
+
+    def __init__(self, users: FakeUsers):
+        """Create database with ``users`` collection."""
+        self.users = users
+
+
+@pytest.mark.parametrize("fail", [False, True])
+@pytest.mark.asyncio
+async def test_preferences_are_applied_while_written(monkeypatch, fail):
+    """Preferences being written are applied to documents read meanwhile."""
+    users = FakeUsers(fail)
+    monkeypatch.setattr(database, "database", FakeDatabase(users))
+    buffer = PreferenceBuffer(60)
+    buffer.set(1, "invert_order", True)
+    buffer.set(1, "invert_book", True)
+    flush = asyncio.create_task(buffer.flush())
+    await users.started.wait()
+    buffer.set(1, "invert_book", False)
+    document = {"id": 1}
+    buffer.apply(document)
+    assert document == {"id": 1, "invert_order": True, "invert_book": False}
+    users.written.set()
+    await flush
+    if fail:
+        assert buffer._pending == {1: {"invert_order": True, "invert_book": False}}
+    else:
+        assert len(users.requests) == 1
+        assert buffer._pending == {1: {"invert_book": False}}
@@ -0,0 +1,85 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of geocoding client."""
+import typing
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from src.geocoding import GeocodeCache
+from src.geocoding import Geocoder
+from src.geocoding import GeocodingBackend
+from src.geocoding import GeocodingError
+
+LOCATION = {"display_name": "Moscow", "lat": "55.75", "lon": "37.62"}
+
+
+class FakeBackend(GeocodingBackend):
+    """Backend returning predefined results."""
+
+    def __init__(self, results: typing.List[typing.Dict[str, str]]):
+        """Create backend returning ``results``."""
+        self.results = results
+
+    async def search(self, session, query, language):
+        """Get predefined results."""
+        return self.results
+
+
+class MalformedBackend(GeocodingBackend):
+    """Backend parsing results without expected fields."""
+
+    def __init__(self, results: typing.Any):
+        """Create backend parsing ``results``."""
+        self.results = results
+
+    async def search(self, session, query, language):
+        """Parse results like Nominatim backend."""
+        return [{"display_name": result["display_name"]} for result in self.results]
+
+
+class FailingCache(GeocodeCache):
+    """Cache which can't write to database."""
+
+    def __init__(self):
+        """Create empty cache without collection."""
+        super().__init__(None, 10, 60)
+
+    async def get(self, query, language):
+        """Find nothing."""
+
+    async def set(self, query, language, results):  # noqa: A003
+        """Fail to write results."""
+        raise PyMongoError("database is unavailable")
+
+
+@pytest.mark.asyncio
+async def test_search_ignores_cache_write_errors():
+    """Results are returned if they can't be cached."""
+    geocoder = Geocoder(FakeBackend([LOCATION]), 1, FailingCache())
+    assert await geocoder.search("Moscow", "en") == [LOCATION]
+    await geocoder.close()
+
+
+@pytest.mark.parametrize("results", [[{"lat": "55.75"}], [None], None])
+@pytest.mark.asyncio
+async def test_search_wraps_malformed_results(results):
+    """Errors of parsing malformed results are raised as geocoding errors."""
+    geocoder = Geocoder(MalformedBackend(results), 1)
+    with pytest.raises(GeocodingError):
+        await geocoder.search("Moscow", "en")
+    await geocoder.close()
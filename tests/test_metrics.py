@@ -0,0 +1,69 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of periodic reporting of metrics."""
+import logging
+
+from src.geocoding import geocoder
+from src.log_sink import log_sink
+from src.metrics import MetricsReporter
+from src.send_scheduler import send_scheduler
+
+
+def test_report_logs_send_scheduler_metrics(caplog, monkeypatch):
+    """Backlog and counters of send scheduler are logged."""
+    monkeypatch.setattr(send_scheduler, "sent", 12)
+    monkeypatch.setattr(send_scheduler, "retried", 3)
+    with caplog.at_level(logging.INFO, logger="src.metrics"):
+        MetricsReporter(60).report()
+    assert (
+        "Send scheduler: 0 interactive and 0 bulk messages waiting, "
+        "12 sent, 3 retried after flood control"
+    ) in caplog.messages
+
+
+def test_report_logs_geocoding_cache_hit_rate(caplog, monkeypatch):
+    """Hits and misses of geocoding cache are logged."""
+    monkeypatch.setattr(geocoder.cache.local, "hits", 2)
+    monkeypatch.setattr(geocoder.cache.local, "misses", 2)
+    monkeypatch.setattr(geocoder.cache, "hits", 1)
+    monkeypatch.setattr(geocoder.cache, "misses", 1)
+    with caplog.at_level(logging.INFO, logger="src.metrics"):
+        MetricsReporter(60).report()
+    assert (
+        "Geocoding cache: 75.0% hit rate, 2 in memory, 1 in database, 1 misses"
+    ) in caplog.messages
+
+
+def test_report_warns_about_lost_logs(caplog, monkeypatch):
+    """Logs lost since previous report are reported with warning."""
+    reporter = MetricsReporter(60)
+    monkeypatch.setattr(log_sink, "written", 10)
+    monkeypatch.setattr(log_sink, "dropped", 3)
+    monkeypatch.setattr(log_sink, "failed", 1)
+    with caplog.at_level(logging.INFO, logger="src.metrics"):
+        reporter.report()
+    assert "Log sink: 0 queued, 10 written, 3 dropped, 1 failed" in caplog.messages
+    assert [
+        record.message for record in caplog.records if record.levelname == "WARNING"
+    ] == [
+        "Log sink lost 4 logs since last report: "
+        "3 dropped because queue was full and 1 failed to be inserted"
+    ]
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger="src.metrics"):
+        reporter.report()
+    assert not [record for record in caplog.records if record.levelname == "WARNING"]
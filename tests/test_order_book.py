@@ -0,0 +1,120 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of in-memory order book."""
+from decimal import Decimal
+from time import time
+
+from bson import Decimal128
+from bson import ObjectId
+
+from src.order_book import crosses
+from src.order_book import is_active
+from src.order_book import OrderBook
+
+
+def make_order(sell, buy, price_buy=None, user_id=1, start_time=None):
+    """Create active order selling ``sell`` for ``buy`` at ``price_buy``."""
+    current_time = time()
+    order = {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "sell": sell,
+        "buy": buy,
+        "start_time": current_time if start_time is None else start_time,
+        "expiration_time": current_time + 3600,
+    }
+    if price_buy is not None:
+        order["price_buy"] = Decimal128(price_buy)
+        order["price_sell"] = Decimal128(1 / Decimal(price_buy))
+        order["price_key"] = order["price_buy"]
+    return order
+
+
+def make_book(*orders):
+    """Create loaded book with ``orders``."""
+    book = OrderBook()
+    book.loaded = True
+    for order in orders:
+        book.update(order)
+    return book
+
+
+def test_crosses_when_product_of_buy_prices_is_at_most_one():
+    """Prices cross if product of buy prices doesn't exceed one."""
+    order = make_order("BTC", "USD", "10000")
+    assert crosses(order, make_order("USD", "BTC", "0.0001"))
+    assert crosses(order, make_order("USD", "BTC", "0.00005"))
+    assert not crosses(order, make_order("USD", "BTC", "0.00010001"))
+
+
+def test_crosses_doesnt_round_product():
+    """Prices which cross only after rounding of product don't cross."""
+    order = make_order("A", "B", "3")
+    assert crosses(order, make_order("B", "A", "0.3333333333333333333333333333333333"))
+    assert not crosses(
+        order, make_order("B", "A", "0.3333333333333333333333333333333334")
+    )
+
+
+def test_crossing_returns_crossing_orders_by_price_and_time():
+    """Crossing orders are sorted by price and then from the oldest."""
+    current_time = time()
+    cheap = make_order("USD", "BTC", "0.00005", user_id=2)
+    old = make_order("USD", "BTC", "0.0001", user_id=3, start_time=current_time - 60)
+    new = make_order("USD", "BTC", "0.0001", user_id=4, start_time=current_time)
+    expensive = make_order("USD", "BTC", "0.0002", user_id=5)
+    book = make_book(new, expensive, old, cheap)
+    order = make_order("BTC", "USD", "10000")
+    assert book.crossing(order) == [cheap, old, new]
+
+
+def test_crossing_boundary_found_with_binary_search():
+    """Every order up to the last crossing price is returned."""
+    counters = [
+        make_order("USD", "BTC", str(Decimal(index) / 10**6), user_id=index)
+        for index in range(1, 201)
+    ]
+    book = make_book(*counters)
+    order = make_order("BTC", "USD", "10000", user_id=0)
+    assert book.crossing(order) == counters[:100]
+
+
+def test_crossing_skips_own_unpriced_and_incompatible_orders():
+    """Orders of the same user, without price or with other gateway don't cross."""
+    matching = make_order("X.USD", "BTC", "0.0001", user_id=2)
+    other_gateway = make_order("Y.USD", "BTC", "0.0001", user_id=4)
+    book = make_book(
+        matching,
+        make_order("USD", "BTC", "0.0001", user_id=1),
+        make_order("USD", "BTC", user_id=3),
+        other_gateway,
+    )
+    assert book.crossing(make_order("BTC", "X.USD", "10000")) == [matching]
+    crossing = book.crossing(make_order("BTC", "USD", "10000"))
+    assert {order["_id"] for order in crossing} == {
+        matching["_id"],
+        other_gateway["_id"],
+    }
+    assert book.crossing(make_order("BTC", "USD")) == []
+
+
+def test_is_active_without_expiration_time():
+    """Orders without expiration time aren't active."""
+    order = make_order("USD", "BTC")
+    del order["expiration_time"]
+    assert not is_active(order, time())
+    assert not make_book(order).crossing(make_order("BTC", "USD", "1"))
@@ -0,0 +1,150 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of keyset pagination of order lists."""
+import pymongo
+import pytest
+from bson import ObjectId
+
+from src.config import config
+from src.handlers import base
+from src.handlers.base import decode_anchor
+from src.handlers.base import encode_anchor
+from src.handlers.base import keyset_filter
+from src.handlers.base import orders_page
+from src.handlers.base import OrdersQuery
+from src.handlers.base import page_callback_data
+from src.order_book import AFTER
+from src.order_book import BEFORE
+from src.order_book import FROM
+
+
+def test_anchor_round_trip():
+    """Decoded anchor has the same kind and order ID."""
+    order_id = ObjectId()
+    for kind in (AFTER, BEFORE, FROM):
+        assert decode_anchor(encode_anchor(kind, order_id)) == (kind, order_id)
+
+
+def test_invalid_anchor_is_ignored():
+    """Anchors with unknown kind or malformed ID are decoded to None."""
+    encoded = encode_anchor(AFTER, ObjectId())
+    assert decode_anchor("x" + encoded[1:]) is None
+    assert decode_anchor(encoded[:-2]) is None
+    assert decode_anchor(AFTER + "!!!!") is None
+    assert decode_anchor("") is None
+
+
+def test_anchored_callback_data_fits_limit():
+    """Anchor is added to callback data of order list pages."""
+    anchor = encode_anchor(AFTER, ObjectId())
+    data = page_callback_data("orders", 10, True, anchor)
+    assert data == f"orders 10 1 {anchor}"
+    assert len(data.encode()) <= 64
+
+
+def test_anchor_omitted_if_callback_data_exceeds_limit():
+    """Anchor is dropped if callback data would be longer than 64 bytes."""
+    anchor = encode_anchor(BEFORE, ObjectId())
+    buttons_data = "x" * (64 - len(" 10 0 ") - len(anchor) + 1)
+    assert page_callback_data(buttons_data, 10, False, anchor) == (
+        f"{buttons_data} 10 0"
+    )
+    assert page_callback_data("orders", 0, False) == "orders 0 0"
+
+
+def test_keyset_filter():
+    """Filter selects orders after, before or from anchor in sort order."""
+    orders_query = OrdersQuery(
+        {}, sort=(("price_key", pymongo.ASCENDING), ("_id", pymongo.DESCENDING))
+    )
+    values = {"price_key": 1, "_id": 2}
+    assert keyset_filter(orders_query, values, AFTER) == {
+        "$or": [
+            {"$and": [{"price_key": {"$gt": 1}}]},
+            {"$and": [{"price_key": {"$eq": 1}}, {"_id": {"$lt": 2}}]},
+        ]
+    }
+    assert keyset_filter(orders_query, values, BEFORE) == {
+        "$or": [
+            {"$and": [{"price_key": {"$lt": 1}}]},
+            {"$and": [{"price_key": {"$eq": 1}}, {"_id": {"$gt": 2}}]},
+        ]
+    }
+    assert keyset_filter(orders_query, values, FROM) == {
+        "$or": [
+            {"$and": [{"price_key": {"$gt": 1}}]},
+            {"$and": [{"price_key": {"$eq": 1}}, {"_id": {"$lte": 2}}]},
+        ]
+    }
+
+
+class FakeCursor:
+    """Aggregation cursor returning empty page."""
+
+    async def to_list(self, length):
+        """Get result of aggregation with empty page."""
+        return [{"orders": [], "quantity": []}]
+
+
+class FakeOrders:
+    """Orders collection recording aggregation pipelines."""
+
+    def __init__(self, anchor_order):
+        """Create collection with ``anchor_order``."""
+        self.anchor_order = anchor_order
+        self.pipelines = []
+
+    async def find_one(self, query):
+        """Find anchor order."""
+        return self.anchor_order
+
+    def aggregate(self, pipeline):
+        """Record ``pipeline``."""
+        self.pipelines.append(pipeline)
+        return FakeCursor()
+
+
+class FakeDatabase:
+    """Database with fake orders collection."""
+
+    def __init__(self, orders: FakeOrders):
+        """Create database with ``orders`` collection."""
+        self.orders = orders
+
+
+@pytest.mark.parametrize(
+    "anchor_order, stage",
+    [
+        ({"_id": 1, "price_key": 2}, "$match"),
+        ({"_id": 1}, "$skip"),
+    ],
+)
+@pytest.mark.asyncio
+async def test_orders_page_skips_if_anchor_lacks_sort_fields(
+    monkeypatch, anchor_order, stage
+):
+    """Page is anchored only to order having all fields of sort key."""
+    orders = FakeOrders(anchor_order)
+    monkeypatch.setattr(base, "database", FakeDatabase(orders))
+    monkeypatch.setattr(config, "ORDERS_COUNT", 10, raising=False)
+    orders_query = OrdersQuery(
+        {}, sort=(("price_key", pymongo.ASCENDING), ("_id", pymongo.DESCENDING))
+    )
+    anchor = encode_anchor(AFTER, ObjectId())
+    assert await orders_page(orders_query, 10, anchor) == ([], 0)
+    (pipeline,) = orders.pipelines
+    assert stage in pipeline[-1]["$facet"]["orders"][0]
@@ -0,0 +1,52 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of in-memory index of subscriptions."""
+from src.subscriptions import SubscriptionIndex
+
+
+def make_index(*subscriptions):
+    """Create index with ``(user_id, sell, buy)`` subscriptions."""
+    index = SubscriptionIndex()
+    for user_id, sell, buy in subscriptions:
+        index.add(user_id, {"sell": sell, "buy": buy})
+    return index
+
+
+def test_order_without_gateway_matches_any_gateway():
+    """Order currency without gateway matches subscriptions with gateways."""
+    index = make_index((1, "X.USD", "BTC"), (2, "USD", "BTC"), (3, None, "BTC"))
+    assert index.subscribers("USD", "BTC") == {1, 2, 3}
+
+
+def test_order_with_gateway_matches_only_same_gateway():
+    """Order currency with gateway doesn't match other or no gateway."""
+    index = make_index(
+        (1, "X.USD", "BTC"), (2, "USD", "BTC"), (3, "Y.USD", "BTC"), (4, None, None)
+    )
+    assert index.subscribers("X.USD", "BTC") == {1, 4}
+
+
+def test_remove_prunes_gateways():
+    """Gateways of removed pairs don't match orders anymore."""
+    index = make_index((1, "X.USD", "BTC"), (2, "X.USD", "BTC"), (3, "X.USD", "EUR"))
+    index.remove(1, {"sell": "X.USD", "buy": "BTC"})
+    assert index.subscribers("USD", "BTC") == {2}
+    index.remove(2, {"sell": "X.USD", "buy": "BTC"})
+    assert index.subscribers("USD", "BTC") == set()
+    assert index._gateways == {"USD": {"X.USD": 1}}
+    index.remove(3, {"sell": "X.USD", "buy": "EUR"})
+    assert not index._gateways
@@ -0,0 +1,107 @@
+# Copyright (C) 2019  alfred richardsn
+#
+# This file is part of TellerBot.
+#
+# TellerBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with TellerBot.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests of queue of transactions waiting to be found in blockchain."""
+from time import time
+
+import pytest
+from bson import ObjectId
+
+from src.config import config
+from src.escrow.blockchain import StreamBlockchain
+from src.escrow.blockchain import TransactionQueue
+
+
+def make_member(from_address, memo):
+    """Create queue member of new offer."""
+    return {"offer_id": ObjectId(), "from_address": from_address, "memo": memo}
+
+
+def test_candidates_by_sender_with_exact_memo_first():
+    """Transactions of sender are candidates, ones with the same memo go first."""
+    first = make_member("alice", "memo 1")
+    second = make_member("Alice", "memo 2")
+    other = make_member("bob", "memo 2")
+    queue = TransactionQueue([first, second, other])
+    assert queue.candidates("ALICE", "memo 2") == [second, first]
+    assert queue.candidates("alice", "memo 1") == [first, second]
+    assert queue.candidates("alice", "memo 3") == [first, second]
+    assert queue.candidates("carol", "memo 1") == []
+
+
+def test_remove_by_offer():
+    """Removed transaction is not a candidate and empty buckets are dropped."""
+    member = make_member("alice", "memo")
+    other = make_member("bob", "memo")
+    queue = TransactionQueue([member, other])
+    assert queue.remove(member["offer_id"]) is member
+    assert queue.remove(member["offer_id"]) is None
+    assert queue.candidates("alice", "memo") == []
+    assert list(queue) == [other]
+    assert len(queue) == 1
+    assert queue.remove(other["offer_id"]) is other
+    assert not queue._senders
+    assert not queue._memos
+
+
+def test_add_replaces_transaction_of_same_offer():
+    """Transaction of offer added again is indexed by its new sender and memo."""
+    member = make_member("alice", "memo")
+    queue = TransactionQueue([member])
+    updated = {**member, "from_address": "bob", "memo": "new memo"}
+    queue.add(updated)
+    assert len(queue) == 1
+    assert queue.candidates("alice", "memo") == []
+    assert queue.candidates("bob", "new memo") == [updated]
+
+
+class IdleBlockchain(StreamBlockchain):
+    """Blockchain which never finds transactions."""
+
+    async def connect(self):
+        """Do nothing."""
+
+    async def get_limits(self, asset):
+        """Do nothing."""
+
+    async def transfer(self, to, amount, asset, memo=""):
+        """Do nothing."""
+
+    async def get_last_irreversible_block(self):
+        """Do nothing."""
+
+    async def is_block_confirmed(self, block_num, op):
+        """Do nothing."""
+
+    async def stream(self):
+        """Do nothing."""
+
+
+@pytest.mark.asyncio
+async def test_add_to_queue_cancels_timeout_of_replaced_transaction(monkeypatch):
+    """Timeout of transaction added again for the same offer is cancelled."""
+    monkeypatch.setattr(config, "CHECK_TIMEOUT_HOURS", 24, raising=False)
+    blockchain = IdleBlockchain()
+    member = {**make_member("alice", "memo"), "transaction_time": time()}
+    await blockchain.add_to_queue(**member)
+    (first,) = blockchain._queue
+    await blockchain.add_to_queue(**{**member, "memo": "new memo"})
+    (second,) = blockchain._queue
+    assert second["memo"] == "new memo"
+    assert first["timeout_handler"].cancelled()
+    assert not second["timeout_handler"].cancelled()
+    blockchain.remove_from_queue(member["offer_id"])
+    assert second["timeout_handler"].cancelled()